@@ -12,6 +12,18 @@ __license__                     = "GPLv3 (or later)"
 
 __all__                         = [ 'server' ]
 
-# These modules form the public interface of hpos-admin-server
+import importlib
+
+# These modules form the public interface of hpos-admin-server.  The server (and web.py) is imported
+# only when first used, not by tools that (eg.) just want the __version__.
 from .version  import __version__, __version_info__
-from .server import *
+
+
+def __getattr__( name ):
+    server			= importlib.import_module( ".server", __name__ )
+    if name == 'server':
+        return server
+    try:
+        return getattr( server, name )
+    except AttributeError:
+        raise AttributeError( f"module {__name__!r} has no attribute {name!r}" )
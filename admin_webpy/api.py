@@ -12,12 +12,49 @@ __license__                     = "GPLv3 (or later)"
 import bisect
 import json
 import logging
+import os
 import re
+import time
+
+from .api_util import etag, queries, batcher, unavailable, admission
+from .auth_util import verifier, SIGNATURE_HEADER, TIMESTAMP_HEADER
+from .config_store import config_store
+from .metrics_util import registry
+from .log_util import log_pipeline
+from .nix_util import holoportos, job_queue, rebuild
+from .status_util import probe, prober, harvester, digest, nix_system, zerotier_info
+from .watch_util import notifier
 
 log				= logging.getLogger( "api" )
 
+# The holo-config.json, parsed once and re-validated via os.stat on each access
+holo_config			= config_store( "data/holo-config.json" )
+
+
+def renew_config():
+    """Replace the holo_config w/ a fresh config_store (eg. when the app is reloaded); returns it."""
+    global holo_config
+    holo_config			= holo_config.renew()
+    return holo_config
+
+
+# The desired HoloPortOS state, and the queue of (NixOS rebuild) jobs applying it
+holoportos_state		= holoportos( "data/holoportos.json" )
+holoportos_jobs			= job_queue( rebuild( holoportos_state, command=( "nixos-rebuild", "switch" )))
+
+# The HoloPortOS status probes; all run concurrently, each caching its result (or failure) for a TTL
+status_probes			= prober(
+    probes	= [
+        probe( "channel",	lambda: nix_system( "data/run/current-system" ),	ttl=1.0 ),
+        probe( "current_system",lambda: nix_system( "data/run/booted-system" ),		ttl=1.0 ),
+        probe( "zerotier",	zerotier_info,						ttl=10.0 ),
+    ],
+    deadline	= 0.5,
+)
+
 """
 api.rest -- Adds all available API versions
+api.renew_config -- Replaces the holo_config store w/ a fresh one (eg. when the app is reloaded)
 """
 
 # 
@@ -25,16 +62,42 @@ api.rest -- Adds all available API versions
 # 
 # GET /api/v1/ping
 # GET /api/v1/config
+# PUT/PATCH /api/v1/config
 # GET /api/v1/status
+# GET /api/v1/jobs[/<id>]
+# GET /api/v1/metrics
+# GET /api/v1/watch[?generation=<n>[&timeout=<s>]]
+# POST /api/v1/batch
 # 
 
 def api_ping_v1( version, path, queries, environ, accept, data=None ):
     """Responds to a ping with any body data supplied (to a POST .../ping)"""
     return dict(
-        pong			= data
+        pong			= data.decode( 'utf-8', errors='replace' ) if type( data ) is bytes else data
+    )
+
+
+# Admin requests' signatures are verified w/ the holo-config.json admin public_key (decoded once)
+request_verifier		= verifier( lambda: holo_config.admin().get( 'public_key' ), window=300 )
+
+
+def api_auth_v1( version, path, queries, environ, accept, data=None ):
+    """Responds (200) if the admin request is validly signed, or with 401 Unauthorized; eg. for nginx
+    auth_request.  The request's method and URI are from the X-Original-Method: and X-Original-URI:
+    headers (supplied by nginx), or else are this request's own.  Its X-Hpos-Admin-Signature: (over
+    "<METHOD> <URI> <timestamp>") must be by the admin's key, and its X-Hpos-Admin-Timestamp: recent.
+    """
+    request_verifier.verify(
+        environ.get( 'HTTP_X_ORIGINAL_METHOD' ) or environ.get( 'REQUEST_METHOD', "GET" ),
+        environ.get( 'HTTP_X_ORIGINAL_URI' ) or environ.get( 'REQUEST_URI', "" ),
+        environ.get( 'HTTP_' + SIGNATURE_HEADER.upper().replace( '-', '_' )),
+        environ.get( 'HTTP_' + TIMESTAMP_HEADER.upper().replace( '-', '_' )))
+    return dict(
+        verified		= True,
     )
 
 
+@etag( lambda path, queries: ( holo_config.digest(), holoportos_state.digest() ))
 def api_config_v1( version, path, queries, environ, accept, data=None ):
     """Responds with the current HoloPortOS config, if successful.
 
@@ -51,6 +114,8 @@ def api_config_v1( version, path, queries, environ, accept, data=None ):
     re-written in-place, as the last step in PUT/PATCH API call.  We cannot use an atomic move
     operation (because the file may be supplied via symbolic link), but since the contents of
     `holo-config.json` is used only on boot-up, we are unlikely to encounter race-conditions.
+    Updates are applied immediately to the in-memory config (and returned, w/ its new `version`);
+    a burst of updates is coalesced into a single write (and fsync) of the file.
 
 
     The `name` field is simply stored, as a string, as a property in the topmost level of the JSON
@@ -62,20 +127,69 @@ def api_config_v1( version, path, queries, environ, accept, data=None ):
     changed via PUT or PATCH.
 
     If a value is changed, a Nix operation is launched to alter this state in the NixOS operating
-    system.
+    system.  This runs asynchronously; the response includes the `job` ID (see `jobs/<id>`).
 
 
     Once successful, the current system `api/v#/config` status is re-harvested and returned; the
     results of the successful GET, PUT and PATCH are `200 OK`, and a body payload containing the
     current config of the system.
     """
-    with open( "data/holo-config.json" ) as f:
-        config			= json.loads( f.read() )
+    method			= environ.get( 'REQUEST_METHOD', 'GET' ) if environ else 'GET'
+    if method in ( 'PUT', 'PATCH' ):
+        update			= json.loads( data or 'null' )
+        if type( update ) is not dict or not update or set( update ) - { 'admin', 'holoportos' }:
+            raise ValueError( f"Invalid config {method}; requires only admin and/or holoportos objects" )
+        # Validate every part of the update before applying any of it; a rejected request changes nothing
+        replace			= ( method == 'PUT' )
+        if 'holoportos' in update:
+            holoportos_state.validate( update['holoportos'], replace=replace )
+        if 'admin' in update:
+            holo_config.validate( update['admin'], replace=replace )
+        results			= {}
+        if 'holoportos' in update:
+            state,changed	= holoportos_state.update( update['holoportos'], replace=replace )
+            if changed:
+                results['job']	= holoportos_jobs.submit( "holoportos", state ).ident
+        if 'admin' in update:
+            results['version'],_ = holo_config.update( update['admin'], replace=replace )
+        return dict(
+            results,
+            admin		= holo_config.admin(),
+            holoportos		= holoportos_state.state(),
+        )
     return dict(
-        admin			= config['v1']['admin']
+        admin			= holo_config.admin(),
+        holoportos		= holoportos_state.state(),
     )
 
 
+def api_jobs_v1( version, path, queries, environ, accept, data=None ):
+    """Responds with the HoloPortOS (NixOS rebuild) jobs launched by config changes.
+
+    `jobs`: A list of the most recent jobs, oldest first (excluding their output).
+
+    `jobs/<id>`: The job w/ the given ID, including the last lines of its `output`.  Its `status` is
+    "queued", "running", "succeeded" or "failed".  While queued, a job may be superseded by further
+    changes, increasing its number of `requests`; it then applies the latest state.
+    """
+    _,_,ident			= path.partition( '/' )
+    if not ident:
+        return [ j.report( output=False ) for j in holoportos_jobs.jobs() ]
+    try:
+        return holoportos_jobs.get( int( ident )).report()
+    except ( KeyError, ValueError ):
+        raise KeyError( f"Unknown job: {ident}" )
+
+
+def status_etag( path, queries ):
+    """Only a harvested status snapshot has a known version (the digest of its content, so unchanged
+    across harvests finding the same status); otherwise, the status is always fresh."""
+    latest			= status_harvester.snapshot
+    if status_harvester.running and latest and latest.harvested_at:
+        return latest.digest
+
+
+@etag( status_etag )
 def api_status_v1( version, path, queries, environ, accept, data=None ):
     """The `holo_nixpkgs` object contains:
 
@@ -85,20 +199,236 @@ def api_status_v1( version, path, queries, environ, accept, data=None ):
     This commit hash is parsed from the symbolic link: `./data/run/current-system ->
     /nix/store/sakdkx4rabp5a0fk16c4r8sjbhv751hp-nixos-system-holoportos-19.09pre-git`
 
-    `current_system.rev`: Parsed from `./data/booted-system` symbolic link.
+    `current_system.rev`: Parsed from `./data/run/booted-system` symbolic link.
 
     `zerotier`: From `zerotier-cli -j info`
+
+    All probes are run concurrently, and each result is cached for a (probe-specific) TTL.  Any
+    probe not completed within the deadline continues in the background, and its last value (if
+    any) is returned.  The `probes` object reports each probe's freshness: its `age` (in seconds;
+    null if never completed), whether it is `stale` and/or `pending`, and its last `error`.
+
+    If the background `status_harvester` is running, the latest snapshot of the status is
+    returned immediately (never waiting on the probes), including the time it was `harvested_at`
+    and its `staleness` (in seconds).
+    """
+    latest			= status_harvester.snapshot
+    if status_harvester.running and latest:
+        return dict(
+            latest.status,
+            harvested_at	= latest.harvested_at,
+            staleness		= None if latest.harvested_at is None else time.time() - latest.harvested_at,
+        )
+    return status_report( status_probes.harvest() )
+
+
+def status_report( harvest ):
+    """Compute the status from a harvest of the status_probes."""
+    return dict(
+        holo_nixpkgs		= dict(
+            channel		= harvest['channel'][0],
+            current_system	= harvest['current_system'][0],
+        ),
+        zerotier		= harvest['zerotier'][0],
+        probes			= { name: report for name,(_,report) in harvest.items() },
+    )
+
+
+def status_digest( status ):
+    """The digest of a status' content; excludes each probe's age, which changes on every harvest."""
+    return digest( dict( status, probes = {
+        name: { k: v for k,v in report.items() if k != 'age' }
+        for name,report in status['probes'].items()
+    }))
+
+
+# The optional background status harvester; started (w/ the desired interval) by the server
+status_harvester		= harvester(
+    status_probes, report=status_report, interval=5.0, watch=( "data/run", ), digest=status_digest )
+
+
+def watch_signature():
+    """The versions of the config, and the data/run symlinks (the status)."""
+    links			= []
+    for name in ( "current-system", "booted-system" ):
+        try:
+            links.append( os.readlink( os.path.join( "data/run", name )))
+        except OSError:
+            links.append( None )
+    return dict(
+        config			= ( holo_config.digest(), holoportos_state.digest() ),
+        status			= tuple( links ),
+    )
+
+
+def watch_event( changed ):
+    """The event published (once) to all watchers, for each change."""
+    latest			= status_harvester.snapshot
+    return dict(
+        changed			= changed,
+        config			= dict(
+            admin		= holo_config.admin(),
+            holoportos		= holoportos_state.state(),
+        ),
+        status			= latest.status if status_harvester.running and latest
+                                  else status_report( status_probes.harvest() ),
+    )
+
+
+# Changes to the holo-config.json (or holoportos.json) and the data/run symlinks are published to
+# all watchers; the number of watchers waiting at once is limited (each occupies a server thread).
+watch_notifier			= notifier(
+    paths	= ( "data", "data/holo-config.json", "data/run" ),
+    signature	= watch_signature,
+    publish	= watch_event,
+    interval	= 1.0,
+    limit	= 5,
+)
+watch_timeout			= 25.0	# The longest a long-poll waits, and SSE heartbeat interval
+
+
+@queries( 'generation', 'timeout' )
+def api_watch_v1( version, path, queries, environ, accept, data=None ):
+    """Responds when the config (holo-config.json) or status (the data/run symlinks) change.
+
+    Requested as text/event-stream (eg. by a browser EventSource), a stream of Server-Sent Events is
+    returned: the current `change` event (or, if reconnecting w/ a Last-Event-ID:, the next one),
+    and each subsequent change, w/ its generation as its `id`; a comment is sent every 25s to keep
+    the connection alive.
+
+    Otherwise, a long-poll: `watch?generation=<n>` waits (up to `timeout` seconds; at most 25s) for a
+    change newer than generation `n`, returning the latest; w/o a generation, the latest is returned
+    immediately.  The result contains the `generation`, the names of the `changed` resources
+    ("config", "status"), and the current `config` (as GET config) and `status` (as GET status).
+
+    Each watcher occupies a server thread (blocked, not busy) and a slot in the shared lane while
+    waiting, so the number of idle watchers is bounded by the threads; if too many are waiting,
+    responds 503 Service Unavailable.  A watcher whose client closes its connection is released at
+    once (not when next a change or keep-alive is written).
+    """
+    streaming			= accept == "text/event-stream"
+    last			= environ.get( 'HTTP_LAST_EVENT_ID' ) if streaming else queries.get( 'generation' )
+    try:
+        generation		= None if last in ( None, "" ) else int( last )
+        timeout			= min( watch_timeout, float( queries.get( 'timeout', watch_timeout )))
+    except ValueError:
+        raise ValueError( f"Invalid watch generation {last!r} or timeout" )
+    peer			= environ.get( 'hpos_admin.peer' )
+    if generation is not None or streaming:
+        if not watch_notifier.admit():
+            raise unavailable( f"Too many watchers (at most {watch_notifier.limit})", retry=int( timeout ))
+    else:
+        generation,event	= watch_notifier.wait()
+        return dict( event, generation = generation )
+    if not streaming:
+        try:
+            generation,event	= watch_notifier.wait( generation, timeout, peer=peer )
+        except ConnectionAbortedError:
+            generation,event	= watch_notifier.wait()	# The client has gone; no one awaits it
+        finally:
+            watch_notifier.leave()
+        return dict( event, generation = generation )
+
+    def events( generation ):
+        try:
+            yield "retry: 3000\n\n"	# Reconnect after 3s, if disconnected
+            while True:
+                try:
+                    current,event = watch_notifier.wait( generation, watch_timeout, peer=peer )
+                except ConnectionAbortedError as exc:
+                    log.info( "Watch ended: %s", exc )
+                    return
+                if current == generation:
+                    yield ": keep-alive\n\n"
+                    continue
+                generation	= current
+                yield f"id: {generation}\nevent: change\ndata: {json.dumps( dict( event, generation = generation ), sort_keys=True )}\n\n"
+        finally:
+            watch_notifier.leave()
+    return events( -1 if generation is None else generation )
+
+
+def api_metrics_v1( version, path, queries, environ, accept, data=None ):
+    """Responds with the server's request metrics: the `request` latency histograms by `version`,
+    `path`, `accept` and `status`; the `endpoint`, `serialize` (JSON) and `render` (HTML) stage
+    latency histograms, and the `inflight` request gauges, by `version` and `path`.  Requested as
+    text/plain (eg. by Prometheus), these are returned in the Prometheus text exposition format.
+    Also, the `logging` queue's `depth` and the number of log records `dropped` (when it was full),
+    and the `admission` control's limits and `running`, `waiting` and `rejected` requests by `path`.
+    """
+    logged			= log_pipeline.report()
+    admitted			= route_admission.report()
+    if accept == "text/plain":
+        namespace		= registry.namespace
+        lines			= [
+            f"# TYPE {namespace}_log_queue_depth gauge",
+            f"{namespace}_log_queue_depth {logged['depth']}",
+            f"# TYPE {namespace}_log_dropped_total counter",
+            f"{namespace}_log_dropped_total {logged['dropped']}",
+        ]
+        for metric,kind in ( ( "running", "gauge" ), ( "waiting", "gauge" ), ( "admitted", "counter" ),
+                             ( "rejected", "counter" )):
+            full		= f"{namespace}_admission_{metric}{'_total' if kind == 'counter' else ''}"
+            lines.append( f"# TYPE {full} {kind}" )
+            for name,counts in admitted['endpoints'].items():
+                lines.append( f'{full}{{path="{name}",lane="{counts["lane"]}"}} {counts[metric]}' )
+        return registry.prometheus() + "\n".join( lines ) + "\n"
+    return dict( registry.report(), logging=logged, admission=admitted )
+
+
+# The requests of each endpoint running (and waiting) at once are limited, and the requests of all
+# endpoints but the reserved (ping, metrics) are limited to leave threads free for them (see main)
+route_admission			= admission(
+    limits	= dict(
+        status		= ( 2, 2 ),	# (running, waiting); probes may be slow
+        config		= ( 2, 4 ),	# PUT/PATCH write holo-config.json, and queue a NixOS rebuild
+    ),
+    reserved	= ( "ping", "metrics" ),
+    wait	= 0.5,
+)
+
+# The batches of API calls are run concurrently, w/ a bounded fan-out and a deadline; each call is
+# admitted under its own endpoint's limits
+batch_runner			= batcher( fanout=8, deadline=2.0, limit=32, admission=route_admission )
+
+# The register of all APIs (set by rest), for batches of API calls not served by a generation of the
+# app (whose own register is used, otherwise)
+registered			= None
+
+
+def api_batch_v1( version, path, queries, environ, accept, data=None ):
+    """Runs a batch of API calls concurrently, and responds w/ each call's results, in order.
+
+    The body of the POST is a list of calls; each an object w/ a `path` (relative to the API version,
+    eg. "config" or "jobs/3"), an optional `method` ("GET" (default), "POST", "PUT" or "PATCH") and
+    an optional `body` (any JSON value; the call's body data).  Each call's result contains its
+    `path`, `method` and `status` (eg. 200, or 400, 401, 404, 500), and its `results` (or error
+    `message`).  A call refused by its endpoint's admission limits (or otherwise unavailable) has
+    status 503 (and the `retry` seconds).  Any call not completed within the batch deadline has status 504.
     """
+    method			= environ.get( 'REQUEST_METHOD', 'GET' ) if environ else 'GET'
+    if method != 'POST':
+        raise ValueError( "Invalid batch; requires a POST of a list of {path, method, body} calls" )
+    apis			= getattr( ( environ or {} ).get( 'hpos_admin.generation' ), 'apis', None ) or registered
+    _,api			= apis.get( version )
+    return batch_runner.run( api, version, json.loads( data or 'null' ), environ )
 
 
 def rest( apis ):
     """Add all available APIs at their API version tuples"""
+    global registered
+    registered			= apis
     apis.add(
         version_tuple	= (1,0,0),
         api		= dict(
             ping		= api_ping_v1,
+            auth		= api_auth_v1,
             config		= api_config_v1,
             status		= api_status_v1,
+            jobs		= api_jobs_v1,
+            metrics		= api_metrics_v1,
+            batch		= api_batch_v1,
+            watch		= api_watch_v1,
         )
     )
 
@@ -10,32 +10,221 @@ __copyright__                   = "Copyright (c) 2019 Holo Ltd."
 __license__                     = "GPLv3 (or later)"
 
 import bisect
+import concurrent.futures
 import json
 import logging
 import re
+import threading
+import time
+import types
 
 log				= logging.getLogger( "api_util" )
 
 """ 
 api_util.register -- Class to manage the set of historically supported API version numbers.
   .add    -- Register an API dict w/ the given version number
-  .get    -- Parse version, return best ((<version>, {api})
+  .freeze -- Complete registration; build the immutable, pre-sorted version index
+  .get    -- Parse version, return best ((<version>, {api}); memoized by raw version string
   .parse  -- Parse a version number, eg 'v1' --> (1,None,None) tuple
   .search -- Retrieve an API (9<version>), {'name': func, ...}) dict matching version tuple
+
+api_util.etag -- Decorate an API endpoint w/ a function returning the current version of its data
+
+api_util.queries -- Decorate an API endpoint w/ the names of the URL queries it accepts
+
+api_util.unavailable -- Raised when a request cannot presently be served (503, w/ a Retry-After)
+
+api_util.unauthorized -- Raised when a request's authentication is missing or invalid (401)
+
+api_util.admission -- Per-endpoint concurrency limits and bounded wait queues, w/ a reserved lane
+  .admit  -- Admit a request for an endpoint (waiting, if queued); raises unavailable if overloaded
+  .leave  -- Release a request's admission
+  .report -- Each endpoint's lane, limit, queue and its running, waiting, admitted, rejected counts
+
+api_util.batcher -- Run a batch of API calls concurrently, w/ a bounded fan-out and a deadline
+  .run    -- Run a list of {path, method, body} calls; returns their ordered [{status, results}, ...]
 """
 
 
+def etag( source ):
+    """The source( path=..., queries=... ) function returns a token identifying the current version
+    of the endpoint's data (eg. a content hash, or snapshot generation), or None if it is unknown.
+    A GET w/ a matching If-None-Match: ETag (computed from the token) may then be answered with 304
+    Not Modified, without computing (or serializing) the endpoint's results.
+
+    """
+    def decorate( endpoint ):
+        endpoint.etag		= source
+        return endpoint
+    return decorate
+
+
+def queries( *names ):
+    """An endpoint accepts only the named URL queries; any others are refused."""
+    def decorate( endpoint ):
+        endpoint.queries	= names
+        return endpoint
+    return decorate
+
+
+class unavailable( Exception ):
+    """An endpoint cannot presently serve the request (eg. too many are waiting); the server responds
+    503 Service Unavailable, w/ a Retry-After: of retry seconds."""
+    def __init__( self, message, retry=1 ):
+        super( unavailable, self ).__init__( message )
+        self.retry		= retry
+
+
+class unauthorized( Exception ):
+    """A request's authentication (eg. its signature) is missing or invalid; the server responds 401
+    Unauthorized."""
+
+
+class admission:
+    """Limit the requests of each endpoint running at once (to its limit), and the requests waiting
+    for it (to its queue, for up to wait seconds).  All requests of the shared lane (every endpoint
+    not reserved) occupying a server thread (running, or waiting) are limited to shared, so that
+    reserved endpoints (eg. health checks) always find a free thread.  A request exceeding any
+    limit is refused immediately (or when its wait expires) w/ unavailable (503, w/ Retry-After).
+    A request not occupying a server thread (eg. a call of a batch, run in the batcher's threads) is
+    limited only by its endpoint's limit and queue.
+
+    """
+    def __init__( self, limits=None, reserved=( "ping", "metrics" ), shared=None, wait=0.5, retry=1 ):
+        self.limits		= dict( limits or {} )	# endpoint --> (limit, queue)
+        self.reserved		= set( reserved )
+        self.shared		= shared	# The most shared lane requests at once (if any)
+        self.wait		= wait
+        self.retry		= retry
+        self.occupied		= 0		# The shared lane requests running or waiting
+        self._lock		= threading.Lock()
+        self._endpoints		= {}		# endpoint --> its counts, and Condition (on _lock)
+
+    def _endpoint( self, name ):
+        counts			= self._endpoints.get( name )
+        if counts is None:
+            counts		= self._endpoints[name] = dict(
+                running = 0, waiting = 0, admitted = 0, rejected = 0,
+                available = threading.Condition( self._lock ))
+        return counts
+
+    def describe( self, name ):
+        """The endpoint's lane, and its limit and queue (None, if unlimited)."""
+        limit,queue		= self.limits.get( name, ( None, None ))
+        return dict(
+            lane		= "reserved" if name in self.reserved else "shared",
+            limit		= limit,
+            queue		= queue,
+        )
+
+    def refuse( self, counts, message ):
+        counts['rejected']     += 1
+        raise unavailable( message, retry=self.retry )
+
+    def admit( self, name, occupies=True ):
+        with self._lock:
+            counts		= self._endpoint( name )
+            if name in self.reserved:
+                counts['running'] += 1
+                counts['admitted'] += 1
+                return
+            if occupies and self.shared is not None and self.occupied >= self.shared:
+                self.refuse( counts, f"Server busy; {self.occupied} requests in progress" )
+            limit,queue		= self.limits.get( name, ( None, 0 ))
+            if limit is not None and counts['running'] >= limit:
+                if counts['waiting'] >= ( queue or 0 ):
+                    self.refuse( counts, f"Endpoint {name} busy; {counts['running']} running, {counts['waiting']} waiting" )
+                counts['waiting'] += 1
+                self.occupied  += occupies
+                try:
+                    deadline	= time.monotonic() + self.wait
+                    while counts['running'] >= limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.refuse( counts, f"Endpoint {name} busy; waited {self.wait}s" )
+                        counts['available'].wait( remaining )
+                finally:
+                    counts['waiting'] -= 1
+                    self.occupied -= occupies
+            counts['running']  += 1
+            counts['admitted'] += 1
+            self.occupied      += occupies
+
+    def leave( self, name, occupies=True ):
+        with self._lock:
+            counts		= self._endpoints[name]
+            counts['running']  -= 1
+            if name not in self.reserved:
+                self.occupied  -= occupies
+                counts['available'].notify()
+
+    def report( self ):
+        with self._lock:
+            for name in set( self.limits ) | self.reserved:
+                self._endpoint( name )
+            return dict(
+                shared		= self.shared,
+                occupied	= self.occupied,
+                wait		= self.wait,
+                endpoints	= {
+                    name: dict( self.describe( name ),
+                                **{ k: v for k,v in counts.items() if k != 'available' } )
+                    for name,counts in sorted( self._endpoints.items() )
+                },
+            )
+
+
 class register:
-    def __init__( self ):
+    version_re			= re.compile(
+        r"[vV]?(?P<major>\d+)(?:\.(?P<minor>\d+)(?:\.(?P<patch>\d+))?)?"
+    )
+
+    def __init__( self, memo_limit=1024 ):
         self._endpoint		= {} # Register all version (1,2,3) API enpoint dicts here
+        self._versions		= None # Once frozen, the pre-sorted tuple of all version tuples
+        self._memo		= {} # Raw version string --> (<version>,{api}), or failure message
+        self._memo_limit	= memo_limit
+        self._memo_lock		= threading.Lock() # Serializes memo insertion and eviction
 
     def add( self, version_tuple, api ):
+        assert self._versions is None, \
+            f"Cannot register API version {version_tuple}; registration is frozen"
         self._endpoint[version_tuple] = api
 
+    def freeze( self ):
+        """Complete registration.  The set of versions is sorted once, here, instead of on every
+        search.  Implicitly performed on the first .get/.search, if not done explicitly.
+
+        """
+        if self._versions is None:
+            self._endpoint	= types.MappingProxyType( dict( self._endpoint ))
+            self._versions	= tuple( sorted( self._endpoint ))
+        return self
+
+    @property
+    def versions( self ):
+        """All registered API version tuples, in ascending order."""
+        return self.freeze()._versions
+
     def get( self, version ):
-        """Find the nearest viable ((<version>,{api}) pair."""
-        version_tuple		= self.parse( version )
-        return self.search( version_tuple )
+        """Find the nearest viable ((<version>,{api}) pair.  Results (including failures) are
+        memoized by the raw version string; the memo is bounded, evicting its oldest entries.  Only
+        a miss takes the lock (a concurrent insertion could break the iteration finding the oldest).
+
+        """
+        found			= self._memo.get( version )
+        if found is None:
+            try:
+                found		= self.search( self.parse( version ))
+            except AssertionError as exc:
+                found		= str( exc )
+            with self._memo_lock:
+                if len( self._memo ) >= self._memo_limit:
+                    self._memo.pop( next( iter( self._memo ), None ), None )
+                self._memo[version] = found
+        if type( found ) is str:
+            raise AssertionError( found )
+        return found
 
     def parse( self, version ):
         """Canonicalize a "v#.#.#" version string into a 3-tuple.  The re.match returns None for
@@ -43,10 +232,7 @@ class register:
         (<version_tuple>, (<api_version>,<api_dict>)), or raises an Exception.
 
         """
-        version_match		= re.match(
-            r"[vV]?(?P<major>\d+)(?:\.(?P<minor>\d+)(?:\.(?P<patch>\d+))?)?",
-            version
-        )
+        version_match		= self.version_re.match( version )
         assert version_match, \
             f"Invalid API version: {version}"
         version_tuple		= tuple(
@@ -64,7 +250,7 @@ class register:
         v1.3.7 and v1.3.0 are available, then the v1.3.7 API will be used.
 
         """
-        apis			= sorted(self._endpoint)
+        apis			= self.versions
         try:
             inexact_index	= version_tuple.index(None)
             assert inexact_index > 0, \
@@ -75,7 +261,7 @@ class register:
             assert 0 < look_below <= len(apis) \
               and apis[look_below-1] == version_tuple, \
                 f"Unsupported API version: {version_tuple}; not found in {apis}"
-            log.debug(f"Found API exact eq {version_tuple}, below index {look_below} in {apis}")
+            log.debug("Found API exact eq %r, below index %d in %r", version_tuple, look_below, apis)
         else:
             # Inexact version_tuple containing None; increment next larger version number, return
             # available API below that.  Eg. convert (2,3,None) to (2,4,0)
@@ -88,8 +274,107 @@ class register:
             assert 0 < look_below <= len(apis) \
               and apis[look_below-1][:inexact_index] == version_tuple[:inexact_index], \
                 f"Unsupported API version: {version_tuple}; not found in {apis}"
-            log.debug(f"Found API close to {version_tuple}, below index {look_below} in {apis} (w/ {next_above})")
+            log.debug("Found API close to %r, below index %d in %r (w/ %r)", version_tuple, look_below, apis, next_above)
     
         # Ensure at least one API was below, and that the one found matches the exact version prefixes
         api_version		= apis[look_below-1]
         return api_version,self._endpoint[api_version]
+
+
+class batcher:
+    """Runs the calls of each batch concurrently, in a shared pool of at most fanout threads.  A batch
+    may contain at most limit calls; any not completed within the deadline are reported w/ status
+    504 (and run to completion in the background, if already started).  The calls of a batch are
+    not ordered w/ respect to each other; dependent calls (eg. a PATCH, and a GET expecting its
+    results) must be made in separate batches.  Each call is admitted under its own endpoint's
+    limits (if an admission is supplied); a call refused is reported w/ status 503 (and its retry).
+
+    """
+    methods			= ( "GET", "POST", "PUT", "PATCH" )
+
+    def __init__( self, fanout=8, deadline=2.0, limit=32, admission=None ):
+        self.fanout		= fanout
+        self.deadline		= deadline
+        self.limit		= limit
+        self.admission		= admission
+        self._lock		= threading.Lock()
+        self._executor		= None
+
+    def executor( self ):
+        with self._lock:
+            if self._executor is None:
+                self._executor	= concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.fanout, thread_name_prefix="batch" )
+            return self._executor
+
+    def validate( self, calls ):
+        if type( calls ) is not list or not calls:
+            raise ValueError( "Invalid batch; requires a list of {path, method, body} calls" )
+        if len( calls ) > self.limit:
+            raise ValueError( f"Invalid batch of {len( calls )} calls; at most {self.limit} allowed" )
+        for call in calls:
+            if type( call ) is not dict or type( call.get( 'path' )) is not str \
+               or set( call ) - { 'path', 'method', 'body' }:
+                raise ValueError( f"Invalid batch call: {call!r}; requires a path, and optional method and body" )
+            if call.get( 'method', 'GET' ) not in self.methods:
+                raise ValueError( f"Invalid batch call method: {call['method']!r}; must be one of {', '.join( self.methods )}" )
+
+    def call( self, api, version, path, method, body, environ ):
+        """Call the API endpoint serving path; returns the call's {status, results} (or message).  Its
+    failures are reported w/ the status the server responds with to a request failing the same way
+    (eg. unauthorized 401, unavailable 503 w/ its retry)."""
+        endpoint		= path.split( '/', 1 )[0]
+        if endpoint not in api or endpoint == "batch":
+            return dict( status = 400, message = f"Unrecognized path: {path}" )
+        if self.admission:
+            try:
+                self.admission.admit( endpoint, occupies=False )
+            except unavailable as exc:
+                return dict( status = 503, message = str( exc ), retry = exc.retry )
+        try:
+            results		= api[endpoint](
+                version	= version,
+                path	= path,
+                queries	= {},
+                environ	= dict( environ, REQUEST_METHOD=method ),
+                accept	= "application/json",
+                data	= None if body is None else json.dumps( body ))
+            return dict( status = 200, results = results )
+        except unavailable as exc:
+            return dict( status = 503, message = str( exc ), retry = exc.retry )
+        except unauthorized as exc:
+            return dict( status = 401, message = str( exc ))
+        except KeyError as exc:
+            return dict( status = 404, message = exc.args[0] if exc.args else str( exc ))
+        except ValueError as exc:
+            return dict( status = 400, message = str( exc ))
+        except Exception as exc:
+            log.warning( "Batch call %s %s failed: %s", method, path, exc )
+            return dict( status = 500, message = str( exc ))
+        finally:
+            if self.admission:
+                self.admission.leave( endpoint, occupies=False )
+
+    def run( self, api, version, calls, environ ):
+        """Run the calls, against the (already resolved) API version.  Raises ValueError if the batch
+        is invalid.  Returns a list of each call's {path, method, status, results (or message)}.
+
+        """
+        self.validate( calls )
+        executor		= self.executor()
+        futures			= []
+        for call in calls:
+            path		= call['path'].strip( '/' )
+            method		= call.get( 'method', 'GET' )
+            futures.append( ( path, method, executor.submit(
+                self.call, api, version, path, method, call.get( 'body' ), environ )))
+        concurrent.futures.wait( [ f for _,_,f in futures ], timeout=self.deadline )
+        results			= []
+        for path,method,future in futures:
+            if future.done():
+                result		= future.result()
+            else:
+                future.cancel()
+                result		= dict( status = 504, message = f"Not completed within {self.deadline}s" )
+            results.append( dict( result, path = path, method = method ))
+        return results
@@ -0,0 +1,165 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import base64
+import collections
+import logging
+import os
+import threading
+import time
+
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from cryptography.exceptions import InvalidSignature
+
+from .api_util import unauthorized
+
+log				= logging.getLogger( "auth_util" )
+
+"""
+auth_util.verifier -- Verify Ed25519-signed admin requests (eg. for nginx auth_request), w/ caching
+  .key    -- The decoded admin public key; decoded again only when the configured key changes
+  .verify -- Verify a request's signature; raises unauthorized if invalid (or outside the window)
+
+auth_util.keypair -- Generate a (seed, public_key) pair, base64 encoded; eg. for testing
+auth_util.signed  -- The headers signing a request (method, URI) w/ a seed; eg. for clients, testing
+
+A request is signed by the admin's private key over "<METHOD> <URI> <timestamp>"; the base64
+signature is supplied in the X-Hpos-Admin-Signature: header, and the UNIX timestamp in
+X-Hpos-Admin-Timestamp:.  A request is accepted only within window seconds of its timestamp, and
+each (recently) verified request is remembered 'til then, so repeated verifications of the same
+request (eg. by nginx auth_request subrequests) cost only a dict lookup.  Signatures are verified
+by the `cryptography` package.
+
+The request body is NOT signed (nginx auth_request subrequests do not carry it), so a captured signed
+PUT/PATCH could be replayed w/ a different body to the same URI, 'til its timestamp leaves the window.
+Deploy only behind TLS, and keep the window short.
+"""
+
+SIGNATURE_HEADER		= "X-Hpos-Admin-Signature"
+TIMESTAMP_HEADER		= "X-Hpos-Admin-Timestamp"
+
+
+#
+# Keys, signing and verification
+#
+def decode( text ):
+    """Decode base64 (standard or URL-safe; padding optional)."""
+    text			= text.strip().replace( '-', '+' ).replace( '_', '/' )
+    return base64.b64decode( text + "=" * ( -len( text ) % 4 ), validate=True )
+
+
+def encode( raw ):
+    """Encode base64 w/o padding, as holo-config.json's public_key."""
+    return base64.b64encode( raw ).decode( 'ascii' ).rstrip( '=' )
+
+
+def public_key( raw ):
+    """A verify( signature, message ) function for the 32-byte Ed25519 public key."""
+    if len( raw ) != 32:
+        raise ValueError( "Invalid Ed25519 public key; must be 32 bytes" )
+    key				= Ed25519PublicKey.from_public_bytes( raw )
+    def verify( signature, message ):
+        try:
+            key.verify( signature, message )
+            return True
+        except InvalidSignature:
+            return False
+    return verify
+
+
+def keypair( seed=None ):
+    """A (seed, public_key) pair, base64 encoded; w/ a random seed, if none is supplied."""
+    seed			= seed or os.urandom( 32 )
+    public			= Ed25519PrivateKey.from_private_bytes( seed ).public_key().public_bytes(
+        Encoding.Raw, PublicFormat.Raw )
+    return encode( seed ),encode( public )
+
+
+def message( method, uri, timestamp ):
+    return f"{method.upper()} {uri} {timestamp}".encode( 'utf-8' )
+
+
+def signed( seed, method, uri, timestamp=None ):
+    """The headers signing the request (method, URI) w/ the base64 seed, at timestamp (default: now)."""
+    raw				= decode( seed )
+    timestamp			= str( int( time.time() if timestamp is None else timestamp ))
+    data			= message( method, uri, timestamp )
+    signature			= Ed25519PrivateKey.from_private_bytes( raw ).sign( data )
+    return {
+        SIGNATURE_HEADER:	encode( signature ),
+        TIMESTAMP_HEADER:	timestamp,
+    }
+
+
+class verifier:
+    def __init__( self, source, window=300, entries=10000 ):
+        self.source		= source	# Returns the current base64 admin public key (or None)
+        self.window		= window	# Seconds (either side) of a request's timestamp it is valid
+        self.entries		= entries	# The most verified requests remembered
+        self._lock		= threading.Lock()
+        self._encoded		= None		# The base64 public key last decoded,
+        self._key		= None		#   and its verify function
+        self._verified		= collections.OrderedDict() # (signature, message) --> timestamp
+        self.verifications	= 0		# Signatures actually verified (not found remembered)
+
+    def key( self ):
+        """The verify function of the current admin public key.  A changed key is decoded (once), and
+        forgets all requests verified w/ the prior key."""
+        encoded			= self.source()
+        if not encoded:
+            raise unauthorized( "No admin public key is configured" )
+        if encoded != self._encoded:
+            with self._lock:
+                if encoded != self._encoded:
+                    try:
+                        self._key	= public_key( decode( encoded ))
+                    except ValueError as exc:
+                        self._encoded,self._key = None,None
+                        raise unauthorized( f"Invalid admin public key: {exc}" )
+                    self._encoded	= encoded
+                    self._verified.clear()
+                    log.info( "Admin public key %s", encoded )
+        return self._key
+
+    def verify( self, method, uri, signature, timestamp, now=None ):
+        """Verify the signature of the request (method, URI) at timestamp.  Raises unauthorized, or
+        returns True if the signature is valid (or was recently verified)."""
+        if not signature or not timestamp:
+            raise unauthorized( f"Missing {SIGNATURE_HEADER} or {TIMESTAMP_HEADER}" )
+        try:
+            when		= int( timestamp )
+        except ValueError:
+            raise unauthorized( f"Invalid {TIMESTAMP_HEADER}: {timestamp!r}" )
+        now			= time.time() if now is None else now
+        if abs( now - when ) > self.window:
+            raise unauthorized( f"Expired {TIMESTAMP_HEADER}: {timestamp}" )
+        verify			= self.key()
+        data			= message( method, uri, timestamp )
+        remembered		= ( signature, data )
+        if remembered in self._verified:
+            return True
+        try:
+            raw			= decode( signature )
+        except ValueError:
+            raise unauthorized( f"Invalid {SIGNATURE_HEADER}" )
+        self.verifications     += 1
+        if not verify( raw, data ):
+            raise unauthorized( f"Invalid {SIGNATURE_HEADER}" )
+        with self._lock:
+            if verify is self._key:
+                self._verified[remembered] = when
+                # Forget the oldest requests beyond the limit, and those (approximately, as they
+                # arrive roughly in timestamp order) no longer within the window
+                while self._verified and ( len( self._verified ) > self.entries
+                                           or next( iter( self._verified.values() )) < now - self.window ):
+                    self._verified.popitem( last=False )
+        return True
@@ -0,0 +1,301 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+
+log				= logging.getLogger( "config_store" )
+
+"""
+config_store.config_store -- Keep the parsed holo-config.json in memory, re-validated via os.stat
+  .signature -- The (symlink, target) (mtime_ns, inode, size) stat signature of the file
+  .refresh   -- Re-parse the file only if its stat signature has changed; returns the generation
+  .config    -- The full (authoritative) parsed holo-config.json document
+  .admin     -- The pre-projected `admin` view (never containing the `seed`)
+  .digest    -- A hash of the content of the `admin` view; eg. for use in an HTTP ETag
+  .validate  -- Validate a PUT/PATCH of the `admin` view, w/o applying it; raises ValueError if invalid
+  .update    -- Validate and apply a PUT/PATCH of the `admin` view; returns (<version>, <admin>)
+  .flush     -- Write any updates to the file, atomically (normally, after a short debounce delay)
+  .write     -- Atomically replace the file's (symlink's) target, via a temporary file beside it
+  .locked    -- Hold a shared (reading) or exclusive (updating) lock on the file, if it is shared
+  .renew     -- A fresh store of the same file (eg. for a reloaded app), once any updates are written
+
+config_store.file_lock -- A (reentrant) shared or exclusive flock on a file, across processes
+
+If the file is shared w/ other processes (eg. the server's --workers), each update re-reads and
+writes the file (instead of after a debounce delay) while holding an exclusive lock, and each
+re-parse holds a shared lock; so, each process sees every other's updates as soon as they complete.
+The lock is on a separate <file>.lock, as each write replaces the file itself.
+"""
+
+
+class file_lock:
+    """A lock on a file, shared w/ other processes (eg. by readers), or exclusive (eg. by a writer),
+    via flock.  Reentrant per thread; the first (outermost) holder determines whether the lock is
+    shared or exclusive.  Unless create is False, the file is created if necessary (eg. a separate
+    <file>.lock)."""
+    def __init__( self, path, create=True ):
+        self.path		= path
+        self.create		= create
+        self._held		= threading.local() # This thread's depth of holding the lock
+
+    @contextlib.contextmanager
+    def __call__( self, exclusive=False ):
+        depth			= getattr( self._held, 'depth', 0 )
+        fd			= None
+        if not depth:
+            fd			= os.open( self.path, os.O_RDONLY | ( os.O_CREAT if self.create else 0 ), 0o600 )
+        try:
+            if fd is not None:
+                fcntl.flock( fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH )
+            self._held.depth	= depth + 1
+            try:
+                yield
+            finally:
+                self._held.depth = depth
+        finally:
+            if fd is not None:
+                os.close( fd )	# releases the lock
+
+
+class config_store:
+    admin_fields		= ( 'email', 'public_key', 'name' )
+    admin_required		= ( 'email', 'public_key' )
+
+    def __init__( self, path="data/holo-config.json", debounce=0.1, backoff=60.0 ):
+        self.path		= path
+        self.debounce		= debounce
+        self.backoff		= backoff	# The longest delay before retrying a failed write
+        self._lock		= threading.Lock()
+        self._flushing		= threading.Lock() # Serializes all writes of the file
+        self._signature		= None	# The (lstat, stat) signature of the last parsed file
+        self._config		= None	# The full parsed document (includes the seed!)
+        self._admin		= None	# The projected `admin` view, shared by all requests
+        self._digest		= None	# The hash of the `admin` view
+        self._timer		= None	# The pending (debounced) flush of updates, if any
+        self.generation		= 0	# Incremented whenever a changed file is re-parsed
+        self.version		= 0	# Incremented by each update
+        self.written		= 0	# The last version durably written to the file
+        self.writes		= 0	# The number of times the file has been written
+        self.failures		= 0	# Consecutive failed writes; each retried after a (doubling) delay
+        self.shared		= False	# If other processes update the file; updates are written through
+        self._file_lock		= file_lock( path + ".lock" )
+
+    def signature( self ):
+        """Both the symlink (if any) and its target must be unchanged.  The holo-config.json may be
+        re-linked to a new target (changing the lstat), or its target replaced or re-written (changing
+        the stat); either will trigger a re-parse.
+
+        """
+        link			= os.lstat( self.path )
+        target			= os.stat( self.path )
+        return (
+            ( link.st_mtime_ns, link.st_ino, link.st_size ),
+            ( target.st_mtime_ns, target.st_ino, target.st_size ),
+        )
+
+    def locked( self, exclusive=False ):
+        """Hold a shared (reading) or exclusive (updating) lock on the file, if it is shared."""
+        return self._file_lock( exclusive=exclusive ) if self.shared else contextlib.nullcontext()
+
+    @staticmethod
+    def project( config ):
+        """The `admin` view of the config: the `v1.admin` object, and the top-level `name` (if any)."""
+        admin			= dict( config['v1']['admin'] )
+        if 'name' in config:
+            admin['name']	= config['name']
+        return admin
+
+    @staticmethod
+    def hash( admin ):
+        return hashlib.sha1( json.dumps( admin, sort_keys=True ).encode( 'utf-8' )).hexdigest()
+
+    def refresh( self ):
+        """Re-parse the holo-config.json iff its stat signature has changed.  The signature is taken
+        before reading, so a file altered during the read will be re-parsed on the next refresh.
+        While updates are pending (not yet written), the in-memory config remains authoritative, and
+        the file is not re-parsed.  Returns the current generation.
+
+        """
+        signature		= self.signature()
+        if signature == self._signature or self.version > self.written:
+            return self.generation
+        with self.locked(), self._lock:
+            if signature != self._signature and self.version <= self.written:
+                with open( self.path ) as f:
+                    config	= json.loads( f.read() )
+                self._admin	= self.project( config )
+                self._digest	= self.hash( self._admin )
+                self._config	= config
+                self._signature	= signature
+                self.generation += 1
+                log.info( f"Loaded {self.path} generation {self.generation}: {signature!r}" )
+        return self.generation
+
+    def config( self ):
+        """The full holo-config.json document.  Shared; do not modify."""
+        self.refresh()
+        return self._config
+
+    def admin( self ):
+        """The `admin` object from holo-config.json.  Shared by all requests; do not modify."""
+        self.refresh()
+        return self._admin
+
+    def digest( self ):
+        """The hash of the current `admin` view; unchanged across restarts, if the content is unchanged."""
+        self.refresh()
+        return self._digest
+
+    def update( self, admin, replace=False ):
+        """Apply a PATCH (or PUT, if replace) of the `admin` view to the authoritative in-memory
+        config, and schedule a (debounced) write of the file; a burst of updates results in a single
+        write.  Only `email`, `public_key` and `name` may be supplied; `email` and `public_key` may
+        not be deleted (a PATCH w/ a null value deletes a field).  Raises ValueError if invalid.
+        Returns the new (<version>, <admin>).  If shared, the file is re-read (if changed by another
+        process) and written, while holding an exclusive lock on it.
+
+        """
+        self.validate( admin, replace=replace )
+        with self.locked( exclusive=True ):
+            result			= self.apply( admin, replace )
+            if self.shared:
+                self.flush()
+        return result
+
+    def validate( self, admin, replace=False ):
+        """Validate a PUT/PATCH of the `admin` view against the current config, w/o applying it (eg.
+        before applying any other part of a request).  Raises ValueError if invalid."""
+        if type( admin ) is not dict:
+            raise ValueError( f"Invalid admin: {admin!r}; must be an object" )
+        unknown			= set( admin ) - set( self.admin_fields )
+        if unknown:
+            raise ValueError( f"Invalid admin fields: {', '.join( sorted( unknown ))}" )
+        for key,val in admin.items():
+            if not ( type( val ) is str or ( val is None and not replace )):
+                raise ValueError( f"Invalid admin {key}: {val!r}; must be a string" )
+        updated			= dict( admin ) if replace else dict( self.admin(), **admin )
+        missing			= [ k for k in self.admin_required if updated.get( k ) is None ]
+        if missing:
+            raise ValueError( f"Invalid admin; missing {', '.join( missing )}" )
+
+    def apply( self, admin, replace=False ):
+        """Apply the validated update to the (refreshed) config; returns the new (<version>, <admin>)."""
+        self.refresh()
+        with self._lock:
+            updated			= dict( admin ) if replace else dict( self._admin, **admin )
+            updated			= { k: v for k,v in updated.items() if v is not None }
+            missing			= [ k for k in self.admin_required if k not in updated ]
+            if missing:
+                raise ValueError( f"Invalid admin; missing {', '.join( missing )}" )
+            # Copy-on-write; requests may still be using the prior config and admin view
+            config			= dict( self._config )
+            config['v1']		= dict( config['v1'] )
+            config['v1']['admin']	= { k: v for k,v in updated.items() if k != 'name' }
+            config.pop( 'name', None )
+            if 'name' in updated:
+                config['name']		= updated['name']
+            self._config		= config
+            self._admin			= self.project( config )
+            self._digest		= self.hash( self._admin )
+            self.generation	       += 1
+            self.version	       += 1
+            if not self._timer and not self.shared:
+                self._timer		= threading.Timer( self.debounce, self.flush )
+                self._timer.start()
+            return self.version,self._admin
+
+    def renew( self ):
+        """A fresh store of the same file, w/ the same settings (eg. for a reloaded app); any updates
+        not yet written are written first, so the fresh store parses them."""
+        self.flush()
+        fresh			= config_store( self.path, debounce=self.debounce, backoff=self.backoff )
+        fresh.shared		= self.shared
+        return fresh
+
+    def flush( self ):
+        """Durably write the latest config to the file, if not already written.  The file may be a
+        symlink, so a temporary file is written next to its target, and renamed over it (retaining
+        its permissions); a crash never leaves a partially written file.  Writes are serialized.  A
+        failed write is retried after a delay (doubling, up to backoff seconds).
+
+        """
+        with self._flushing:
+            with self._lock:
+                self._timer		= None
+                config,version		= self._config,self.version
+            if version <= self.written:
+                return
+            contents			= ( json.dumps( config, indent=2 ) + "\n" ).encode( 'utf-8' )
+            try:
+                self.write( contents )
+            except Exception as exc:
+                # Remains unwritten (and authoritative); retried after a delay, or by the next update
+                with self._lock:
+                    self.failures      += 1
+                    delay		= min( self.debounce * 2 ** min( self.failures, 16 ),
+                                               max( self.debounce, self.backoff ))
+                    if not self._timer:
+                        self._timer	= threading.Timer( delay, self.retry )
+                        self._timer.daemon = True
+                        self._timer.start()
+                log.error( f"Failed to write {self.path} version {version}; retrying in {delay:.1f}s: {exc}" )
+                return
+            with self._lock:
+                self._signature		= self.signature()
+                self.written		= version
+                self.writes	       += 1
+                self.failures		= 0
+            log.info( f"Wrote {self.path} version {version}" )
+
+    def retry( self ):
+        """Retry a failed write (of the latest config), under the exclusive lock if shared."""
+        with self.locked( exclusive=True ):
+            self.flush()
+
+    def write( self, contents ):
+        """Atomically replace the file's (symlink's) target w/ the contents, via a temporary file."""
+        target			= os.path.realpath( self.path )
+        prior			= os.stat( target )
+        fd,temporary		= tempfile.mkstemp( prefix=f".{os.path.basename( target )}.",
+                                            dir=os.path.dirname( target ))
+        try:
+            try:
+                os.fchmod( fd, stat.S_IMODE( prior.st_mode ))
+                with contextlib.suppress( PermissionError ):
+                    os.fchown( fd, prior.st_uid, prior.st_gid )
+                offset			= 0
+                while offset < len( contents ):
+                    offset	       += os.write( fd, contents[offset:] )
+                if self.shared and os.fstat( fd ).st_mtime_ns <= prior.st_mtime_ns:
+                    # A coarse file system clock; ensure other processes see a changed signature
+                    os.utime( fd, ns=( prior.st_atime_ns, prior.st_mtime_ns + 1 ))
+                os.fsync( fd )
+            finally:
+                os.close( fd )
+            os.replace( temporary, target )
+        except BaseException:
+            with contextlib.suppress( OSError ):
+                os.unlink( temporary )
+            raise
+        # Durably record the rename in the target's directory
+        directory		= os.open( os.path.dirname( target ), os.O_RDONLY )
+        try:
+            os.fsync( directory )
+        finally:
+            os.close( directory )
@@ -0,0 +1,117 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson			= None
+
+log				= logging.getLogger( "json_util" )
+
+"""
+json_util.serializer -- Serialize results to JSON, w/ the fastest available encoder
+  .dumps     -- Serialize to a str (or bytes, from a fast encoder)
+  .iterdumps -- Serialize a (large) list, or a dict of lists, to an iterable of chunks, for streaming to WSGI
+  .items     -- The number of items of a list, or of the lists in a dict (eg. a job's output lines)
+
+The readable (indented) form is always produced by the stdlib json; the compact form uses orjson,
+if installed.  The encoders are configured once, not per call.
+"""
+
+
+class serializer:
+    def __init__( self, fast=True, chunk=65536 ):
+        self.chunk		= chunk
+        self.fast		= bool( fast and orjson )
+        self.readable		= json.JSONEncoder( sort_keys=True, indent=4 )
+        self.compact		= json.JSONEncoder( sort_keys=True, separators=( ',', ':' ))
+        self.options		= orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS if orjson else 0
+        log.info( "JSON compact encoder: %s", "orjson" if self.fast else "json" )
+
+    @property
+    def encoder( self ):
+        return "orjson" if self.fast else "json"
+
+    def dumps( self, obj, compact=False ):
+        if compact and self.fast:
+            try:
+                return orjson.dumps( obj, option=self.options )
+            except TypeError:
+                pass # eg. an unsupported type, or an integer too large; the stdlib may handle it
+        return ( self.compact if compact else self.readable ).encode( obj )
+
+    @staticmethod
+    def items( obj ):
+        """The number of items of a list, or of the lists in a dict (eg. a job's output lines); ie.
+        the number of fragments a compact serialization of it is streamed in."""
+        if type( obj ) is list:
+            return len( obj )
+        if type( obj ) is dict:
+            return sum( len( v ) for v in obj.values() if type( v ) is list )
+        return 0
+
+    def iterdumps( self, obj, compact=False ):
+        """Yield the JSON serialization of obj in chunks of about self.chunk bytes.  Each item of a
+        compact list (or of each list in a compact dict, eg. a job's output lines) is serialized
+        separately (by the fast encoder, if available); otherwise, the stdlib encoder's fragments
+        are collected into chunks.
+
+        """
+        if compact and ( type( obj ) is list
+                         or ( type( obj ) is dict and all( type( k ) is str for k in obj ))):
+            fragments		= self._fragments( obj )
+        else:
+            fragments		= ( self.compact if compact else self.readable ).iterencode( obj )
+        chunk,size		= [],0
+        for fragment in fragments:
+            chunk.append( fragment )
+            size	       += len( fragment )
+            if size >= self.chunk:
+                yield self._join( chunk )
+                chunk,size	= [],0
+        if chunk:
+            yield self._join( chunk )
+
+    def _encode( self, obj ):
+        return self.dumps( obj, compact=True ) if self.fast else self.compact.encode( obj )
+
+    def _fragments( self, obj ):
+        """The compact serialization of a list (each item separately), or of a dict w/ str keys (in
+        sorted order; each of its list values' items separately)."""
+        literal			= ( lambda s: s.encode( 'utf-8' )) if self.fast else ( lambda s: s )
+        if type( obj ) is list:
+            yield literal( '[' )
+            for i,item in enumerate( obj ):
+                if i:
+                    yield literal( ',' )
+                yield self._encode( item )
+            yield literal( ']' )
+            return
+        yield literal( '{' )
+        for i,key in enumerate( sorted( obj )):
+            if i:
+                yield literal( ',' )
+            yield self._encode( key )
+            yield literal( ':' )
+            if type( obj[key] ) is list:
+                yield from self._fragments( obj[key] )
+            else:
+                yield self._encode( obj[key] )
+        yield literal( '}' )
+
+    @staticmethod
+    def _join( chunk ):
+        if any( type( c ) is bytes for c in chunk ):
+            return b''.join( c if type( c ) is bytes else c.encode( 'utf-8' ) for c in chunk )
+        return ''.join( chunk )
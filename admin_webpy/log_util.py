@@ -0,0 +1,188 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+import urllib.parse
+
+log				= logging.getLogger( "log_util" )
+
+"""
+log_util.pipeline -- Non-blocking logging: records are queued, and written by a background thread
+  .start  -- Move a logger's (eg. logging.basicConfig's) handlers behind the queue
+  .stop   -- Write any queued records, and restore the handlers
+  .reopen -- Re-open the log file(s) (eg. on SIGHUP, after logrotate has moved them)
+  .report -- The queue's capacity, depth and the number of records dropped
+
+The queue is bounded; when it is full (eg. the log file's disk is stalled), a record is dropped and
+counted, rather than blocking the request thread.
+
+log_util.access_logger -- WSGI middleware logging a compact, structured line per request, w/ its timing
+"""
+
+
+class dropping_queue_handler( logging.handlers.QueueHandler ):
+    """Queue records on a (fast, unbounded) SimpleQueue, dropping (and counting) any beyond capacity."""
+    def __init__( self, queue, capacity ):
+        super().__init__( queue )
+        self.capacity		= capacity
+        self.dropped		= 0
+
+    def prepare( self, record ):
+        """Only merge the message's (possibly mutable) args now; the record is not pickled, so the
+        listener's handlers can do all the formatting (incl. any exception) in the background."""
+        record.msg		= record.getMessage()
+        record.args		= None
+        return record
+
+    def enqueue( self, record ):
+        if self.queue.qsize() >= self.capacity:
+            self.dropped       += 1	# Not thread-safe, but an approximate count suffices
+            return
+        self.queue.put( record )
+
+
+class pipeline:
+    def __init__( self, capacity=10000 ):
+        self.capacity		= capacity	# The most records queued; more are dropped
+        self.queue		= None
+        self.handler		= None
+        self.handlers		= []		# The handlers serviced by the listener
+        self.logger		= None
+        self.listener		= None
+        self._lock		= threading.Lock()
+
+    def start( self, logger=None ):
+        """Move the logger's (default: root) handlers behind the queue, serviced by the listener."""
+        with self._lock:
+            if self.listener:
+                return
+            self.logger		= logger or logging.getLogger()
+            self.queue		= queue.SimpleQueue()
+            self.handler	= dropping_queue_handler( self.queue, self.capacity )
+            self.handlers	= list( self.logger.handlers )
+            for handler in self.handlers:
+                self.logger.removeHandler( handler )
+            self.logger.addHandler( self.handler )
+            self.listener	= logging.handlers.QueueListener(
+                self.queue, *self.handlers, respect_handler_level=True )
+            self.listener.start()
+        log.info( "Logging via a queue of %d records", self.capacity )
+
+    def stop( self ):
+        with self._lock:
+            if not self.listener:
+                return
+            self.listener.stop()
+            self.listener	= None
+            self.logger.removeHandler( self.handler )
+            for handler in self.handlers:
+                self.logger.addHandler( handler )
+        if self.dropped:
+            log.warning( "Logging dropped %d records", self.dropped )
+
+    def reopen( self ):
+        """Close and re-open every log file handler's file, so records are written to a (new) file at
+        the original path.  Used from a signal handler; when queued, the handlers are only used by
+        the listener thread, so the main thread never holds their (reentrant) locks."""
+        handlers		= self.handlers if self.listener else logging.getLogger().handlers
+        reopened		= []
+        for handler in handlers:
+            if isinstance( handler, logging.FileHandler ):
+                handler.acquire()
+                try:
+                    if handler.stream:
+                        handler.stream.close()
+                    handler.stream = handler._open()
+                finally:
+                    handler.release()
+                reopened.append( handler.baseFilename )
+        log.warning( "Reopened log file(s): %s", ", ".join( reopened ) or "(none)" )
+        return reopened
+
+    @property
+    def dropped( self ):
+        return self.handler.dropped if self.handler else 0
+
+    def report( self ):
+        return dict(
+            queued		= bool( self.listener ),
+            capacity		= self.capacity,
+            depth		= self.queue.qsize() if self.queue else 0,
+            dropped		= self.dropped,
+        )
+
+
+class access_logger:
+    """Log each request as a compact, structured (logfmt) line, once its response has been sent:
+
+        method=GET path=/api/v1/ping status=200 bytes=73 ms=0.412 remote=127.0.0.1
+
+    """
+    def __init__( self, app, logger="access" ):
+        self.app		= app
+        self.log		= logging.getLogger( logger )
+
+    def __call__( self, environ, start_response ):
+        begun			= time.perf_counter()
+        status			= [ "-", None ]	# The status code, and any Content-Length
+        def logged_start_response( code, headers, *args ):
+            status[0]		= code.split( None, 1 )[0]
+            status[1]		= next( ( v for k,v in headers if k.lower() == 'content-length' ), None )
+            return start_response( code, headers, *args )
+        body			= self.app( environ, logged_start_response )
+        wrapper			= environ.get( 'wsgi.file_wrapper' )
+        if isinstance( wrapper, type ) and isinstance( body, wrapper ):
+            return self.wrapped( body, environ, status, begun )
+        return self.logged( body, environ, status, begun )
+
+    def wrapped( self, body, environ, status, begun ):
+        """A body of the server's wsgi.file_wrapper (eg. served via sendfile) is returned itself, its
+        close hooked, and logged w/ the size of its Content-Length (if any); any other is wrapped."""
+        close			= getattr( body, 'close', None )
+        def logged_close():
+            try:
+                if close:
+                    close()
+            finally:
+                size		= status[1]
+                self.record( environ, status, int( size ) if size and size.isdigit() else "-", begun )
+        try:
+            body.close		= logged_close
+        except AttributeError:
+            return self.logged( body, environ, status, begun )	# eg. w/ __slots__
+        return body
+
+    def logged( self, body, environ, status, begun ):
+        size			= 0
+        try:
+            for chunk in body:
+                size	       += len( chunk )
+                yield chunk
+        finally:
+            close		= getattr( body, 'close', None )
+            if close:
+                close()
+            self.record( environ, status, size, begun )
+
+    def record( self, environ, status, size, begun ):
+        self.log.info( "method=%s path=%s status=%s bytes=%s ms=%.3f remote=%s",
+                       environ.get( 'REQUEST_METHOD', '-' ),
+                       urllib.parse.quote( environ.get( 'PATH_INFO', '' ), safe="/:@!$&'()*+,;=" ),
+                       status[0], size, ( time.perf_counter() - begun ) * 1000,
+                       environ.get( 'REMOTE_ADDR' ) or "-" )
+
+
+# The server's logging pipeline; started by main
+log_pipeline			= pipeline()
@@ -0,0 +1,158 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import bisect
+import logging
+import threading
+import time
+
+log				= logging.getLogger( "metrics_util" )
+
+"""
+metrics_util.metrics -- Low-overhead latency histograms and in-flight gauges, by name and labels
+  .observe    -- Record a latency (in seconds) in a fixed-bucket histogram
+  .begin/.end -- Increment/decrement an in-flight gauge
+  .collect    -- Merge all threads' metrics; returns ({(name,labels): [counts..., sum]}, {(name,labels): n})
+  .report     -- The merged metrics, as a JSON-able dict
+  .prometheus -- The merged metrics, in the Prometheus text exposition format
+
+Each thread records into its own shard, so no lock is taken on the request path; the shards are
+merged only when the metrics are collected.
+"""
+
+
+class metrics:
+    buckets			= ( .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0 )
+
+    def __init__( self, namespace="hpos_admin", labels=( "version", "path", "accept", "status" ),
+                  buckets=None, series=500, enabled=True ):
+        self.namespace		= namespace
+        self.labels		= labels
+        self.buckets		= tuple( buckets or self.buckets )
+        self.series		= series	# The maximum distinct (name, labels) series; others merged
+        self.enabled		= enabled
+        self._local		= threading.local()
+        self._lock		= threading.Lock()
+        self._shards		= []		# Every thread's (histograms, gauges) shard
+        self._known		= set()		# The distinct (name, labels) series seen
+
+    def _shard( self ):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard			= ( {}, {} )
+            with self._lock:
+                self._shards.append( shard )
+            self._local.shard	= shard
+            return shard
+
+    def _series( self, name, labels ):
+        """Limit the cardinality of the series (eg. from unrecognized versions, paths).  Only a new
+        series takes the lock, so concurrent new series never exceed the limit."""
+        key			= ( name, labels )
+        if key not in self._known:
+            with self._lock:
+                if key not in self._known:
+                    if len( self._known ) >= self.series:
+                        return ( name, tuple( "other" for _ in labels ))
+                    self._known.add( key )
+        return key
+
+    def observe( self, name, labels, seconds ):
+        if not self.enabled:
+            return
+        histograms,_		= self._shard()
+        key			= self._series( name, labels )
+        histogram		= histograms.get( key )
+        if histogram is None:
+            histogram		= histograms[key] = [ 0 ] * ( len( self.buckets ) + 1 ) + [ 0.0 ]
+        histogram[bisect.bisect_left( self.buckets, seconds )] += 1
+        histogram[-1]	       += seconds
+
+    def begin( self, name, labels ):
+        if self.enabled:
+            _,gauges		= self._shard()
+            key			= self._series( name, labels )
+            gauges[key]		= gauges.get( key, 0 ) + 1
+
+    def end( self, name, labels ):
+        if self.enabled:
+            _,gauges		= self._shard()
+            key			= self._series( name, labels )
+            gauges[key]		= gauges.get( key, 0 ) - 1
+
+    def collect( self ):
+        with self._lock:
+            shards		= list( self._shards )
+        histograms,gauges	= {},{}
+        for shard_histograms,shard_gauges in shards:
+            for key,histogram in list( shard_histograms.items() ):
+                merged		= histograms.setdefault( key, [ 0 ] * len( histogram ))
+                for i,v in enumerate( list( histogram )):
+                    merged[i]  += v
+            for key,value in list( shard_gauges.items() ):
+                gauges[key]	= gauges.get( key, 0 ) + value
+        return histograms,gauges
+
+    def report( self ):
+        histograms,gauges	= self.collect()
+        return dict(
+            histograms		= [
+                dict(
+                    name	= name,
+                    labels	= dict( zip( self.labels, labels )),
+                    buckets	= dict( zip( list( map( str, self.buckets )) + [ "+Inf" ], histogram[:-1] )),
+                    count	= sum( histogram[:-1] ),
+                    sum		= histogram[-1],
+                )
+                for (name,labels),histogram in sorted( histograms.items() )
+            ],
+            gauges		= [
+                dict(
+                    name	= name,
+                    labels	= dict( zip( self.labels, labels )),
+                    value	= value,
+                )
+                for (name,labels),value in sorted( gauges.items() )
+            ],
+        )
+
+    def prometheus( self ):
+        """Render the histograms (cumulative buckets, sum, count) and gauges in Prometheus format."""
+        histograms,gauges	= self.collect()
+        def labelled( names, values, **extra ):
+            pairs		= list( zip( names, values )) + list( extra.items() )
+            return "{" + ",".join( '%s="%s"' % ( k, str( v ).replace( '\\', '\\\\' ).replace( '"', '\\"' ))
+                                   for k,v in pairs ) + "}"
+        lines			= []
+        for metric in sorted( set( name for name,_ in histograms )):
+            full		= f"{self.namespace}_{metric}_seconds"
+            lines.append( f"# TYPE {full} histogram" )
+            for (name,labels),histogram in sorted( histograms.items() ):
+                if name != metric:
+                    continue
+                cumulative	= 0
+                for le,count in zip( list( map( str, self.buckets )) + [ "+Inf" ], histogram[:-1] ):
+                    cumulative += count
+                    lines.append( f"{full}_bucket{labelled( self.labels, labels, le=le )} {cumulative}" )
+                lines.append( f"{full}_sum{labelled( self.labels, labels )} {histogram[-1]}" )
+                lines.append( f"{full}_count{labelled( self.labels, labels )} {cumulative}" )
+        for metric in sorted( set( name for name,_ in gauges )):
+            full		= f"{self.namespace}_{metric}"
+            lines.append( f"# TYPE {full} gauge" )
+            for (name,labels),value in sorted( gauges.items() ):
+                if name == metric:
+                    lines.append( f"{full}{labelled( self.labels, labels )} {value}" )
+        return "\n".join( lines ) + "\n"
+
+
+# The server's metrics, recorded by the request dispatch, and reported by the metrics API
+registry			= metrics()
@@ -0,0 +1,419 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import collections
+import contextlib
+import hashlib
+import itertools
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+from .config_store import file_lock
+
+log				= logging.getLogger( "nix_util" )
+
+"""
+nix_util.holoportos -- The desired HoloPortOS state (`network`, `sshAccess`), persisted in a JSON file
+  .state  -- The current state
+  .digest -- A hash of the content of the current state
+  .validate -- Validate a PUT/PATCH of the state, w/o applying it; raises ValueError if invalid
+  .update -- Validate and apply a PUT/PATCH of the state; returns (<state>, <changed>)
+
+  If shared w/ other processes (eg. the server's --workers), the file is re-validated via os.stat
+  on each access, and each update is written through, under a lock (<path>.lock).
+
+nix_util.rebuild -- A job runner, applying a holoportos state via a (NixOS rebuild) command
+
+nix_util.job_queue -- Run jobs (eg. a NixOS rebuild) one at a time, in a single background worker
+  .submit -- Queue a job to apply a state; coalesced w/ any still-queued (or settling) job for the same key
+  .get    -- Return a job by its ID, or raise KeyError
+  .jobs   -- All retained jobs, oldest first
+
+  If shared w/ other processes (eg. the server's --workers) via a directory, each job's report is
+  saved there (as <id>.json) whenever its status changes (and each second while running), job IDs
+  are allocated from there (under a lock, <directory>/.lock), and jobs are run one at a time across
+  all processes (under another, <directory>/.run).  Each process coalesces only its own queued jobs;
+  a job whose state was already applied by the last job run (by any process) for its key is not run.
+"""
+
+
+class holoportos:
+    defaults			= dict(
+        network		= "live",
+        sshAccess	= False,
+    )
+    networks			= ( "live", "dev", "test" )
+
+    def __init__( self, path="data/holoportos.json" ):
+        self.path		= path
+        self.shared		= False	# If other processes update the file; re-validated, written through
+        self._lock		= threading.Lock()
+        self._file_lock		= file_lock( path + ".lock" )
+        self._state		= None
+        self._digest		= None
+        self._signature		= None
+
+    def locked( self, exclusive=False ):
+        return self._file_lock( exclusive=exclusive ) if self.shared else contextlib.nullcontext()
+
+    def signature( self ):
+        try:
+            st			= os.stat( self.path )
+        except FileNotFoundError:
+            return None
+        return ( st.st_mtime_ns, st.st_ino, st.st_size )
+
+    def state( self ):
+        """The desired state; from the file (if it exists), or the defaults.  Shared; do not modify."""
+        if self._state is None or ( self.shared and self.signature() != self._signature ):
+            with self.locked(), self._lock:
+                signature	= self.signature()
+                if self._state is None or ( self.shared and signature != self._signature ):
+                    state	= dict( self.defaults )
+                    if os.path.exists( self.path ):
+                        with open( self.path ) as f:
+                            state.update( json.loads( f.read() ))
+                    self._digest = self.hash( state )
+                    self._state	= state
+                    self._signature = signature
+        return self._state
+
+    @staticmethod
+    def hash( state ):
+        return hashlib.sha1( json.dumps( state, sort_keys=True ).encode( 'utf-8' )).hexdigest()
+
+    def digest( self ):
+        self.state()
+        return self._digest
+
+    def validate( self, state, replace=False ):
+        """Validate a PUT/PATCH of the state, w/o applying it.  Raises ValueError if invalid."""
+        if type( state ) is not dict:
+            raise ValueError( f"Invalid holoportos: {state!r}; must be an object" )
+        unknown			= set( state ) - set( self.defaults )
+        if unknown:
+            raise ValueError( f"Invalid holoportos fields: {', '.join( sorted( unknown ))}" )
+        if replace and set( state ) != set( self.defaults ):
+            raise ValueError( f"Invalid holoportos; requires {', '.join( sorted( self.defaults ))}" )
+        if 'network' in state and state['network'] not in self.networks:
+            raise ValueError( f"Invalid holoportos network: {state['network']!r}; must be one of {', '.join( self.networks )}" )
+        if 'sshAccess' in state and type( state['sshAccess'] ) is not bool:
+            raise ValueError( f"Invalid holoportos sshAccess: {state['sshAccess']!r}; must be true/false" )
+
+    def update( self, state, replace=False ):
+        """Apply a PUT (all values required) or PATCH of the state.  Neither value may be deleted.
+        Raises ValueError if invalid.  Returns the new (<state>, <changed>).
+
+        """
+        self.validate( state, replace=replace )
+        with self.locked( exclusive=True ):
+            self.state()
+            with self._lock:
+                updated		= dict( self._state, **state )
+                changed		= updated != self._state
+                if self.shared and changed:
+                    self.write( updated )
+                self._digest	= self.hash( updated )
+                self._state	= updated
+        return updated,changed
+
+    def write( self, state ):
+        """Durably write the state file (for the NixOS rebuild to consume)."""
+        with self.locked( exclusive=True ):
+            prior		= self.signature()
+            with open( self.path, 'w' ) as f:
+                f.write( json.dumps( state, indent=2 ) + "\n" )
+                f.flush()
+                if self.shared and prior and os.fstat( f.fileno() ).st_mtime_ns <= prior[0]:
+                    # A coarse file system clock; ensure other processes see a changed signature
+                    os.utime( f.fileno(), ns=( prior[0] + 1, prior[0] + 1 ))
+                os.fsync( f.fileno() )
+            if self.shared:
+                self._signature	= self.signature()
+
+
+class job:
+    def __init__( self, ident, key, state, lines=1000 ):
+        self.ident		= ident
+        self.key		= key
+        self.state		= state
+        self.requests		= 1	# The number of submissions coalesced into this job
+        self.status		= "queued"
+        self.returncode		= None
+        self.error		= None
+        self.output		= collections.deque( maxlen=lines ) # The last lines of output
+        self.submitted		= time.time()
+        self.updated		= self.submitted # When last superseded (or submitted)
+        self.started		= None
+        self.finished		= None
+
+    def report( self, output=True ):
+        result			= dict(
+            id			= self.ident,
+            key			= self.key,
+            state		= self.state,
+            requests		= self.requests,
+            status		= self.status,
+            returncode		= self.returncode,
+            error		= self.error,
+            submitted		= self.submitted,
+            started		= self.started,
+            finished		= self.finished,
+        )
+        if output:
+            result['output']	= list( self.output )
+        return result
+
+
+class saved_job:
+    """A job's report, as saved by (another process') job_queue."""
+    def __init__( self, report ):
+        self.ident		= report['id']
+        self._report		= report
+
+    def report( self, output=True ):
+        if output:
+            return self._report
+        return { k: v for k,v in self._report.items() if k != 'output' }
+
+
+class job_queue:
+    """Jobs are run by run( job ) one at a time, in submission order, by a single worker thread.  A
+    job submitted while another job for the same key is still queued supersedes it: the queued job
+    is updated to apply the latest state instead, and its ID is returned.  A queued job is run only
+    once it has settled (not been superseded for settle seconds), so a burst of rapid changes
+    results in one job applying the final state.  Each job retains only the last
+    lines of its output, and only the most recent jobs are retained.
+
+    If shared, other processes' queued jobs cannot be superseded; instead, a job is not run (but
+    succeeds at once) if the last job run for its key, by any process, succeeded in applying the
+    same state.  A run w/ a latest( job ) method supplies the state the job would apply now (eg.
+    the latest shared state); otherwise, the job's own state.
+
+    """
+    def __init__( self, run, jobs=100, lines=1000, settle=1.0 ):
+        self.run		= run
+        self.retain		= jobs
+        self.lines		= lines
+        self.settle		= settle	# Seconds a queued job must go unchanged, before it runs
+        self._lock		= threading.Condition()
+        self._ident		= itertools.count( 1 )
+        self._jobs		= collections.OrderedDict() # ID --> job; the most recent jobs
+        self._queued		= collections.OrderedDict() # key --> queued job
+        self._worker		= None
+        self.directory		= None	# If shared w/ other processes, the directory of all jobs' reports
+
+    def share( self, directory ):
+        """Share jobs w/ other processes (eg. the server's --workers), via the directory (created on
+        the first job submitted)."""
+        self.directory		= directory
+        self._allocating	= file_lock( os.path.join( directory, ".lock" ))
+        self._running		= file_lock( os.path.join( directory, ".run" ))
+
+    def saved( self ):
+        """The IDs of all jobs saved in the (shared) directory."""
+        try:
+            names		= os.listdir( self.directory )
+        except FileNotFoundError:
+            return []
+        return [ int( name[:-5] ) for name in names if name.endswith( ".json" ) and name[:-5].isdigit() ]
+
+    def save( self, saving ):
+        """Save the job's report in the (shared) directory, atomically.  Each save writes its own
+        temporary file, so concurrent saves (eg. by other threads or processes) never collide."""
+        path			= os.path.join( self.directory, f"{saving.ident}.json" )
+        fd,temporary		= tempfile.mkstemp( prefix=f".{saving.ident}.json.", dir=self.directory )
+        try:
+            with os.fdopen( fd, 'w' ) as f:
+                f.write( json.dumps( saving.report() ))
+            os.replace( temporary, path )
+        except BaseException:
+            with contextlib.suppress( OSError ):
+                os.unlink( temporary )
+            raise
+
+    def load( self, ident ):
+        try:
+            with open( os.path.join( self.directory, f"{ident}.json" )) as f:
+                return saved_job( json.loads( f.read() ))
+        except FileNotFoundError:
+            raise KeyError( ident )
+
+    def submit( self, key, state ):
+        with self._lock:
+            queued		= self._queued.get( key )
+            if queued:
+                queued.state	= state
+                queued.requests += 1
+                queued.updated	= time.time()
+                if self.directory:
+                    self.save( queued )
+                log.info( f"Job {queued.ident} {key} superseded ({queued.requests} requests): {state!r}" )
+                return queued
+            if self.directory:
+                # Allocate the next ID after all processes' jobs, and forget all but the most recent
+                os.makedirs( self.directory, exist_ok=True )
+                with self._allocating( exclusive=True ):
+                    idents	= self.saved()
+                    queued	= job( max( idents, default=0 ) + 1, key, state, lines=self.lines )
+                    self.save( queued )
+                for ident in idents:
+                    if ident <= queued.ident - self.retain:
+                        with contextlib.suppress( FileNotFoundError ):
+                            os.unlink( os.path.join( self.directory, f"{ident}.json" ))
+            else:
+                queued		= job( next( self._ident ), key, state, lines=self.lines )
+            self._queued[key]	= queued
+            self._jobs[queued.ident] = queued
+            while len( self._jobs ) > self.retain:
+                self._jobs.popitem( last=False )
+            if self._worker is None:
+                self._worker	= threading.Thread( target=self.work, name="jobs", daemon=True )
+                self._worker.start()
+            self._lock.notify()
+            log.info( f"Job {queued.ident} {key} queued: {state!r}" )
+            return queued
+
+    def get( self, ident ):
+        with self._lock:
+            found		= self._jobs.get( ident )
+        if found is None and self.directory:
+            return self.load( ident )
+        if found is None:
+            raise KeyError( ident )
+        return found
+
+    def jobs( self ):
+        with self._lock:
+            local		= dict( self._jobs )
+        if not self.directory:
+            return list( local.values() )
+        found			= {}
+        for ident in sorted( self.saved() )[-self.retain:]:
+            with contextlib.suppress( KeyError, ValueError ):
+                found[ident]	= local.get( ident ) or self.load( ident )
+        return list( found.values() )
+
+    def work( self ):
+        while True:
+            with self._lock:
+                while True:
+                    while not self._queued:
+                        self._lock.wait()
+                    # Wait for the oldest queued job to settle; it may yet be superseded
+                    settling	= next( iter( self._queued.values() )).updated + self.settle - time.time()
+                    if settling <= 0:
+                        break
+                    self._lock.wait( settling )
+                _,running	= self._queued.popitem( last=False )
+            with self._running( exclusive=True ) if self.directory else contextlib.nullcontext():
+                running.started	= time.time()
+                applied		= self.applied( running ) if self.directory else None
+                if applied:
+                    # Another process' job has already applied this state; another run is redundant
+                    running.status = "succeeded"
+                    running.returncode = 0
+                    running.output.append( f"State already applied by job {applied}" )
+                    running.finished = running.started
+                    try:
+                        self.save( running )
+                    except Exception as exc:
+                        log.warning( f"Job {running.ident} final report not saved: {exc}" )
+                    log.info( f"Job {running.ident} {running.key} skipped; applied by job {applied}" )
+                    continue
+                running.status	= "running"
+                saving		= self.saving( running )
+                try:
+                    running.returncode = self.run( running )
+                    running.status = "succeeded" if running.returncode == 0 else "failed"
+                except Exception as exc:
+                    running.error = str( exc )
+                    running.status = "failed"
+                running.finished = time.time()
+                if saving:
+                    # Stop the periodic saves before the final one; a failed write must not end the worker
+                    saving()
+                    try:
+                        self.save( running )
+                    except Exception as exc:
+                        log.warning( f"Job {running.ident} final report not saved: {exc}" )
+            log.info( f"Job {running.ident} {running.key} {running.status}: {running.returncode}" )
+
+    def applied( self, running ):
+        """The ID of the last job run for the running job's key (by any process), if it succeeded in
+        applying the state the running job would apply now (which becomes the running job's state)."""
+        latest			= getattr( self.run, 'latest', None )
+        if latest:
+            running.state	= latest( running )
+        last			= None
+        for ident in self.saved():
+            if ident == running.ident:
+                continue
+            with contextlib.suppress( KeyError, ValueError ):
+                report		= self.load( ident ).report( output=False )
+                if report['key'] == running.key and report['finished'] is not None and (
+                        last is None or report['started'] > last['started'] ):
+                    last	= report
+        if last and last['status'] == "succeeded" and last['state'] == running.state:
+            return last['id']
+        return None
+
+    def saving( self, running ):
+        """If shared, save the running job's report (w/ its latest output) every second; returns a
+        function that stops saving, once any save in progress is complete."""
+        if not self.directory:
+            return None
+        done			= threading.Event()
+        def save():
+            while True:
+                try:
+                    self.save( running )
+                except Exception as exc:
+                    log.warning( f"Job {running.ident} report not saved: {exc}" )
+                if done.wait( 1.0 ):
+                    break
+        saver			= threading.Thread( target=save, name="jobs-saving", daemon=True )
+        saver.start()
+        def stop():
+            done.set()
+            saver.join()
+        return stop
+
+
+class rebuild:
+    """A job runner which writes the job's holoportos state, and runs the (NixOS rebuild) command,
+    capturing its combined output.  The state file path is supplied to the command in the
+    HOLOPORTOS_STATE environment variable.
+
+    """
+    def __init__( self, holoportos, command=( "nixos-rebuild", "switch" )):
+        self.holoportos		= holoportos
+        self.command		= command
+
+    def latest( self, job ):
+        """The state the job would apply now; if shared, another process' job may have run since, so
+        the latest state (from any process)."""
+        return self.holoportos.state() if self.holoportos.shared else job.state
+
+    def __call__( self, job ):
+        job.state		= self.latest( job )
+        self.holoportos.write( job.state )
+        proc			= subprocess.Popen(
+            self.command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            env=dict( os.environ, HOLOPORTOS_STATE=os.path.abspath( self.holoportos.path )))
+        for line in proc.stdout:
+            job.output.append( line.decode( 'utf-8', errors='replace' ).rstrip( '\n' ))
+        return proc.wait()
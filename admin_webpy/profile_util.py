@@ -0,0 +1,130 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import hmac
+import io
+import logging
+import os
+import threading
+import time
+
+log				= logging.getLogger( "profile_util" )
+
+"""
+profile_util.profiler -- Opt-in cProfile profiling of individual requests
+  .requested -- The profiling mode requested (by the startup mode, or an authorized header/query)
+  .run       -- Run a function under cProfile; returns (<result>, <report>)
+  .dump      -- Write the aggregate profile to <directory>/aggregate.prof
+
+Modes:
+  inline    -- The top N functions' stats (text) are returned, instead of the response
+  file      -- The request's profile is written to <directory>/<time>-<name>.prof
+  aggregate -- The profile is accumulated w/ all other aggregated requests' profiles, and written
+               to <directory>/aggregate.prof after the 1st and every `every` requests (and by .dump,
+               eg. at exit); analyze w/ pstats
+
+Only one request is profiled at a time (the interpreter supports only one active profiler); a
+request arriving while another is being profiled is run unprofiled.
+"""
+
+
+class profiler:
+    modes			= ( "inline", "file", "aggregate" )
+
+    def __init__( self, directory="data/profiles", mode=None, token=None, top=25, sort="cumulative",
+                  every=100 ):
+        assert mode in ( None, ) + self.modes, \
+            f"Invalid profiling mode {mode!r}; must be one of {', '.join( self.modes )}"
+        self.directory		= directory
+        self.mode		= mode		# If set, every request is profiled in this mode
+        self.token		= token		# If set, requests bearing it may ask to be profiled
+        self.top		= top
+        self.sort		= sort
+        self.every		= every
+        self._active		= threading.Lock()
+        self._lock		= threading.Lock()
+        self._aggregate		= None		# The pstats.Stats accumulated, in aggregate mode
+        self.aggregated		= 0		# The number of requests aggregated
+        self.skipped		= 0		# Requests not profiled, because another was being profiled
+
+    def requested( self, environ, queries ):
+        """The profiling mode for a request (or None).  A request may ask for a mode via the
+        X-Profile: <mode> header or ?profile=<mode> query, but only w/ the configured token (via the
+        X-Profile-Token: header or ?profile_token= query).  Otherwise, the startup mode (if any)."""
+        mode			= environ.get( 'HTTP_X_PROFILE' ) or queries.get( 'profile' )
+        if mode and self.token:
+            token		= environ.get( 'HTTP_X_PROFILE_TOKEN' ) or queries.get( 'profile_token' ) or ""
+            if hmac.compare_digest( token.encode( 'utf-8' ), self.token.encode( 'utf-8' )):
+                if mode in self.modes:
+                    return mode
+                log.warning( "Profiling %s denied; must be one of %s", mode, ", ".join( self.modes ))
+            else:
+                log.warning( "Profiling %s denied; invalid token", mode )
+        return self.mode
+
+    def run( self, mode, name, func, *args, **kwargs ):
+        """Run func under cProfile in the given mode.  Returns its (<result>, <report>); the report is
+        the stats text (inline), or the path of the profile written (file, aggregate), or None if
+        not profiled."""
+        if not mode or not self._active.acquire( blocking=False ):
+            if mode:
+                self.skipped   += 1
+            return func( *args, **kwargs ),None
+        import cProfile # Only imported if profiling
+        try:
+            profile		= cProfile.Profile()
+            profile.enable()
+            try:
+                result		= func( *args, **kwargs )
+            finally:
+                profile.disable()
+        finally:
+            self._active.release()
+        return result,getattr( self, mode )( profile, name )
+
+    def inline( self, profile, name ):
+        import pstats
+        output			= io.StringIO()
+        stats			= pstats.Stats( profile, stream=output )
+        stats.sort_stats( self.sort ).print_stats( self.top )
+        return output.getvalue()
+
+    def file( self, profile, name ):
+        os.makedirs( self.directory, exist_ok=True )
+        now			= time.time()
+        path			= os.path.join( self.directory, "%s.%03d-%s.prof" % (
+            time.strftime( "%Y%m%d-%H%M%S", time.localtime( now )), now * 1000 % 1000,
+            name.replace( '/', '_' ) or "index" ))
+        profile.dump_stats( path )
+        log.info( "Profiled %s: %s", name, path )
+        return path
+
+    def aggregate( self, profile, name ):
+        import pstats
+        with self._lock:
+            if self._aggregate is None:
+                self._aggregate	= pstats.Stats( profile )
+            else:
+                self._aggregate.add( profile )
+            self.aggregated    += 1
+            due			= self.aggregated % self.every == 1 % self.every # the 1st, every+1th, ...
+        return self.dump() if due else os.path.join( self.directory, "aggregate.prof" )
+
+    def dump( self ):
+        """Write the aggregate profile (if any); returns its path."""
+        path			= os.path.join( self.directory, "aggregate.prof" )
+        with self._lock:
+            if self._aggregate is None:
+                return None
+            os.makedirs( self.directory, exist_ok=True )
+            self._aggregate.dump_stats( path )
+        log.info( "Profiled %d requests: %s", self.aggregated, path )
+        return path
@@ -11,23 +11,80 @@ __email__                       = "perry.kundert@holo.host"
 __copyright__                   = "Copyright (c) 2019 Holo Ltd."
 __license__                     = "GPLv3 (or later)"
 
+import time
+
+# The startup phases' completion times, reported (w/ --startup-timing) at the first API response
+startup				= [ ( "begun", time.perf_counter() ) ]
+startup_timing			= False
+
 import argparse
+import hashlib
+import itertools
 import json
 import logging
 import os
+import shlex
+import signal
 import socket
 import sys
+import threading
 
 import web
 
 from .version import __version_info__
 from .web_util import *
-from .api_util import register
-from .api import rest
+from .api_util import register, unavailable, unauthorized
+from .api import ( rest, status_harvester, holoportos_jobs, batch_runner, watch_notifier, request_verifier,
+                   route_admission, holo_config, holoportos_state, renew_config )
+from .wsgi_util import servers, describe, listen_fds, unix_listener, reuseport_listener, prefork
+from .json_util import serializer
+from .metrics_util import registry
+from .profile_util import profiler
+from .log_util import log_pipeline
+
+
+class generation:
+    """A generation of the app: the register of all the available REST APIs (via rest), the text/html
+    pages (rendered via the templates/, relative to the CWD at the time of first use) and (if urls
+    are supplied) the web.py WSGI function serving them.  A new generation is built on each
+    (re)load, w/ fresh templates (and the config store renewed, so holo-config.json is re-read), and
+    swapped in as a whole; each request is served entirely by the generation current when it
+    arrived.  The code is not reloaded; new code (or command-line options) requires a restart.
+
+    """
+    numbers			= itertools.count()
+    reload_templates		= False	# Reload changed templates (eg. in debug mode)
+
+    def __init__( self, urls=None, prior=None ):
+        self.number		= next( self.numbers )
+        self.apis		= register()
+        rest( self.apis )
+        self.apis.freeze()
+        self.pages		= page_renderer( "templates/", base="layout", reload=self.reload_templates )
+        if prior:
+            renew_config()
+        self.urls		= urls
+        self.wsgifunc		= wsgi_app( urls ) if urls else None
+
+
+# The generation serving new requests; replaced by load
+serving				= generation()
+
+# Response bodies are compressed (if large enough) w/ any negotiated Accept-Encoding: content-coding
+compressor			= body_compressor( threshold=1024 )
+
+# JSON is rendered compactly (w/o indentation) for machine clients (not for browsers), if desired
+json_compact			= False
 
-# Register all the available REST APIs; available now in global `apis`
-apis				= register()
-rest( apis )
+# JSON is serialized by the fastest available encoder; results of at least stream_items items (of a
+# list, or of the lists in a dict, eg. a job's output lines) are streamed in chunks, rather than
+# being serialized into one (large) string.
+serialize			= serializer()
+stream_items			= 1000
+
+# Requests are profiled (w/ cProfile) only if requested; by the startup --profile mode, or by an
+# X-Profile: header or ?profile= query bearing the --profile-token
+profiling			= profiler( "data/profiles" )
 
 # The Server provides some known service prefixes.  Here they are; add any more when we know about
 prefixes			= [
@@ -48,10 +105,23 @@ log_cfg				= {
 # 
 
 
-def api_request( prefix, version, path, queries, environ, accept, data=None ):
+def admitted( stream, endpoint ):
+    """Yield the stream (eg. of Server-Sent Events), releasing the endpoint's admission once it ends
+    (or is closed, eg. when its client disconnects)."""
+    try:
+        yield from stream
+    finally:
+        route_admission.leave( endpoint )
+
+
+def api_request( prefix, version, path, queries, environ, accept, data=None, coding=None ):
     """A HoloPortOS admin API request.
     
-    Computes a list of 'results' dicts, and renders it as requested by "accept" encoding.
+    Computes a list of 'results' dicts, and renders it as requested by "accept" encoding.  Returns
+    the (<accept>, <response>, <etag>); the ETag is None, unless the endpoint's data is versioned.
+    A GET w/ an If-None-Match: header matching the ETag raises 304 Not Modified, before the results
+    are computed or rendered.  Each distinct representation (eg. content-coding, compact JSON) of
+    the data has its own ETag.
 
     Note that the handling of paths *without* a trailing '/' is handled unexpectedly by browsers;
     they do not consider the last segment to be a path segment in the URL, so we must ensure that,
@@ -59,15 +129,21 @@ def api_request( prefix, version, path, queries, environ, accept, data=None ):
     REQUEST_URI + the next path segment (trimming any existing).
     """
 
-    assert not queries, \
-        "Unrecognized queries: %s" % ", ".join( queries.keys() )
-
     accept			= deduce_encoding([ "application/json", "text/javascript", "text/plain",
-                                                    "text/html" ],
+                                                    "text/html", "text/event-stream" ],
                                                   environ=environ, accept=accept )
 
+    app				= environ.get( 'hpos_admin.generation' ) or serving
     status			= None # If we have a proposed HTTP Status
+    compact			= json_compact and "text/html" not in environ.get( "HTTP_ACCEPT", "" ).lower()
+    etag			= None # If the endpoint's data is versioned, its strong ETag
+    series			= ( version or "", ( path or "" ).split( '/', 1 )[0] ) # metrics labels
+    begun			= time.perf_counter()
     try:
+        if not path:
+            assert not queries, \
+                "Unrecognized queries: %s" % ", ".join( queries.keys() )
+
         if not prefix:
             # /[index[.html]]
             title		= "Service Prefixes Available"
@@ -80,19 +156,20 @@ def api_request( prefix, version, path, queries, environ, accept, data=None ):
             title		= "API Versions Available"
             results		= [
                 dict( version = f"v{'.'.join(map(str,ver))}" )
-                for ver in version_api.endpoint.keys()
+                for ver in app.apis.versions
             ]
         elif not path:
             # /<prefix>/v#[.#.#]
-            ver,api		= apis.get( version )
+            ver,api		= app.apis.get( version )
             title		= f"API v{'.'.join(map(str,ver))} Paths Available"
             results		= [
-                dict( url = f"{environ.get('REQUEST_URI').rstrip('/')}/{p}" )
+                dict( url = f"{environ.get('REQUEST_URI').rstrip('/')}/{p}", **route_admission.describe( p ))
                 for p in api
             ]
         else:
-            ver,api		= apis.get( version )
-            if path not in api: \
+            ver,api		= app.apis.get( version )
+            endpoint		= path.split( '/', 1 )[0] # eg. jobs/<id> is served by jobs
+            if endpoint not in api: \
                 raise web.HTTPError(
                     status	= "400 Bad Request",
                     headers	= {
@@ -103,36 +180,71 @@ def api_request( prefix, version, path, queries, environ, accept, data=None ):
                     ))
                 )
 
-            title		= f"API v{'.'.join(map(str,ver))} {path}"
-            results		= api[path](
-                version	= version,
-                path	= path,
-                queries	= queries,
-                environ	= environ,
-                accept	= accept,
-                data	= data )
+            unrecognized	= set( queries or () ) - set( getattr( api[endpoint], 'queries', () ))
+            assert not unrecognized, \
+                "Unrecognized queries: %s" % ", ".join( sorted( unrecognized ))
+
+            source		= getattr( api[endpoint], 'etag', None )
+            if source and accept and environ.get( 'REQUEST_METHOD', 'GET' ) == 'GET':
+                token		= source( path=path, queries=queries )
+                if token is not None:
+                    etag	= '"' + hashlib.sha1(
+                        repr( ( ver, path, accept, compact, coding, token )).encode( 'utf-8' )).hexdigest() + '"'
+                    if if_none_match( environ.get( 'HTTP_IF_NONE_MATCH' ), etag ):
+                        raise web.HTTPError(
+                            status	= "304 Not Modified",
+                            headers	= {
+                                'ETag': etag,
+                                'Cache-Control': 'no-cache',
+                            },
+                            data	= ""
+                        )
 
-        if accept and accept in ( "application/json", "text/javascript", "text/plain" ):
-            response		= ""
+            title		= f"API v{'.'.join(map(str,ver))} {path}"
+            route_admission.admit( endpoint ) # or raises unavailable (503), if overloaded
+            streaming		= False
+            try:
+                results		= api[endpoint](
+                    version	= version,
+                    path	= path,
+                    queries	= queries,
+                    environ	= environ,
+                    accept	= accept,
+                    data	= data )
+                streaming	= accept == "text/event-stream" and hasattr( results, '__next__' )
+            finally:
+                if not streaming:
+                    route_admission.leave( endpoint )
+            if streaming:
+                # The stream occupies its thread 'til it ends; it holds the admission 'til then
+                results		= admitted( results, endpoint )
+            registry.observe( "endpoint", series, time.perf_counter() - begun )
+
+        begun			= time.perf_counter()
+
+        if accept == "text/plain" and type( results ) is str:
+            # Pre-rendered text (eg. Prometheus metrics) is returned verbatim
+            response		= results
+        elif accept == "text/event-stream" and hasattr( results, '__next__' ):
+            # A stream of Server-Sent Events (eg. from watch) is returned as it is produced
+            response		= results
+        elif accept and accept in ( "application/json", "text/javascript", "text/plain" ):
             callback		= queries and queries.get( 'callback', "" ) or ""
+            streaming		= 0 <= stream_items <= serialize.items( results )
+            if streaming:
+                response	= serialize.iterdumps( results, compact=compact )
+            else:
+                response	= serialize.dumps( results, compact=compact )
             if callback:
-                response		= callback + "( "
-            response               += json.dumps( results, sort_keys=True, indent=4 )
-            if callback:
-                response           += " )"
+                response	= itertools.chain(
+                    ( callback + "( ", ), response if streaming else ( response, ), ( " )", ))
+            registry.observe( "serialize", series, time.perf_counter() - begun )
         elif accept and accept in ( "text/html" ):
-            render			= web.template.render( "templates/", base="layout" )
-    
             resultslist		= results if type( results ) is list else [results] if results else []
             resultskeys		= list( sorted( resultslist[0].keys() )) if resultslist else []
-            response		= render.keylist(
-                dict(
-                    title	= title,
-                    keys	= resultskeys,
-                    list	= resultslist
-                )
-            )
+            response		= app.pages.render( "keylist", title, resultskeys, resultslist )
             assert response, f"Failed to render {results}"
+            registry.observe( "render", series, time.perf_counter() - begun )
         else:
             # Invalid encoding requested.  Return appropriate 406 Not Acceptable
             raise web.HTTPError(
@@ -146,6 +258,52 @@ def api_request( prefix, version, path, queries, environ, accept, data=None ):
             )
     except web.HTTPError as exc:
         raise
+    except unavailable as exc:
+        # The endpoint cannot presently serve the request; the client should retry later
+        raise web.HTTPError(
+            status	= "503 Service Unavailable",
+            headers	= {
+                'Content-Type': 'application/json',
+                'Retry-After': str( exc.retry ),
+            },
+            data	= json.dumps(dict(
+                message = str( exc )
+            ))
+        )
+    except unauthorized as exc:
+        # The request's authentication (eg. its signature) is missing or invalid
+        raise web.HTTPError(
+            status	= "401 Unauthorized",
+            headers	= {
+                'Content-Type': 'application/json',
+                'WWW-Authenticate': 'Hpos-Admin-Signature realm="hpos-admin"',
+            },
+            data	= json.dumps(dict(
+                message = str( exc )
+            ))
+        )
+    except KeyError as exc:
+        # An unknown resource (eg. a job ID) within a recognized path
+        raise web.HTTPError(
+            status	= "404 Not Found",
+            headers	= {
+                'Content-Type': 'application/json',
+            },
+            data	= json.dumps(dict(
+                message = exc.args[0] if exc.args else str( exc )
+            ))
+        )
+    except ValueError as exc:
+        # Invalid request data (eg. bad JSON, or disallowed values)
+        raise web.HTTPError(
+            status	= "400 Bad Request",
+            headers	= {
+                'Content-Type': 'application/json',
+            },
+            data	= json.dumps(dict(
+                message = str( exc )
+            ))
+        )
     except Exception as exc:
         raise web.HTTPError(
             status	= "500 Internal Error",
@@ -157,15 +315,17 @@ def api_request( prefix, version, path, queries, environ, accept, data=None ):
             ))
         )
 
-    return accept,response
+    return accept,response,etag
 
 
 class api:
-    def GET( self, prefix, version, path, data=None ):
+    def GET( self, prefix, version, path, data=None, queries=None ):
         environ			= web.ctx.environ
-        queries			= web.input()
+        if queries is None:
+            queries		= web.input()
         accept			= None
-        log.info(f"api GET URI: {environ.get('REQUEST_URI')}, prefix: {prefix!r}, version: {version!r}, path: {path!r}")
+        log.info( "api GET URI: %s, prefix: %r, version: %r, path: %r",
+                  environ.get( 'REQUEST_URI' ), prefix, version, path )
 
         # Trim leading / in path, trailing .{json,html} content type requested via path extension
         if path and path.startswith('/'):
@@ -177,22 +337,67 @@ class api:
             path		= path[:-5]
             accept		= "text/html"
 
-        content,response	= api_request(
-            prefix	= prefix,
-            version	= version,
-            path	= path,
-            queries	= queries,
-            environ	= environ,
-            accept	= accept,
-            data	= data )
-
-        web.header( "Cache-Control", "no-cache" )
-        web.header( "Content-Type", content )
-        return response
+        # Record the latency of every request, and the number in flight, by version and endpoint
+        series			= ( version or "", ( path or "" ).split( '/', 1 )[0] )
+        content			= accept
+        begun			= time.perf_counter()
+        registry.begin( "inflight", series )
+        try:
+            # Profile the request, if requested; the profiling queries are not for the endpoint
+            mode		= profiling.requested( environ, queries )
+            if 'profile' in queries or 'profile_token' in queries:
+                queries		= web.storage( ( k, v ) for k,v in queries.items()
+                                                       if k not in ( 'profile', 'profile_token' ))
+            coding		= negotiate_coding( environ.get( "HTTP_ACCEPT_ENCODING" ))
+            (content,response,etag),report = profiling.run(
+                mode, "-".join( s for s in series if s ), api_request,
+                prefix	= prefix,
+                version	= version,
+                path	= path,
+                queries	= queries,
+                environ	= environ,
+                accept	= accept,
+                data	= data,
+                coding	= coding )
+            if report and mode == "inline":
+                content,response,etag = "text/plain",report,None
+            elif report:
+                web.header( "X-Profile", report )
+
+            web.header( "Cache-Control", "no-cache" )
+            web.header( "Content-Type", content )
+            web.header( "Vary", "Accept, Accept-Encoding" )
+            if etag:
+                web.header( "ETag", etag )
+            if content == "text/event-stream":
+                # Each event must be sent as it occurs; not buffered by compression, or by nginx
+                web.header( "X-Accel-Buffering", "no" )
+                return response
+            compressed		= compressor.compress( response, coding, key=etag )
+            if compressed is not None:
+                web.header( "Content-Encoding", coding )
+                return compressed
+            return response
+        finally:
+            global startup_timing
+            if startup_timing:
+                startup_timing	= False
+                startup.append( ( "responded", time.perf_counter() ))
+                startup_report()
+            registry.end( "inflight", series )
+            registry.observe( "request", series + ( content or "", web.ctx.status.split()[0] ),
+                              time.perf_counter() - begun )
 
     def POST( self, prefix, version, path ):
-        # form data is in web.input(), just like GET queries, but there could be body data
-        return self.GET( prefix, version, path, data=web.data() )
+        # The body data is the content (eg. JSON), not form data; only URL queries are queries
+        return self.GET( prefix, version, path, data=web.data(), queries=web.input( _method='get' ))
+
+    def PUT( self, prefix, version, path ):
+        # The body data is the (JSON) content, not form data; only URL queries are queries
+        return self.GET( prefix, version, path, data=web.data(), queries=web.input( _method='get' ))
+
+    def PATCH( self, prefix, version, path ):
+        return self.GET( prefix, version, path, data=web.data(), queries=web.input( _method='get' ))
 
 
 class favicon:
@@ -205,27 +410,115 @@ class favicon:
         Furthermore, they continue to request it 'til satisfied, so we do a 301
         Permanent Redirect to satisfy the browser and prevent future requests.
         So, this is the most general way to handle the favicon.ico"""
+        # Normally served directly by the static/ middleware; this redirect is for other WSGI servers
         web.redirect( 'static/icons/favicon.ico' )
 
 
-def web_api( urls, http=None ):
+def wsgi_app( urls ):
+    """The web.py application WSGI function, serving the urls table (its regexes precompiled) w/ our
+    global web.py classes."""
+    return application( urls, globals() ).wsgifunc()
+
+
+def load( urls ):
+    """Build a new generation of the app serving the urls, and swap it in for new requests; requests
+    in flight complete w/ their own generation.  Returns the new generation."""
+    global serving
+    fresh			= generation( urls, prior=serving )
+    serving			= fresh
+    log.info( "Loaded generation %d", fresh.number )
+    return fresh
+
+
+def reload( signum=None, frame=None ):
+    """Re-open the log files, and (re)load a new generation of the app serving the same urls; eg. on
+    SIGHUP.  Any failure is logged, and the current generation remains."""
+    log_pipeline.reopen()
+    try:
+        load( serving.urls )
+    except Exception as exc:
+        log.error( "Reload failed; retaining generation %d: %s", serving.number, exc )
+
+
+def dispatch( environ, start_response ):
+    """Serve the request w/ the current generation's web.py application."""
+    app				= serving
+    environ['hpos_admin.generation'] = app
+    return app.wsgifunc( environ, start_response )
+
+
+def web_api( urls, http=None, server="runsimple", drain=10.0, ready=None, **options ):
     """Get the required web.py classes from the global namespace.  The iface:port must always passed on
-    argv[1] to use app.run(), so use lower-level web.httpserver.runsimple interface, so we can bind
-    to the supplied http address."""
+    argv[1] to use app.run(), so use a lower-level WSGI server interface (by default,
+    web.httpserver.runsimple), so we can bind to the supplied http address (or serve the supplied
+    listening socket).  Any other options (eg. threads, backlog, keepalive, queue) tune the selected
+    server backend.  The current generation of the app (re)loaded w/ the urls serves each request.
+
+    On SIGTERM, the server stops accepting connections, and drains those open (for up to drain
+    seconds) before stopping; ready() (if any) is called once it is about to serve."""
     try:
-        app			= web.application( urls, globals() )
-        web.httpserver.runsimple( app.wsgifunc(), http )
-        log.info( "Web API started on %s:%s",
-                    http[0] if http else None, http[1] if http else None )
+        load( urls )
+        backend			= servers[server]( dispatch, http, **options )
+        log.info( "Web API starting on %s w/ %s server: %r", describe( http ), server, options )
+        startup.append( ( "serving", time.perf_counter() ))
+        if threading.current_thread() is threading.main_thread():
+            def retire( signum, frame ):
+                signal.signal( signal.SIGTERM, signal.SIG_IGN )
+                def drained():
+                    backend.drain( drain )
+                    backend.shutdown()
+                threading.Thread( target=drained, name="drain", daemon=True ).start()
+            signal.signal( signal.SIGTERM, retire )
+        backend.serve_forever( ready=ready )
     except socket.error:
-        log.error( "Could not bind to %s:%s for web API",
-                   http[0] if http else None, http[1] if http else None )
+        log.error( "Could not bind to %s for web API", describe( http ))
     except Exception as exc:
-        log.error( "Web API server on %s:%s failed: %s",
-                   http[0] if http else None, http[1] if http else None, exc )
+        log.error( "Web API server on %s failed: %s", describe( http ), exc )
+
+
+def api_urls( prefix='api' ):
+    """Compute the web.py urls table of (<regex>, <class name>, ...) for the API at /<prefix>, and
+    remember the selected prefix."""
+    # The api prefix/version/path regex: (/<prefix>)/(v#[.#.#])(/...)
+    api_path			= [ '' ]	# Ensure a leading '/...' after join
+    if prefix:
+        api_path.append( prefix )		# Allowing a path prefix, eg. 'api'.
+
+    # Remember the API prefix we've selected, in addition to any other prefixes we're handling
+    global prefixes
+    prefixes.append( prefix or '' )
+
+    # Every API request will have a 'prefix', 'version' and 'path' (None, if not supplied) A
+    # non-empty 'path' will contain a leading "/", *unless* its a content-type suffix, eg. .json
+    # Both of these are handled by the api.GET.
+    api_prefix			= f"({'/'.join(api_path)})" # eg. "(/<prefix>)"
+    log.info(f"API Prefix pattern:  {api_prefix!r}")
+    api_version			= r"/([vV][^/]*)"
+    log.info(f"API Version pattern: {api_version!r}")
+    api_path			= r"((?:/.+)?|(?:\..+)?)/?" # /... | [.json]; trailing / ignored
+
+    # 
+    # The web.py url endpoints, and their classes
+    # 
+    return (
+        "/favicon.ico",				"favicon",
+        api_prefix + api_version + api_path,	"api", # full:        (/<prefix>/(v#[.#[.#.]])(/...)
+        api_prefix + "()" + api_path,		"api", # versionless: (/<prefix>)()(/...)
+        "/(?:index)?()()" + api_path,		"api", # root
+    )
+
+
+def startup_report():
+    """Log the duration of each startup phase, and the total since the server module was imported."""
+    phases			= ", ".join(
+        f"{name} {( now - prior ) * 1000:.1f}ms"
+        for (_,prior),(name,now) in zip( startup, startup[1:] ))
+    log.warning( "Startup: %s; total %.1fms", phases, ( startup[-1][1] - startup[0][1] ) * 1000 )
 
 
 def main( argv=None ):
+    global json_compact, stream_items, startup_timing
+    startup.append( ( "imported", time.perf_counter() ))
     ap				= argparse.ArgumentParser(
         description = "HoloPortOS Admin API Server",
         epilog = "" )
@@ -241,64 +534,248 @@ def main( argv=None ):
                      help="Enable web server debug mode HTML output" )
     ap.add_argument( '-b', '--bind',
                      default=( "%s:%d" % address ),
-                     help="HTTP interface[:port] to bind (default: %s:%d)" % (
+                     help="HTTP interface[:port], unix:<path> socket, or fd:<n> listening socket to serve; ignored if listening sockets are passed via systemd LISTEN_FDS (default: %s:%d)" % (
                          address[0], address[1] ))
+    ap.add_argument( '--socket-mode',
+                     default="0660",
+                     help="Permissions of a unix:<path> socket, in octal (default: 0660)" )
+    ap.add_argument( '--socket-group',
+                     default=None,
+                     help="Group of a unix:<path> socket (default: our group)" )
+    ap.add_argument( '-s', '--server',
+                     default="runsimple", choices=sorted( servers ),
+                     help="WSGI server backend (default: runsimple)" )
+    ap.add_argument( '--workers',
+                     default=1, type=int,
+                     help="Worker processes serving requests, supervised and restarted if they exit (default: 1)" )
+    ap.add_argument( '--reuseport',
+                     default=False, action="store_true",
+                     help="W/ --workers, each binds its own HTTP listening socket w/ SO_REUSEPORT (default: share one)" )
+    ap.add_argument( '--drain',
+                     default=10.0, type=float,
+                     help="Seconds a stopping (or, on reload, retiring) server waits for its open connections to complete (default: 10)" )
+    ap.add_argument( '--reload-timeout',
+                     default=30.0, type=float,
+                     help="W/ --workers, seconds a reload's new workers have to become ready, or the reload fails (default: 30)" )
+    ap.add_argument( '--threads',
+                     default=10, type=int,
+                     help="Worker threads, for threadpool, wsgiref servers (default: 10)" )
+    ap.add_argument( '--backlog',
+                     default=5, type=int,
+                     help="Listen backlog, for threadpool, wsgiref servers (default: 5)" )
+    ap.add_argument( '--keepalive',
+                     default=10, type=float,
+                     help="Keep-alive (socket) timeout seconds, for threadpool, wsgiref servers (default: 10)" )
+    ap.add_argument( '--queue',
+                     default=-1, type=int,
+                     help="Accepted connection queue depth, for threadpool server (default: -1, unlimited)" )
+    ap.add_argument( '--compress-min',
+                     default=compressor.threshold, type=int,
+                     help="Compress responses of at least this many bytes; -1 disables (default: %d)" % (
+                         compressor.threshold ))
+    ap.add_argument( '--gzip-level',
+                     default=compressor.levels['gzip'], type=int,
+                     help="gzip compression level, 1-9 (default: %d)" % ( compressor.levels['gzip'] ))
+    ap.add_argument( '--deflate-level',
+                     default=compressor.levels['deflate'], type=int,
+                     help="deflate compression level, 1-9 (default: %d)" % ( compressor.levels['deflate'] ))
+    ap.add_argument( '--compact-json',
+                     default=False, action="store_true",
+                     help="Render JSON w/o indentation, except for browsers (Accept: text/html)" )
+    ap.add_argument( '--stream-items',
+                     default=stream_items, type=int,
+                     help="Stream JSON results of at least this many items (of a list, or the lists in an object, eg. a job's output); -1 disables (default: %d)" % (
+                         stream_items ))
+    ap.add_argument( '--no-metrics',
+                     default=False, action="store_true",
+                     help="Disable recording of request metrics" )
+    ap.add_argument( '--profile',
+                     default=None, choices=( "file", "aggregate" ),
+                     help="Profile every request, to a file each or in aggregate, in data/profiles/" )
+    ap.add_argument( '--profile-token',
+                     default=None,
+                     help="Profile requests w/ an X-Profile: <mode> header (or ?profile=<mode>) bearing this X-Profile-Token: (or ?profile_token=)" )
+    ap.add_argument( '--profile-top',
+                     default=profiling.top, type=int,
+                     help="Functions reported by inline profiles (default: %d)" % ( profiling.top ))
     ap.add_argument( '-p', '--prefix',
                      default='api',
                      help="App URL prefix (optional)" )
+    ap.add_argument( '--harvest',
+                     default=None, type=float,
+                     help="Harvest the status in the background every HARVEST seconds (default: on request)" )
+    ap.add_argument( '--rebuild',
+                     default="nixos-rebuild switch",
+                     help="Command to apply HoloPortOS config changes (default: nixos-rebuild switch)" )
+    ap.add_argument( '--rebuild-settle',
+                     default=holoportos_jobs.settle, type=float,
+                     help="Seconds a HoloPortOS config change must go unchanged before it is applied (default: %s)" % (
+                         holoportos_jobs.settle ))
+    ap.add_argument( '--batch-fanout',
+                     default=batch_runner.fanout, type=int,
+                     help="Threads running the calls of /batch requests, concurrently (default: %d)" % (
+                         batch_runner.fanout ))
+    ap.add_argument( '--batch-deadline',
+                     default=batch_runner.deadline, type=float,
+                     help="Seconds for all calls of a /batch request to complete (default: %s)" % (
+                         batch_runner.deadline ))
+    ap.add_argument( '--batch-limit',
+                     default=batch_runner.limit, type=int,
+                     help="The most calls allowed in a /batch request (default: %d)" % (
+                         batch_runner.limit ))
+    ap.add_argument( '--watch-limit',
+                     default=None, type=int,
+                     help="The most /watch requests waiting at once (per worker); each occupies a thread in the shared lane (default: half the --threads not --reserve'd)" )
+    ap.add_argument( '--limit',
+                     default=[], action="append",
+                     help="Limit an endpoint's requests running (and waiting) at once (per worker), eg. status=2:8 (default: %s)" % (
+                         ", ".join( f"{n}={l}:{q}" for n,(l,q) in sorted( route_admission.limits.items() ))))
+    ap.add_argument( '--reserve',
+                     default=2, type=int,
+                     help="Threads reserved for the reserved endpoints; others are refused if they would occupy them (default: 2)" )
+    ap.add_argument( '--reserved',
+                     default=",".join( sorted( route_admission.reserved )),
+                     help="Endpoints served in the reserved lane (default: %s)" % (
+                         ",".join( sorted( route_admission.reserved ))))
+    ap.add_argument( '--admission-wait',
+                     default=route_admission.wait, type=float,
+                     help="Seconds a request may wait for its endpoint, if queued (default: %s)" % (
+                         route_admission.wait ))
+    ap.add_argument( '--auth-window',
+                     default=request_verifier.window, type=int,
+                     help="Seconds (either side) of a signed request's timestamp it is accepted by /auth (default: %d)" % (
+                         request_verifier.window ))
+    ap.add_argument( '--startup-timing',
+                     default=False, action="store_true",
+                     help="Report the time taken by each startup phase, at the first API response" )
     ap.add_argument( '-l', '--log',
-                     help="Log file, if desired" )
+                     help="Log file, if desired; re-opened on SIGHUP (eg. by logrotate), which also reloads the app" )
+    ap.add_argument( '--log-queue',
+                     default=log_pipeline.capacity, type=int,
+                     help="Log records queued for a background thread to write; more are dropped (0 logs synchronously; default: %d)" % (
+                         log_pipeline.capacity ))
+    ap.add_argument( '--access-log',
+                     default=False, action="store_true",
+                     help="Log each request (w/ its timing) as a structured line, via the 'access' logger" )
     args			= ap.parse_args( argv )
 
     # If desired, run server relative to the specified directory
     if args.change_directory:
         os.chdir( args.change_directory )
     
-    # Deduce interface:port address to bind, and correct types (default is address, above)
-    http			= args.bind.split( ':' )
-    assert 1 <= len( http ) <= 2, "Invalid --address [<interface>]:[<port>}: %s" % args.bind
-    http			= ( str( http[0] ) if http[0] else address[0],
+    # Deduce interface:port address to bind, and correct types (default is address, above).  A
+    # unix:<path> socket is bound (or an fd:<n> listening socket adopted) once logging is configured.
+    if args.bind.startswith( ( "unix:", "fd:" )):
+        http			= None
+    else:
+        http			= args.bind.split( ':' )
+        assert 1 <= len( http ) <= 2, "Invalid --address [<interface>]:[<port>}: %s" % args.bind
+        http			= ( str( http[0] ) if http[0] else address[0],
                                     int( http[1] ) if len( http ) > 1 and http[1] else address[1] )
 
     web.config.debug		= bool( args.debug )
-
+    compressor.threshold	= args.compress_min
+    registry.enabled		= not args.no_metrics
+    profiling.mode		= args.profile
+    profiling.token		= args.profile_token
+    profiling.top		= args.profile_top
+    compressor.levels.update( gzip=args.gzip_level, deflate=args.deflate_level )
+    json_compact		= args.compact_json
+    stream_items		= args.stream_items
+    generation.reload_templates	= bool( args.debug ) # Reload changed templates in debug mode
+
+    log_cfg['level']		= max( logging.DEBUG, logging.WARNING - 10 * args.verbose )
     if args.log:
         # Output logging to a file, and handle UNIX-y log file rotation via 'logrotate', which sends
         # signals to indicate that a service's log file has been moved/renamed and it should re-open
         log_cfg['filename']	= args.log
 
     logging.basicConfig( **log_cfg )
-
-    # The api prefix/version/path regex: (/<prefix>)/(v#[.#.#])(/...)
-    api_path			= [ '' ]	# Ensure a leading '/...' after join
-    if args.prefix:
-        api_path.append( args.prefix )		# Allowing a path prefix, eg. 'api'.
-
-    # Remember the API prefix we've selected, in addition to any other prefixes we're handling
-    global prefixes
-    prefixes.append( args.prefix or '' )
-
-    # Every API request will have a 'prefix', 'version' and 'path' (None, if not supplied) A
-    # non-empty 'path' will contain a leading "/", *unless* its a content-type suffix, eg. .json
-    # Both of these are handled by the api.GET.
-    api_prefix			= f"({'/'.join(api_path)})" # eg. "(/<prefix>)"
-    log.info(f"API Prefix pattern:  {api_prefix!r}")
-    api_version			= r"/([vV][^/]*)"
-    log.info(f"API Version pattern: {api_version!r}")
-    api_path			= r"((?:/.+)?|(?:\..+)?)/?" # /... | [.json]; trailing / ignored
-
-    # 
-    # The web.py url endpoints, and their classes
-    # 
-    urls			= (
-        "/favicon.ico",				"favicon",
-        api_prefix + api_version + api_path,	"api", # full:        (/<prefix>/(v#[.#[.#.]])(/...)
-        api_prefix + "()" + api_path,		"api", # versionless: (/<prefix>)()(/...)
-        "/(?:index)?()()" + api_path,		"api", # root
-    )
+    if args.access_log:
+        logging.getLogger( "access" ).setLevel( logging.INFO )
+    log_pipeline.capacity	= args.log_queue
+
+    # A listening socket passed via systemd socket activation takes precedence over any --bind
+    inherited			= listen_fds()
+    if inherited:
+        if len( inherited ) > 1:
+            log.warning( "Serving only the first of %d inherited listening sockets", len( inherited ))
+        http			= inherited[0]
+    elif args.bind.startswith( "unix:" ):
+        http			= unix_listener( args.bind[5:], mode=int( args.socket_mode, 8 ),
+                                                 group=args.socket_group, backlog=args.backlog )
+    elif args.bind.startswith( "fd:" ):
+        http			= socket.socket( fileno=int( args.bind[3:] ))
+
+    urls			= api_urls( prefix=args.prefix )
+
+    holoportos_jobs.run.command = shlex.split( args.rebuild )
+    holoportos_jobs.settle	= args.rebuild_settle
+    request_verifier.window	= args.auth_window
+    for limit in args.limit:
+        # <endpoint>=<running>[:<waiting>]; a negative running limit removes any limit
+        name,counts		= limit.split( '=', 1 )
+        running,_,waiting	= counts.partition( ':' )
+        if int( running ) < 0:
+            route_admission.limits.pop( name, None )
+        else:
+            route_admission.limits[name] = ( int( running ), int( waiting or 0 ))
+    route_admission.reserved	= set( filter( None, args.reserved.split( ',' )))
+    route_admission.wait	= args.admission_wait
+    route_admission.shared	= max( 1, args.threads - args.reserve ) if args.reserve > 0 else None
+    log.info( "Admission: %r", route_admission.report() )
+    batch_runner.fanout		= args.batch_fanout
+    batch_runner.deadline	= args.batch_deadline
+    batch_runner.limit		= args.batch_limit
+    # Each waiting watcher holds a thread (and a shared lane slot); by default, leave at least half the
+    # shared lane to other requests
+    watch_notifier.limit	= args.watch_limit if args.watch_limit is not None else max(
+        1, ( route_admission.shared or args.threads ) // 2 )
+
+    startup_timing		= args.startup_timing
+    startup.append( ( "configured", time.perf_counter() ))
+
+    def serve( worker, http, ready=None ):
+        """Start this (worker) process' background threads, and serve the web API 'til interrupted.
+        A forked worker starts its own threads (none survive a fork), and profiles to its own
+        directory.  A single process reloads on SIGHUP; workers are reloaded by their supervisor."""
+        if worker is not None:
+            profiling.directory	= os.path.join( profiling.directory, f"worker-{worker}" )
+        if args.log_queue > 0:
+            # Request threads only queue their log records; a background thread writes them
+            log_pipeline.start()
+        if worker is None:
+            signal.signal( signal.SIGHUP, reload )
+        if args.harvest:
+            # Serve the status from snapshots harvested in the background, relative to our CWD
+            status_harvester.interval = args.harvest
+            status_harvester.start()
+        try:
+            web_api( urls=urls, http=http, server=args.server, drain=args.drain, ready=ready,
+                     threads=args.threads, backlog=args.backlog, keepalive=args.keepalive,
+                     queue=args.queue, access=args.access_log )
+        finally:
+            log_pipeline.stop()
+            profiling.dump()
 
     try:
-        web_api( urls=urls, http=http )
+        if args.workers <= 1:
+            return serve( None, http )
+        # The config, HoloPortOS state and jobs are shared by the workers via data/, under file locks
+        holo_config.shared	= True
+        holoportos_state.shared	= True
+        holoportos_jobs.share( "data/jobs" )
+        if isinstance( http, tuple ) and args.reuseport:
+            supervisor		= prefork( args.workers, serve,
+                                           listen=lambda: reuseport_listener( http, backlog=args.backlog ),
+                                           hangup=log_pipeline.reopen, timeout=args.reload_timeout )
+        else:
+            if isinstance( http, tuple ):
+                http		= socket.create_server( http, backlog=args.backlog )
+            supervisor		= prefork( args.workers, serve, listener=http,
+                                           hangup=log_pipeline.reopen, timeout=args.reload_timeout )
+        log.warning( "Serving %s w/ %d workers", describe( http ), args.workers )
+        return supervisor.run()
     except KeyboardInterrupt:
         log.warning( "Quitting" )
         return 0
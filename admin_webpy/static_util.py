@@ -0,0 +1,193 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import collections
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+import urllib.parse
+
+from .web_util import if_none_match, negotiate_coding
+
+log				= logging.getLogger( "static_util" )
+
+"""
+static_util.static_files -- WSGI middleware serving the static/ files from an in-memory index
+  .index  -- (Re-)build the index of all files
+  .lookup -- The (re-validated) index entry for a URL path, or None
+
+Each file's entry holds its size, a content-hash ETag, and its (small) body and gzip variant in
+memory; a pre-compressed <file>.gz is used as its gzip variant, if present.  Larger bodies are
+streamed via the server's wsgi.file_wrapper (eg. w/ sendfile), if provided.  Files w/ a content
+fingerprint in their name (eg. app.3f2a9c1d.css) are cached "forever"; all others must be
+revalidated, and are answered w/ 304 Not Modified, if unchanged.
+"""
+
+entry				= collections.namedtuple( 'entry', [
+    'path',		# The file system path
+    'signature',	# Its (mtime_ns, inode, size) when indexed
+    'size',
+    'etag',		# A strong ETag, from the content hash
+    'content_type',
+    'body',		# The content (if small enough to hold in memory), or None
+    'variants',		# { <content-coding>: <body> }; eg. a smaller gzip body
+    'cache_control',
+] )
+
+
+class static_files:
+    fingerprint_re		= re.compile( r"[.-][0-9a-f]{8,}\.[^./]+$" )
+    compressible		= ( "text/", "application/javascript", "application/json", "application/xml",
+                                    "image/svg+xml", "image/x-icon", "image/vnd.microsoft.icon" )
+    alias_cache_control		= "public, max-age=86400" # eg. /favicon.ico; a stable name, but not fingerprinted
+
+    def __init__( self, app, root="static/", prefix="/static/", aliases=None, memory=262144,
+                  compress_min=256 ):
+        self.app		= app
+        self.root		= root
+        self.prefix		= prefix
+        self.aliases		= aliases or {} # eg. { "/favicon.ico": "icons/favicon.ico" }
+        self.memory		= memory	# Bodies up to this size are held in memory
+        self.compress_min	= compress_min
+        self._lock		= threading.Lock()
+        self._index		= None		# Relative path --> entry
+
+    def signature( self, path ):
+        st			= os.stat( path )
+        return ( st.st_mtime_ns, st.st_ino, st.st_size )
+
+    def load( self, relative, signature=None ):
+        """Compute the index entry for the file at the relative path."""
+        path			= os.path.join( self.root, relative )
+        signature		= signature or self.signature( path )
+        content_type,_		= mimetypes.guess_type( relative )
+        content_type		= content_type or "application/octet-stream"
+        digest			= hashlib.sha1()
+        body			= []
+        with open( path, 'rb' ) as f:
+            for chunk in iter( lambda: f.read( 65536 ), b'' ):
+                digest.update( chunk )
+                if sum( map( len, body )) <= self.memory:
+                    body.append( chunk )
+        body			= b''.join( body ) if signature[2] <= self.memory else None
+        variants		= {}
+        if os.path.isfile( path + ".gz" ):
+            with open( path + ".gz", 'rb' ) as f:
+                variants['gzip'] = f.read()
+        elif body is not None and len( body ) >= self.compress_min \
+             and content_type.startswith( self.compressible ):
+            compressed		= gzip.compress( body, compresslevel=9, mtime=0 )
+            if len( compressed ) < len( body ):
+                variants['gzip'] = compressed
+        if self.fingerprint_re.search( relative ):
+            cache_control	= "public, max-age=31536000, immutable"
+        else:
+            cache_control	= "no-cache"
+        return entry(
+            path		= path,
+            signature		= signature,
+            size		= signature[2],
+            etag		= '"' + digest.hexdigest() + '"',
+            content_type	= content_type,
+            body		= body,
+            variants		= variants,
+            cache_control	= cache_control,
+        )
+
+    def index( self ):
+        """Index all the files under root (except pre-compressed .gz variants)."""
+        index			= {}
+        for directory,_,names in os.walk( self.root ):
+            for name in names:
+                relative	= os.path.relpath( os.path.join( directory, name ), self.root )
+                if name.endswith( ".gz" ) and os.path.isfile( os.path.join( directory, name[:-3] )):
+                    continue
+                try:
+                    index[relative.replace( os.sep, '/' )] = self.load( relative )
+                except OSError as exc:
+                    log.warning( "Failed to index %s: %s", relative, exc )
+        log.info( "Indexed %d static files in %s", len( index ), self.root )
+        self._index		= index
+        return index
+
+    def lookup( self, url ):
+        """The entry for the URL path (re-loaded, if the file has changed), or None if not a file."""
+        if url in self.aliases:
+            relative		= self.aliases[url]
+        elif url.startswith( self.prefix ):
+            relative		= posixpath.normpath( urllib.parse.unquote( url[len( self.prefix ):] ))
+            if relative.startswith( ( "../", "/" )) or relative in ( "..", "." ):
+                return None
+        else:
+            return None
+        index			= self._index
+        if index is None:
+            with self._lock:
+                index		= self._index if self._index is not None else self.index()
+        found			= index.get( relative )
+        try:
+            signature		= self.signature( os.path.join( self.root, relative ))
+        except OSError:
+            return None
+        if found is None or found.signature != signature:
+            if not os.path.isfile( os.path.join( self.root, relative )):
+                return None
+            found		= self.load( relative, signature )
+            with self._lock:
+                index[relative]	= found
+        return found
+
+    def __call__( self, environ, start_response ):
+        method			= environ.get( 'REQUEST_METHOD', 'GET' )
+        url			= environ.get( 'PATH_INFO', '' )
+        found			= self.lookup( url ) if method in ( 'GET', 'HEAD' ) else None
+        if found is None:
+            return self.app( environ, start_response )
+
+        coding			= negotiate_coding( environ.get( 'HTTP_ACCEPT_ENCODING' ), tuple( found.variants ))
+        etag			= found.etag if not coding else found.etag[:-1] + '-' + coding + '"'
+        headers			= [
+            ( 'ETag', etag ),
+            ( 'Cache-Control', self.alias_cache_control if url in self.aliases else found.cache_control ),
+        ]
+        if found.variants:
+            headers.append( ( 'Vary', 'Accept-Encoding' ))
+        if if_none_match( environ.get( 'HTTP_IF_NONE_MATCH' ), etag ):
+            start_response( "304 Not Modified", headers )
+            return []
+
+        body			= found.variants[coding] if coding else found.body
+        headers		       += [
+            ( 'Content-Type', found.content_type ),
+            ( 'Content-Length', str( len( body ) if body is not None else found.size )),
+        ]
+        if coding:
+            headers.append( ( 'Content-Encoding', coding ))
+        start_response( "200 OK", headers )
+        if method == 'HEAD':
+            return []
+        if body is not None:
+            return [ body ]
+        f			= open( found.path, 'rb' )
+        if 'wsgi.file_wrapper' in environ:
+            return environ['wsgi.file_wrapper']( f, 65536 )
+        return self.stream( f )
+
+    @staticmethod
+    def stream( f ):
+        with f:
+            for chunk in iter( lambda: f.read( 65536 ), b'' ):
+                yield chunk
@@ -0,0 +1,233 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import re
+import select
+import subprocess
+import threading
+import time
+
+from .watch_util import inotify
+
+log				= logging.getLogger( "status_util" )
+
+"""
+status_util.probe -- A named status probe function, whose result (or failure) is cached for a TTL
+  .refresh -- Returns a Future for a refresh (if stale), or None if fresh; only one is ever in flight
+  .report  -- Returns the latest (<value>, { age, stale, pending, error }) of the probe
+
+status_util.prober -- Runs a set of probes concurrently, under a single deadline
+  .harvest -- Refresh all stale probes; return { <name>: (<value>, { age, ... }) } at the deadline
+  .report  -- Return the latest { <name>: (<value>, { age, ... }) }, without refreshing
+
+status_util.harvester -- A background thread harvesting a prober into immutable snapshots
+  .start    -- Begin harvesting every interval (or on any change to the watched paths)
+  .stop     -- Stop harvesting
+  .snapshot -- The latest (generation, harvested_at, status, digest) snapshot; None until started
+"""
+
+
+class probe:
+    def __init__( self, name, func, ttl=5.0 ):
+        self.name		= name
+        self.func		= func
+        self.ttl		= ttl
+        self._lock		= threading.Lock()
+        self._value		= None	# The last successful result
+        self._error		= None	# The failure of the last refresh, if any
+        self._when		= None	# The time.monotonic() the last refresh completed
+        self._future		= None	# The refresh in flight, if any
+
+    def refresh( self, pool, force=False ):
+        """Launch a refresh in the pool if the last result is stale or force (and none is yet in flight)."""
+        with self._lock:
+            if not force and self._when is not None and time.monotonic() - self._when < self.ttl:
+                return None
+            if self._future is None:
+                self._future	= pool.submit( self._refresh )
+            return self._future
+
+    def _refresh( self ):
+        try:
+            value,error		= self.func(),None
+        except Exception as exc:
+            log.info( f"Status probe {self.name} failed: {exc}" )
+            value,error		= None,str( exc ) or exc.__class__.__name__
+        with self._lock:
+            if error is None:
+                self._value	= value
+            self._error		= error
+            self._when		= time.monotonic()
+            self._future	= None
+
+    def report( self ):
+        """The latest value, and its freshness.  Failures retain the last successful value."""
+        with self._lock:
+            age			= None if self._when is None else time.monotonic() - self._when
+            return self._value, dict(
+                age		= age,
+                stale		= age is None or age >= self.ttl,
+                pending		= self._future is not None,
+                error		= self._error,
+            )
+
+
+class prober:
+    def __init__( self, probes, deadline=0.5, threads=4 ):
+        self.probes		= probes
+        self.deadline		= deadline
+        self.pool		= concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="probe" )
+
+    def harvest( self, deadline=None, force=False ):
+        """Refresh all stale (or all, if force) probes concurrently, waiting no longer than the
+        deadline.  Probes still pending at the deadline report their last value (if any), and
+        continue in the background.
+
+        """
+        futures			= [ f for f in ( p.refresh( self.pool, force=force ) for p in self.probes ) if f ]
+        if futures:
+            concurrent.futures.wait( futures, timeout=self.deadline if deadline is None else deadline )
+        return self.report()
+
+    def report( self ):
+        return { p.name: p.report() for p in self.probes }
+
+
+snapshot			= collections.namedtuple( 'snapshot', [ 'generation', 'harvested_at', 'status', 'digest' ] )
+
+
+def digest( status ):
+    """A hash of the content of a status (eg. for use in an HTTP ETag)."""
+    return hashlib.sha1( json.dumps( status, sort_keys=True, default=str ).encode( 'utf-8' )).hexdigest()
+
+
+class harvester:
+    """Harvest all probes every interval, and whenever the watched paths change (via inotify, where
+    available; otherwise, changes are detected by the periodic harvest).  The status computed from
+    each harvest by the supplied report function is published as an immutable snapshot; readers
+    never wait on the probes.  Each snapshot carries the digest of its status (computed once, by the
+    supplied digest function), so an unchanged status has the same digest across harvests.  While
+    any probe fails (or remains pending), or the harvest itself fails, the interval is doubled (up to
+    backoff seconds) after each harvest.
+
+    """
+    def __init__( self, prober, report, interval=5.0, watch=(), backoff=60.0, digest=digest ):
+        self.prober		= prober
+        self.report		= report
+        self.digest		= digest
+        self.interval		= interval
+        self.watch		= watch
+        self.backoff		= backoff
+        self.snapshot		= None
+        self.failures		= 0
+        self._thread		= None
+        self._wakeup		= None	# The (read,write) pipe used to stop the harvester
+
+    @property
+    def running( self ):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start( self ):
+        if self.running:
+            return
+        # Until the first harvest completes, publish whatever the probes presently report
+        status			= self.report( self.prober.report() )
+        self.snapshot		= snapshot( 0, None, status, self.digest( status ))
+        self._wakeup		= os.pipe()
+        self._thread		= threading.Thread( target=self.run, name="harvester", daemon=True )
+        self._thread.start()
+
+    def stop( self, timeout=None ):
+        if self._thread is None:
+            return
+        os.write( self._wakeup[1], b'\0' )
+        self._thread.join( timeout )
+        self._thread		= None
+        for fd in self._wakeup:
+            os.close( fd )
+        self._wakeup		= None
+
+    def run( self ):
+        watcher			= None
+        if self.watch:
+            try:
+                watcher		= inotify( self.watch )
+            except OSError as exc:
+                log.warning( f"Polling for status changes every {self.interval}s: {exc}" )
+        try:
+            while True:
+                # No failure (eg. of a report) may end the harvester; it is retried after the backoff
+                try:
+                    harvest	= self.prober.harvest( deadline=self.interval, force=True )
+                    status	= self.report( harvest )
+                    self.snapshot = snapshot(
+                        self.snapshot.generation + 1, time.time(), status, self.digest( status ))
+                    if any( r['error'] or r['pending'] for _,r in harvest.values() ):
+                        self.failures += 1
+                    else:
+                        self.failures = 0
+                except Exception as exc:
+                    self.failures += 1
+                    log.warning( f"Status harvest failed: {exc}" )
+                delay		= min( self.interval * 2 ** min( self.failures, 16 ), max( self.interval, self.backoff ))
+                if watcher:
+                    try:
+                        changes	= watcher.wait( delay, others=( self._wakeup[0], ))
+                        if changes:
+                            # Coalesce the burst of events from eg. a symlink replacement
+                            time.sleep( .05 )
+                            watcher.drain()
+                            log.info( f"Harvesting status after {changes} changes" )
+                    except Exception as exc:
+                        log.warning( f"Status watch failed; polling every {delay}s: {exc}" )
+                        watcher.close()
+                        watcher	= None
+                stopping,_,_	= select.select( [ self._wakeup[0] ], [], [], 0 if watcher else delay )
+                if stopping:
+                    break
+        finally:
+            if watcher:
+                watcher.close()
+
+
+# A NixOS system path, eg. /nix/store/<hash>-nixos-system-<hostname>-19.09pre123456.abcdef0, may
+# contain the channel's git commit hash as the last component of its version.
+nix_system_re			= re.compile(
+    r"(?P<hash>[0-9a-z]{32})-nixos-system-(?P<name>.+?)-(?P<version>\d+\.\d+.*?)(?:\.(?P<rev>[0-9a-f]{7,40}))?$"
+)
+
+
+def nix_system( link ):
+    """Parse the NixOS system symbolic link's target into its rev (None, if not a git build), and path."""
+    target			= os.readlink( link )
+    match			= nix_system_re.match( os.path.basename( target ))
+    assert match, \
+        f"Unrecognized NixOS system {link} -> {target}"
+    return dict(
+        rev			= match.group( 'rev' ),
+        version			= match.group( 'version' ),
+        path			= target,
+    )
+
+
+def zerotier_info( command=( "zerotier-cli", "-j", "info" ), timeout=5.0 ):
+    """Run zerotier-cli (found on the PATH), and parse its JSON info."""
+    output			= subprocess.run(
+        command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        timeout=timeout, check=True )
+    return json.loads( output.stdout )
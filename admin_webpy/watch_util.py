@@ -0,0 +1,262 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import contextlib
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import sys
+import threading
+import time
+
+log				= logging.getLogger( "watch_util" )
+
+"""
+watch_util.inotify -- Watch a set of paths for changes, via Linux inotify (raises OSError if unavailable)
+  .fileno -- The inotify file descriptor, readable when events are available (eg. for select)
+  .drain  -- Consume all available events; returns the number of events
+  .wait   -- Wait up to a timeout for any events (or for any other file descriptors to be readable)
+  .close  -- Release the inotify file descriptor
+
+watch_util.notifier -- Publish changes to a set of paths to any number of (mostly idle) subscribers
+  .wait   -- Wait up to a timeout for an event newer than a generation; returns (<generation>, <event>)
+             (or raises ConnectionAbortedError, if the waiter's peer socket is closed meanwhile)
+  .admit  -- Admit a subscriber, if fewer than the limit are subscribed (otherwise, returns False)
+  .leave  -- Release a subscriber's admission
+"""
+
+IN_MODIFY			= 0x00000002
+IN_ATTRIB			= 0x00000004
+IN_CLOSE_WRITE			= 0x00000008
+IN_MOVED_FROM			= 0x00000040
+IN_MOVED_TO			= 0x00000080
+IN_CREATE			= 0x00000100
+IN_DELETE			= 0x00000200
+IN_DELETE_SELF			= 0x00000400
+IN_MOVE_SELF			= 0x00000800
+
+# Any change to the contents of a watched file, or the entries (eg. symlinks) of a watched directory
+IN_CHANGES			= IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO \
+                                | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+# The peer has closed (or shut down writing to) a connection; where unavailable, only a connection
+# closed in both directions (POLLHUP, always reported) is detected
+POLLRDHUP			= getattr( select, 'POLLRDHUP', 0 )
+
+_libc				= None
+
+
+def libc():
+    global _libc
+    if _libc is None:
+        _libc			= ctypes.CDLL( ctypes.util.find_library( "c" ), use_errno=True )
+        _libc.inotify_init1.argtypes = [ ctypes.c_int ]
+        _libc.inotify_add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+    return _libc
+
+
+class inotify:
+    def __init__( self, paths, mask=IN_CHANGES ):
+        try:
+            init1		= libc().inotify_init1
+        except AttributeError as exc:
+            raise OSError( errno.ENOSYS, f"inotify unavailable: {exc}" )
+        self.fd			= init1( os.O_NONBLOCK | os.O_CLOEXEC )
+        if self.fd < 0:
+            raise OSError( ctypes.get_errno(), f"inotify_init1 failed: {os.strerror( ctypes.get_errno() )}" )
+        try:
+            for path in paths:
+                wd		= libc().inotify_add_watch( self.fd, os.fsencode( path ), mask )
+                if wd < 0:
+                    raise OSError( ctypes.get_errno(), f"inotify_add_watch {path} failed: {os.strerror( ctypes.get_errno() )}" )
+                log.info( "Watching %s via inotify", path )
+        except Exception:
+            self.close()
+            raise
+
+    def fileno( self ):
+        return self.fd
+
+    def drain( self ):
+        events			= 0
+        while True:
+            try:
+                data		= os.read( self.fd, 65536 )
+            except BlockingIOError:
+                return events
+            # Each event is a 16-byte struct inotify_event, followed by its (padded) name
+            while data:
+                length		= int.from_bytes( data[12:16], sys.byteorder )
+                data		= data[16+length:]
+                events	       += 1
+
+    def wait( self, timeout=None, others=() ):
+        """Wait for inotify events (draining them), or any others to be readable.  Returns the number of
+        inotify events drained (0 on timeout, or if one of the others became readable)."""
+        readable,_,_		= select.select( [ self.fd ] + list( others ), [], [], timeout )
+        return self.drain() if self.fd in readable else 0
+
+    def close( self ):
+        if self.fd >= 0:
+            os.close( self.fd )
+            self.fd		= -1
+
+
+class notifier:
+    """A single thread detects changes to the paths' signature( ), and publishes each change as an
+    event (computed once, by publish( <changed names> ), and shared by all subscribers).  Changes are
+    detected via inotify on the paths, where available; the signature is also checked every interval
+    (so, changes are detected by polling, where inotify is unavailable).  A burst of changes is
+    coalesced into one event.  Waiting subscribers are blocked on a condition; they never poll.
+
+    A subscriber may wait w/ its client's (peer) socket; the same thread watches each waiting peer,
+    and wakes the subscriber as soon as its client closes the connection (instead of when it next
+    writes to it), so its admission is promptly released.
+
+    The signature() returns a dict of {<name>: <value>}; the names whose values differ are changed.
+    The thread is started (and the initial event published) on the first wait.
+
+    """
+    def __init__( self, paths, signature, publish, interval=1.0, coalesce=.05, limit=None ):
+        self.paths		= paths
+        self.signature		= signature
+        self.publish		= publish
+        self.interval		= interval
+        self.coalesce		= coalesce
+        self.limit		= limit		# The maximum subscribers admitted at once (if any)
+        self.generation		= 0
+        self.event		= None
+        self.subscribers	= 0
+        self._signature		= None
+        self._changed		= threading.Condition()
+        self._lock		= threading.Lock()
+        self._thread		= None
+        self._peers		= {}		# The waiting subscribers' peer sockets, by fileno
+        self._hungup		= set()		# ... those whose peer has closed the connection
+        self._wakeup		= None		# A pipe, to wake the thread to watch a changed set of peers
+
+    def start( self ):
+        with self._lock:
+            if self._thread is None:
+                self.check()
+                self._wakeup	= os.pipe2( os.O_NONBLOCK | os.O_CLOEXEC )
+                self._thread	= threading.Thread( target=self.run, name="notifier", daemon=True )
+                self._thread.start()
+
+    def run( self ):
+        watcher			= None
+        try:
+            watcher		= inotify( [ p for p in self.paths if os.path.exists( p ) ])
+        except OSError as exc:
+            log.warning( "Polling for changes every %ss: %s", self.interval, exc )
+        try:
+            checking		= time.monotonic() + self.interval
+            while True:
+                changed		= False
+                for fd,events in self.poll( watcher, max( 0, checking - time.monotonic() )):
+                    if watcher and fd == watcher.fileno():
+                        changed	= True
+                    elif fd == self._wakeup[0]:
+                        with contextlib.suppress( BlockingIOError ):
+                            os.read( fd, 4096 )
+                    else:
+                        self.hangup( fd )
+                if changed:
+                    time.sleep( self.coalesce )
+                    watcher.drain()
+                elif time.monotonic() < checking:
+                    continue
+                checking	= time.monotonic() + self.interval
+                try:
+                    self.check()
+                except Exception as exc:
+                    log.warning( "Failed to check for changes: %s", exc )
+        finally:
+            if watcher:
+                watcher.close()
+
+    def poll( self, watcher, timeout ):
+        """Wait up to timeout for inotify events, a wakeup, or any waiting peer to close; returns the
+        [(<fd>, <events>), ...] ready."""
+        poller			= select.poll()
+        if watcher:
+            poller.register( watcher.fileno(), select.POLLIN )
+        poller.register( self._wakeup[0], select.POLLIN )
+        with self._changed:
+            peers		= [ fd for fd in self._peers if fd not in self._hungup ]
+        for fd in peers:
+            poller.register( fd, POLLRDHUP )
+        return poller.poll( timeout * 1000 )
+
+    def hangup( self, fd ):
+        """A waiting peer's connection is closed; wake its subscriber."""
+        with self._changed:
+            if fd in self._peers:
+                self._hungup.add( fd )
+                self._changed.notify_all()
+
+    def check( self ):
+        """Publish an event, if the signature has changed; returns the names changed."""
+        signature		= self.signature()
+        prior			= self._signature or {}
+        changed			= sorted( n for n in set( signature ) | set( prior )
+                                          if signature.get( n ) != prior.get( n ))
+        if changed:
+            event		= self.publish( changed )
+            with self._changed:
+                self._signature	= signature
+                self.generation += 1
+                self.event	= event
+                self._changed.notify_all()
+            log.info( "Published generation %d: %s changed", self.generation, ", ".join( changed ))
+        return changed
+
+    def wait( self, generation=None, timeout=None, peer=None ):
+        """Wait for an event newer than generation (returning the current one immediately, if None).
+        Returns the (<generation>, <event>); unchanged, if the timeout elapses first.  If a peer
+        socket is supplied and its connection is closed while waiting, raises ConnectionAbortedError.
+
+        """
+        self.start()
+        fd			= peer.fileno() if peer is not None and generation is not None else None
+        with self._changed:
+            if generation is None:
+                return self.generation,self.event
+            if fd is None:
+                self._changed.wait_for( lambda: self.generation > generation, timeout )
+                return self.generation,self.event
+            self._peers[fd]	= peer
+        with contextlib.suppress( BlockingIOError ):
+            os.write( self._wakeup[1], b"\0" )
+        try:
+            with self._changed:
+                self._changed.wait_for( lambda: self.generation > generation or fd in self._hungup, timeout )
+                if fd in self._hungup:
+                    raise ConnectionAbortedError( f"Watcher's peer {fd} closed the connection" )
+                return self.generation,self.event
+        finally:
+            with self._changed:
+                self._peers.pop( fd, None )
+                self._hungup.discard( fd )
+
+    def admit( self ):
+        with self._lock:
+            if self.limit is not None and self.subscribers >= self.limit:
+                return False
+            self.subscribers   += 1
+            return True
+
+    def leave( self ):
+        with self._lock:
+            self.subscribers   -= 1
@@ -9,12 +9,82 @@ __email__                       = "perry.kundert@holo.host"
 __copyright__                   = "Copyright (c) 2019 Holo Ltd."
 __license__                     = "GPLv3 (or later)"
 
+import collections
+import functools
+import gzip
+import hashlib
 import json
 import logging
+import os
+import re
+import threading
+import zlib
+
+import web
 
 log				= logging.getLogger( "web_util" )
 
 
+def parse_accept( header ):
+    """Parse an HTTP Accept: header into a tuple of (type, subtype, q, params) media ranges, ordered
+    by decreasing specificity (ie. precedence, per RFC 7231 5.3.2): "type/subtype;params" first,
+    then "type/subtype", "type/*" and finally "*/*".  The params are a (sorted) tuple of the media
+    range's "name=value" parameters (other than q).  Media ranges with an invalid q are ignored.
+
+    """
+    ranges			= []
+    for stanza in header.lower().split( ',' ):
+        # application/xml;q=0.9
+        media,*params		= [ p.strip() for p in stanza.split( ';' ) ]
+        if not media:
+            continue
+        typ,_,sub		= media.partition( '/' )
+        q			= 1.0
+        others			= []
+        try:
+            for p in params:
+                if p.startswith( "q=" ):
+                    q		= max( 0.0, min( 1.0, float( p[2:] )))
+                elif p:
+                    name,_,value = p.partition( '=' )
+                    others.append( f"{name.strip()}={value.strip()}" )
+        except ValueError:
+            log.debug( "Ignoring invalid Accept: media range %r", stanza )
+            continue
+        ranges.append( ( typ, sub or '*', q, tuple( sorted( others )) ))
+    ranges.sort( key=lambda r: ( r[0] != '*', r[1] != '*', len( r[3] )), reverse=True )
+    return tuple( ranges )
+
+
+@functools.lru_cache( maxsize=256 )
+def negotiate( header, available ):
+    """Select the first of the (ordered) tuple of available encodings w/ the highest quality in the
+    Accept: header.  The quality of each encoding is that of the most specific media range matching
+    it; an encoding only matched by a q=0 media range (or not matched at all) is not acceptable.  A
+    media range w/ parameters (eg. "text/html;level=1") matches only an encoding bearing them, so is
+    ignored for a parameterless one (eg. "text/html").  If no available encoding is acceptable,
+    returns None.  Memoized per (header, available) pair.
+
+    """
+    ranges			= parse_accept( header or "*/*" )
+    accept			= None
+    quality			= 0.0
+    for avail in available:
+        typ,sub,_,params	= parse_accept( avail )[0]
+        for r_typ,r_sub,q,r_params in ranges:
+            if r_typ in ( typ, '*' ) and r_sub in ( sub, '*' ) and set( r_params ) <= set( params ):
+                # The first (most specific) match determines avail's quality.  Since earlier
+                # available encodings are preferred, later ones must *exceed* earlier quality.
+                log.debug( "Found %16s == %s/%s;q=%.3f %s %-16s;q=%.3f",
+                           avail, r_typ, r_sub, q, '> ' if q > quality else '<=',
+                           accept, quality )
+                if q > quality:
+                    quality	= q
+                    accept	= avail
+                break
+    return accept
+
+
 def deduce_encoding( available, environ, accept=None ):
     """Deduce acceptable encoding from HTTP Accept: header:
 
@@ -35,8 +105,9 @@ def deduce_encoding( available, environ, accept=None ):
     supplied 'accept' encoding against the 'available' encodings,
     because these are the only ones known to the caller.
 
-    Otherwise, return the first acceptable encoding in 'available'.  If no
-    matching encodings are avaliable, return the (original) None.
+    Otherwise, return the first acceptable encoding in 'available' with
+    the highest quality; see negotiate.  If no matching encodings are
+    avaliable, return the (original) None.
     """
     if accept:
         # A desired encoding; make sure it is available
@@ -46,34 +117,197 @@ def deduce_encoding( available, environ, accept=None ):
         return accept
 
     # No predefined accept encoding; deduce preferred available one.  Accept:
-    # may contain */*, */json, etc.  If multiple matches, select the one with
-    # the highest Accept: quality value (our present None starts with a quality
-    # metric of 0.0).  Test available: ["application/json", "text/html"],
-    # vs. HTTP_ACCEPT
-    # "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8" Since
-    # earlier matches are for the more preferred encodings, later matches must
-    # *exceed* the quality metric of the earlier.
-    accept		= None # may be "", False, {}, [], ()
-    HTTP_ACCEPT		= environ.get( "HTTP_ACCEPT", "*/*" ).lower() if environ else "*/*"
-    quality		= 0.0
-    for stanza in HTTP_ACCEPT.split( ',' ):
-        # application/xml;q=0.9
-        q		= 1.0
-        for encoding in reversed( stanza.split( ';' )):
-            if encoding.startswith( "q=" ):
-                q	= float( encoding[2:] )
-        for avail in available:
-            match	= True
-            for a, t in zip( avail.split( '/' ), encoding.split( '/' )):
-                if a != t and t != '*':
-                    match = False
-            if match:
-                log.debug( "Found %16s == %-16s;q=%.1f %s %-16s;q=%.1f",
-                           avail, encoding, q,
-                           '> ' if q > quality else '<=',
-                           accept, quality )
-                if q > quality:
-                    quality	= q
-                    accept	= avail
-    return accept
+    # may contain */*, text/*, etc.  Each distinct Accept: header is parsed
+    # and negotiated once (per set of available encodings), and memoized.
+    HTTP_ACCEPT		= environ.get( "HTTP_ACCEPT", "*/*" ) if environ else "*/*"
+    return negotiate( HTTP_ACCEPT, tuple( available ))
+
+
+@functools.lru_cache( maxsize=64 )
+def negotiate_coding( header, available=( "gzip", "deflate" )):
+    """Select the first of the available content-codings w/ the highest quality in the HTTP
+    Accept-Encoding: header (eg. "gzip, deflate, br;q=0.5"), or None (ie. identity).  A "*" matches
+    any coding not otherwise listed, and a q=0 excludes a coding.  Memoized per header.
+
+    """
+    if not header:
+        return None
+    qualities			= {}
+    for stanza in header.lower().split( ',' ):
+        coding,*params		= [ p.strip() for p in stanza.split( ';' ) ]
+        q			= 1.0
+        try:
+            for p in params:
+                if p.startswith( "q=" ):
+                    q		= float( p[2:] )
+        except ValueError:
+            continue
+        if coding:
+            qualities[coding]	= q
+    coding			= None
+    quality			= 0.0
+    for avail in available:
+        q			= qualities.get( avail, qualities.get( '*', 0.0 ))
+        if q > quality:
+            quality,coding	= q,avail
+    return coding
+
+
+class body_compressor:
+    """Compress response bodies of at least threshold bytes w/ a content-coding (gzip or deflate),
+    at the configured levels.  Compressed bodies w/ a content key (eg. an ETag) are retained in a
+    small LRU, so unchanged content is compressed only once per content-coding.  A negative
+    threshold disables compression.
+
+    """
+    def __init__( self, threshold=1024, levels=None, bodies=64 ):
+        self.threshold		= threshold
+        self.levels		= dict( gzip = 6, deflate = 6, **( levels or {} ))
+        self.bodies		= bodies
+        self._lock		= threading.Lock()
+        self._cache		= collections.OrderedDict()
+
+    def compress( self, body, coding, key=None ):
+        """Returns the body, compressed w/ the content-coding, or None if not compressed.  A body
+        which is an iterable of (streamed) chunks is always compressed, as a stream.
+
+        """
+        if not coding or self.threshold < 0:
+            return None
+        if type( body ) not in ( str, bytes ):
+            return self.stream( body, coding )
+        if len( body ) < self.threshold:
+            return None
+        if key is not None:
+            with self._lock:
+                compressed	= self._cache.get( ( key, coding ))
+                if compressed is not None:
+                    self._cache.move_to_end( ( key, coding ))
+                    return compressed
+        data			= body.encode( 'utf-8' ) if type( body ) is str else body
+        if coding == "gzip":
+            compressed		= gzip.compress( data, compresslevel=self.levels['gzip'], mtime=0 )
+        else:
+            compressed		= zlib.compress( data, self.levels['deflate'] )
+        if key is not None:
+            with self._lock:
+                self._cache[( key, coding )] = compressed
+                while len( self._cache ) > self.bodies:
+                    self._cache.popitem( last=False )
+        return compressed
+
+    def stream( self, chunks, coding ):
+        """Compress an iterable of str/bytes chunks into a generator of compressed chunks."""
+        compressor		= zlib.compressobj(
+            self.levels[coding], zlib.DEFLATED, 31 if coding == "gzip" else 15 )
+        for chunk in chunks:
+            compressed		= compressor.compress( chunk.encode( 'utf-8' ) if type( chunk ) is str else chunk )
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+
+def if_none_match( header, etag ):
+    """Does an HTTP If-None-Match: header (eg. '"abc", W/"def"', or '*') match the (strong) etag?
+    Per RFC 7232 3.2, the weak comparison function is used.
+
+    """
+    if not header:
+        return False
+    tags			= [ t.strip() for t in header.split( ',' ) ]
+    return '*' in tags or etag in ( t[2:] if t.startswith( 'W/' ) else t for t in tags )
+
+
+class application( web.application ):
+    """A web.application w/ its urls table's regexes compiled once, when the table is set.  The stock
+    web.py matches each request path against each pattern via a (locked) memo of re.compile, and two
+    regex substitutions; here, each pattern is simply matched, 'til one succeeds.
+
+    """
+    def init_mapping( self, mapping ):
+        super( application, self ).init_mapping( mapping )
+        self.compiled		= []
+        for pat,what in self.mapping:
+            self.compile( pat, what )
+
+    def add_mapping( self, pattern, classname ):
+        super( application, self ).add_mapping( pattern, classname )
+        self.compile( pattern, classname )
+
+    def compile( self, pattern, what ):
+        if isinstance( what, web.application ) or self.compiled is None:
+            self.compiled	= None	# Sub-applications are matched by prefix; use web.py's matching
+        else:
+            self.compiled.append( ( re.compile( rf"^{pattern}\Z" ), what ))
+
+    def _match( self, mapping, value ):
+        if mapping is not self.mapping or self.compiled is None:
+            return super( application, self )._match( mapping, value )
+        for regex,what in self.compiled:
+            result		= regex.match( value )
+            if result:
+                # A class name may refer to groups (eg. r"\1"), as w/ web.py's re_subm
+                return ( result.expand( what ) if isinstance( what, str ) else what ),list( result.groups() )
+        return None,None
+
+
+class page_renderer:
+    """Render text/html pages via web.py templates, compiled once and reused.  The rendered pages are
+    retained in a small LRU, keyed by a hash of the (template, title, keys, results) rendered, so
+    repeated hits on unchanged data skip rendering entirely.
+
+    In development (reload=True), the templates' mtimes are checked on each render, and the
+    templates (and all rendered pages) are discarded whenever any of them change.
+    """
+    def __init__( self, loc="templates/", base="layout", pages=64, reload=False ):
+        self.loc		= loc
+        self.base		= base
+        self.pages		= pages
+        self.reload		= reload
+        self._lock		= threading.Lock()
+        self._render		= None	# The web.template.render, created on first use
+        self._mtimes		= {}	# Template name --> st_mtime_ns, when reloading
+        self._cache		= collections.OrderedDict()
+
+    def mtimes( self, name ):
+        return {
+            n: os.stat( os.path.join( self.loc, n + ".html" )).st_mtime_ns
+            for n in ( name, self.base )
+        }
+
+    def renderer( self, name ):
+        """Return the web.template.render, (re)creating it if necessary."""
+        if self.reload:
+            mtimes		= self.mtimes( name )
+            if any( self._mtimes.get( n ) != m for n,m in mtimes.items() ):
+                with self._lock:
+                    log.info( "Reloading templates in %s: %s", self.loc, ", ".join( mtimes ))
+                    self._render = None
+                    self._cache.clear()
+                    self._mtimes.update( mtimes )
+        if self._render is None:
+            self._render	= web.template.render( self.loc, base=self.base, cache=True )
+        return self._render
 
+    def render( self, name, title, keys, results ):
+        """Render the named template w/ the content dict of title, keys and list of results."""
+        render			= self.renderer( name )
+        key			= hashlib.sha1( json.dumps(
+            [ name, title, keys, results ], sort_keys=True, default=str ).encode( 'utf-8' )).digest()
+        with self._lock:
+            response		= self._cache.get( key )
+            if response is not None:
+                self._cache.move_to_end( key )
+                return response
+        response		= str( getattr( render, name )(
+            dict(
+                title	= title,
+                keys	= keys,
+                list	= results
+            )
+        ))
+        with self._lock:
+            self._cache[key]	= response
+            while len( self._cache ) > self.pages:
+                self._cache.popitem( last=False )
+        return response
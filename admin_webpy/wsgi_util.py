@@ -0,0 +1,669 @@
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+import concurrent.futures
+import contextlib
+import ctypes
+import ctypes.util
+import itertools
+import logging
+import os
+import select
+import shutil
+import signal
+import socket
+import stat
+import threading
+import time
+import wsgiref.simple_server
+
+import web
+
+from .static_util import static_files
+from .log_util import access_logger
+
+log				= logging.getLogger( "wsgi_util" )
+
+"""
+wsgi_util.servers -- The available WSGI server backends, by name, for serving a web.py app.wsgifunc()
+  runsimple  -- web.httpserver.runsimple (the default); the cheroot server w/ its default tuning
+  threadpool -- A cheroot server w/ configurable worker threads, listen backlog, keep-alive, queue
+  wsgiref    -- A stdlib wsgiref server w/ a bounded pool of worker threads; no keep-alive
+
+Each is created w/ the (wrapped) wsgifunc, http (interface,port) address (or a pre-opened, listening
+socket) and its tuning options (and access, to log requests via the "access" logger), and each
+provides .serve_forever( ready=None ) (calling ready() once about to serve; returning on
+KeyboardInterrupt), .drain( timeout ) (stop accepting connections, and wait for those open to
+complete their requests and close) and .shutdown().  Each supplies the request's client socket as
+environ['hpos_admin.peer'] (eg. so a long-lived response may detect that its client has gone).
+
+wsgi_util.drainer -- WSGI middleware counting requests in flight; once draining, each response asks
+  its client to close the (keep-alive) connection, so its next request is made on a new one
+
+wsgi_util.prefork -- Serve in several forked worker processes, restarting any that exit
+  .run    -- Fork the workers, and supervise them 'til SIGTERM/SIGINT; returns when all have exited
+  .reload -- Fork a new generation of workers, and once they are ready, retire the prior generation
+
+wsgi_util.unix_listener -- A listening UNIX domain socket, w/ the desired permissions
+wsgi_util.reuseport_listener -- A listening TCP socket w/ SO_REUSEPORT; eg. one per worker process
+wsgi_util.listen_fds    -- The listening sockets passed via systemd socket activation (LISTEN_FDS)
+wsgi_util.describe      -- A description of an http address or listening socket, eg. for logging
+wsgi_util.exit_with_parent -- Signal this (forked) process when its parent exits; eg. a prefork worker
+"""
+
+SD_LISTEN_FDS_START		= 3
+PR_SET_PDEATHSIG		= 1
+
+
+def unix_listener( path, mode=0o660, group=None, backlog=5 ):
+    """Bind a listening UNIX domain socket at path, replacing any (stale) socket there.  The socket is
+    created w/ the desired permissions (and group, if any); it is never accessible w/ any looser
+    permissions, even briefly.
+
+    """
+    try:
+        if stat.S_ISSOCK( os.lstat( path ).st_mode ):
+            os.unlink( path )
+    except FileNotFoundError:
+        pass
+    sock			= socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    umask			= os.umask( 0o777 & ~mode )
+    try:
+        sock.bind( path )
+    except Exception:
+        sock.close()
+        raise
+    finally:
+        os.umask( umask )
+    os.chmod( path, mode )
+    if group is not None:
+        shutil.chown( path, group=group )
+    sock.listen( backlog )
+    log.info( "Listening on unix:%s (mode %04o%s)", path, mode, f", group {group}" if group else "" )
+    return sock
+
+
+def reuseport_listener( http, backlog=5 ):
+    """Bind a listening TCP socket at the http (interface,port) w/ SO_REUSEPORT, so several (eg. one
+    per worker process) may listen on the same address; the kernel balances new connections across
+    them."""
+    return socket.create_server( http, backlog=backlog, reuse_port=True )
+
+
+def listen_fds( unset=True ):
+    """The listening sockets passed by systemd socket activation: LISTEN_FDS file descriptors starting
+    at 3, iff LISTEN_PID is our PID.  The environment variables are (by default) removed, so they are
+    not inherited by any child processes (or interpreted again, eg. by cheroot).
+
+    """
+    try:
+        pid,count		= int( os.environ['LISTEN_PID'] ),int( os.environ['LISTEN_FDS'] )
+    except ( KeyError, ValueError ):
+        return []
+    finally:
+        if unset:
+            for name in ( 'LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES' ):
+                os.environ.pop( name, None )
+    if pid != os.getpid():
+        return []
+    sockets			= []
+    for fd in range( SD_LISTEN_FDS_START, SD_LISTEN_FDS_START + count ):
+        os.set_inheritable( fd, False )
+        sockets.append( socket.socket( fileno=fd ))
+    log.info( "Inherited %d listening socket(s): %s", len( sockets ), ", ".join( map( describe, sockets )))
+    return sockets
+
+
+def describe( http ):
+    """Describe an (interface,port) address, or a listening socket, eg. "http://localhost:5555/" or
+    "unix:/run/hpos-admin.sock"."""
+    if isinstance( http, socket.socket ):
+        http			= http.getsockname()
+    if isinstance( http, ( str, bytes )):
+        return "unix:%s" % ( os.fsdecode( http ) or "(unnamed)" )
+    return "http://%s:%d/" % tuple( http[:2] )
+
+
+def exit_with_parent( parent, signum=signal.SIGTERM, interval=1.0 ):
+    """Arrange for this (forked) process to be sent signum once its parent process exits, so it is
+    never left orphaned (eg. still serving, after its supervisor is killed).  Uses Linux prctl(
+    PR_SET_PDEATHSIG ), or else a thread polling every interval for a change of parent.  Returns
+    False if the parent has already exited.
+
+    """
+    try:
+        libc			= ctypes.CDLL( ctypes.util.find_library( "c" ), use_errno=True )
+        if libc.prctl( PR_SET_PDEATHSIG, int( signum ), 0, 0, 0 ) != 0:
+            raise OSError( ctypes.get_errno(), os.strerror( ctypes.get_errno() ))
+    except ( AttributeError, OSError ) as exc:
+        log.info( "Polling every %ss for exit of parent pid %d: %s", interval, parent, exc )
+        def orphaned():
+            while os.getppid() == parent:
+                time.sleep( interval )
+            os.kill( os.getpid(), signum )
+        threading.Thread( target=orphaned, name="orphaned", daemon=True ).start()
+    return os.getppid() == parent
+
+
+def middleware( wsgifunc, access=False ):
+    """Serve static/ (and /favicon.ico) from an in-memory index w/ caching headers, and log requests,
+    like web.httpserver.runsimple's StaticMiddleware and LogMiddleware.  If access, each request is
+    logged (w/ its timing) via the "access" logger, instead of being printed to wsgi.errors."""
+    static			= static_files( wsgifunc, aliases={ "/favicon.ico": "icons/favicon.ico" } )
+    if access:
+        return access_logger( static )
+    return web.httpserver.LogMiddleware( static )
+
+
+def cheroot_peer( server ):
+    """Supply each request's client socket as environ['hpos_admin.peer'], via the cheroot server's
+    (per-request) WSGI gateway."""
+    class peer_gateway( server.gateway ):
+        def get_environ( self ):
+            environ		= super().get_environ()
+            environ['hpos_admin.peer'] = self.req.conn.socket
+            return environ
+    server.gateway		= peer_gateway
+    return server
+
+
+class closing:
+    """An iterable response body, calling closed() once it is closed (after the body's own close);
+    its length (eg. of a list of one chunk, so the server may supply a Content-Length) is retained."""
+    def __init__( self, body, closed ):
+        self.body		= body
+        self.closed		= closed
+        self._close		= getattr( body, 'close', None )
+
+    def __iter__( self ):
+        return iter( self.body )
+
+    def __len__( self ):
+        return len( self.body )
+
+    def close( self ):
+        try:
+            if self._close:
+                self._close()
+        finally:
+            self.closed()
+
+
+class drainer:
+    """Count the requests in flight (from the call 'til the response body is closed).  Once draining,
+    each response carries a Connection: close, so the client makes its next request on a new
+    connection (eg. to another worker), instead of on one about to be closed.  Only for servers
+    (eg. cheroot) allowing the application to supply this hop-by-hop header."""
+    def __init__( self, app ):
+        self.app		= app
+        self.draining		= False
+        self.active		= 0
+        self._lock		= threading.Lock()
+
+    def __call__( self, environ, start_response ):
+        with self._lock:
+            self.active	       += 1
+        try:
+            if self.draining:
+                def closing_start_response( status, headers, *args ):
+                    headers	= [ h for h in headers if h[0].lower() != 'connection' ]
+                    headers.append( ( 'Connection', 'close' ))
+                    return start_response( status, headers, *args )
+                body		= self.app( environ, closing_start_response )
+            else:
+                body		= self.app( environ, start_response )
+        except BaseException:
+            self.leave()
+            raise
+        return self.counted( body, environ )
+
+    def counted( self, body, environ ):
+        """The body, completed (ie. left) once closed.  A body of the server's wsgi.file_wrapper (eg.
+        served via sendfile) is returned itself, its close hooked; any other is wrapped."""
+        wrapper			= environ.get( 'wsgi.file_wrapper' )
+        if isinstance( wrapper, type ) and isinstance( body, wrapper ):
+            try:
+                body.close	= closing( body, self.leave ).close
+                return body
+            except AttributeError:
+                pass	# eg. w/ __slots__; wrap it instead
+        return closing( body, self.leave )
+
+    def leave( self ):
+        with self._lock:
+            self.active	       -= 1
+
+
+def drain_cheroot( server, draining, timeout ):
+    """Stop the cheroot server accepting connections (its listening socket remains open, eg. for other
+    workers), and wait up to timeout for its requests in flight to complete, and for its clients to
+    close their (kept-alive) connections.  Returns True, if all have.  Uses cheroot's (private)
+    connection manager; if unavailable, only waits for the requests in flight."""
+    draining.draining		= True
+    connections			= getattr( server, '_connections', None )
+    selector			= getattr( connections, '_selector', None )
+    if selector is not None and server.socket is not None:
+        with contextlib.suppress( KeyError, ValueError, OSError ):
+            selector.unregister( server.socket.fileno() )
+    def open_connections():
+        if selector is None:
+            return 0
+        return sum( 1 for _,conn in selector.connections if conn is not server )
+    deadline			= time.monotonic() + timeout
+    while draining.active or open_connections():
+        if time.monotonic() >= deadline:
+            log.warning( "Drain incomplete after %.1fs: %d requests in flight, %d connections open",
+                         timeout, draining.active, open_connections() )
+            return False
+        time.sleep( 0.05 )
+    return True
+
+
+class runsimple_server:
+    def __init__( self, wsgifunc, http, access=False, **options ):
+        self.wsgifunc		= wsgifunc
+        self.http		= http
+        self.access		= access
+        # runsimple binds only an (interface,port); serve a listening socket w/ the same (cheroot)
+        # server and default tuning, via threadpool_server
+        self.delegate		= None if isinstance( http, tuple ) else threadpool_server(
+            wsgifunc, http, access=access )
+
+        self.draining		= None
+
+    def serve_forever( self, ready=None ):
+        """As web.httpserver.runsimple, but w/ our static/ file middleware."""
+        if self.delegate:
+            return self.delegate.serve_forever( ready=ready )
+        self.draining		= drainer( middleware( self.wsgifunc, access=self.access ))
+        web.httpserver.server = cheroot_peer( web.httpserver.WSGIServer( self.http, self.draining ))
+        log.warning( "Serving %s", describe( self.http ))
+        try:
+            web.httpserver.server.prepare()
+            if ready:
+                ready()
+            web.httpserver.server.serve()
+        except ( KeyboardInterrupt, SystemExit ):
+            web.httpserver.server.stop()
+            web.httpserver.server = None
+
+    def drain( self, timeout=10.0 ):
+        if self.delegate:
+            return self.delegate.drain( timeout )
+        server			= getattr( web.httpserver, 'server', None )
+        return drain_cheroot( server, self.draining, timeout ) if server else True
+
+    def shutdown( self ):
+        if self.delegate:
+            return self.delegate.shutdown()
+        if getattr( web.httpserver, 'server', None ):
+            web.httpserver.server.stop()
+
+
+class threadpool_server:
+    def __init__( self, wsgifunc, http, threads=10, backlog=5, keepalive=10, queue=-1, access=False,
+                  **options ):
+        from cheroot import wsgi
+        listener		= http if isinstance( http, socket.socket ) else None
+        if listener:
+            http		= listener.getsockname()
+            http		= http if isinstance( http, str ) else tuple( http[:2] )
+        self.draining		= drainer( middleware( wsgifunc, access=access ))
+        self.server		= wsgi.Server(
+            http, self.draining, server_name=http if isinstance( http, str ) else http[0],
+            numthreads		= threads,
+            request_queue_size	= backlog,
+            timeout		= keepalive,
+            accepted_queue_size	= queue,
+        )
+        self.server.nodelay	= True
+        cheroot_peer( self.server )
+        if listener:
+            # Serve the pre-opened listening socket, instead of binding a new one
+            self.server.bind = self.server.bind_unix_socket = lambda *args: self.inherit( listener )
+
+    def inherit( self, listener ):
+        if listener.family in ( socket.AF_INET, socket.AF_INET6 ):
+            # As cheroot's own bind would; accepted connections inherit TCP_NODELAY
+            listener.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+        self.server.socket	= listener
+        return listener
+
+    def serve_forever( self, ready=None ):
+        log.warning( "Serving %s", describe( self.http ))
+        try:
+            self.server.prepare()
+            if ready:
+                ready()
+            self.server.serve()
+        except KeyboardInterrupt:
+            self.server.stop()
+
+    def drain( self, timeout=10.0 ):
+        return drain_cheroot( self.server, self.draining, timeout )
+
+    @property
+    def http( self ):
+        return self.server.bind_addr
+
+    def shutdown( self ):
+        self.server.stop()
+
+
+class wsgiref_request_handler( wsgiref.simple_server.WSGIRequestHandler ):
+    def address_string( self ):
+        return self.client_address[0] if self.client_address else ""
+
+    def get_environ( self ):
+        """Supply the environ entries that cheroot provides, and web.py and our APIs expect."""
+        environ			= super().get_environ()
+        environ['REQUEST_URI']	= self.path
+        environ['REMOTE_PORT']	= str( self.client_address[1] )
+        environ['ACTUAL_SERVER_PROTOCOL'] = self.request_version
+        environ['hpos_admin.peer'] = self.connection
+        return environ
+
+    def log_message( self, format, *args ):
+        log.debug( "%s - %s", self.address_string(), format % args )
+
+
+class wsgiref_pooled_server( wsgiref.simple_server.WSGIServer ):
+    """A wsgiref WSGIServer handling each request in a bounded pool of worker threads.  Binds the http
+    (interface,port), or serves a pre-opened listening socket (eg. a UNIX domain socket).  Once
+    closed, waits up to grace seconds for the connections being served, and then closes them."""
+    def __init__( self, http, threads=10, backlog=5, grace=10.0 ):
+        self.request_queue_size	= backlog
+        self.grace		= grace
+        self.pool		= concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="wsgiref" )
+        self.connections	= set()		# The connections accepted, and not yet completed
+        self._connecting	= threading.Lock()
+        if not isinstance( http, socket.socket ):
+            super().__init__( http, wsgiref_request_handler )
+            return
+        super().__init__( http.getsockname(), wsgiref_request_handler, bind_and_activate=False )
+        self.socket.close()
+        self.socket		= http
+        self.server_address	= http.getsockname()
+        if isinstance( self.server_address, str ):
+            self.server_name,self.server_port = "localhost",0
+        else:
+            self.server_name,self.server_port = self.server_address[:2]
+        self.setup_environ()
+        self.server_activate()
+
+    def process_request( self, request, client_address ):
+        if not isinstance( client_address, tuple ):
+            client_address	= ( "", 0 )	# A UNIX domain socket peer has no address
+        with self._connecting:
+            self.connections.add( request )
+        self.pool.submit( self.process_request_pooled, request, client_address )
+
+    def process_request_pooled( self, request, client_address ):
+        try:
+            self.finish_request( request, client_address )
+        except Exception:
+            self.handle_error( request, client_address )
+        finally:
+            self.shutdown_request( request )
+            with self._connecting:
+                self.connections.discard( request )
+
+    def drain( self, timeout ):
+        """Wait up to timeout for the connections being served to complete; then, shut down any that
+        remain (so their handlers fail, rather than block).  Returns True, if all completed."""
+        deadline		= time.monotonic() + timeout
+        while self.connections and time.monotonic() < deadline:
+            time.sleep( 0.05 )
+        with self._connecting:
+            remaining		= list( self.connections )
+        if remaining:
+            log.warning( "Drain incomplete after %.1fs: closing %d connections", timeout, len( remaining ))
+            for conn in remaining:
+                with contextlib.suppress( OSError ):
+                    conn.shutdown( socket.SHUT_RDWR )
+        return not remaining
+
+    def server_close( self ):
+        super().server_close()
+        drained			= self.drain( self.grace )
+        # Any handler still running (eg. blocked in the app) is abandoned, not awaited
+        self.pool.shutdown( wait=drained, cancel_futures=True )
+
+
+class wsgiref_server:
+    def __init__( self, wsgifunc, http, threads=10, backlog=5, keepalive=10, access=False, **options ):
+        # wsgiref supports only one request per connection; keepalive bounds each socket read
+        wsgiref_request_handler.timeout = keepalive
+        self.server		= wsgiref_pooled_server( http, threads=threads, backlog=backlog )
+        self.server.set_app( middleware( wsgifunc, access=access ))
+        self.closed		= threading.Event()	# Once served, and the connections drained
+
+    @property
+    def http( self ):
+        return self.server.server_address
+
+    def serve_forever( self, ready=None ):
+        log.warning( "Serving %s", describe( self.http ))
+        if ready:
+            ready()
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            self.closed.set()
+
+    def drain( self, timeout=10.0 ):
+        """Stop accepting connections; server_close (once serve_forever stops) waits up to timeout
+        for each (of only one request) to complete, and closes any remaining.  Returns True, if all
+        completed."""
+        self.server.grace	= timeout
+        self.server.shutdown()
+        self.closed.wait( timeout + 1.0 )
+        return self.closed.is_set() and not self.server.connections
+
+    def shutdown( self ):
+        self.server.shutdown()
+
+
+class prefork:
+    """Serve in several worker processes, each forked from this supervisor process to call serve(
+    index, listener, ready ) and exit.  Every worker serves the same listening socket (accepting
+    connections in turn), or if listen is supplied, its own listening socket from listen() (eg. a
+    reuseport_listener, so the kernel balances connections across the workers).  Each worker calls
+    ready() once it is about to serve.
+
+    The supervisor forwards SIGTERM and SIGINT (as SIGTERM) to the workers, which then stop serving
+    (by default, serve sees KeyboardInterrupt; serve may instead handle SIGTERM by draining its
+    connections).  On SIGHUP, it calls any hangup (eg. to re-open the supervisor's own log file),
+    and reloads: a new generation of workers is forked, and once all are ready, the prior
+    generation is sent SIGTERM; the listening socket remains open throughout, so no connection is
+    refused.  Any current worker exiting otherwise is restarted; if it exited within rapid seconds
+    of starting, only after a delay (doubling, up to 30s), so a worker failing on startup does not
+    spin.  If the supervisor itself dies (eg. is killed w/ SIGKILL), each worker is sent SIGTERM, so
+    none is left orphaned and serving.  The supervisor process must not have started any threads.
+
+    """
+    def __init__( self, workers, serve, listener=None, listen=None, hangup=None, rapid=1.0, timeout=30.0 ):
+        assert ( listener is None ) != ( listen is None ), \
+            "Supply either a listening socket, or a listen function"
+        self.workers		= workers
+        self.serve		= serve
+        self.listener		= listener
+        self.listen		= listen
+        self.hangup		= hangup
+        self.rapid		= rapid
+        self.timeout		= timeout	# Seconds a reload's new workers have to become ready
+        self.children		= {}		# pid --> ( index, started, generation )
+        self.starting		= {}		# pid --> readiness pipe, of workers awaited by a reload
+        self.generations	= itertools.count()
+        self.generation		= next( self.generations ) # The current generation of workers
+        self.stopping		= False
+        self.reloading		= False
+        self.restarts		= 0
+        self.reloads		= 0
+
+    def spawn( self, index, awaiting=False ):
+        listener		= self.listener if self.listen is None else self.listen()
+        readiness,readied	= os.pipe()
+        supervisor		= os.getpid()
+        pid			= os.fork()
+        if pid == 0:
+            status		= 1
+            try:
+                os.close( readiness )
+                signal.signal( signal.SIGTERM, self.interrupt )
+                signal.signal( signal.SIGINT, self.interrupt )
+                signal.signal( signal.SIGHUP, signal.SIG_IGN )	# 'til serve handles it
+                self.children	= {}
+                def ready():
+                    with contextlib.suppress( OSError ):
+                        os.write( readied, b"." )
+                        os.close( readied )
+                if exit_with_parent( supervisor ):
+                    status	= self.serve( index, listener, ready ) or 0
+                else:
+                    status	= 0	# The supervisor has already exited
+            except KeyboardInterrupt:
+                status		= 0
+            except BaseException:
+                log.exception( "Worker %d failed", index )
+            finally:
+                # Never return into the supervisor's code (or run its atexit handlers)
+                os._exit( status )
+        os.close( readied )
+        if awaiting:
+            self.starting[pid]	= readiness
+        else:
+            os.close( readiness )
+        self.children[pid]	= ( index, time.monotonic(), self.generation )
+        log.info( "Worker %d (generation %d) started (pid %d), serving %s", index, self.generation, pid,
+                  describe( listener ))
+        if self.listen is not None:
+            listener.close()	# The worker's own; described (above) while still open
+        return pid
+
+    def ready( self, pids, timeout ):
+        """Wait up to timeout for the (awaited) workers to be ready; True iff they all are."""
+        pending			= { self.starting.pop( pid ): pid for pid in pids }
+        deadline		= time.monotonic() + timeout
+        try:
+            while pending and not self.stopping:
+                remaining	= deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                readable,_,_	= select.select( list( pending ), [], [], remaining )
+                for fd in readable:
+                    if not os.read( fd, 1 ):
+                        log.warning( "Worker pid %d exited before it was ready", pending[fd] )
+                        return False
+                    pending.pop( fd )
+                    os.close( fd )
+            return not pending
+        finally:
+            for fd in pending:
+                os.close( fd )
+
+    def kill( self, pids, signum ):
+        for pid in pids:
+            try:
+                os.kill( pid, signum )
+            except ProcessLookupError:
+                pass
+
+    def reload( self ):
+        """Start a new generation of workers; once they are all ready to serve, retire (SIGTERM) the
+        prior generation.  If they are not all ready within timeout, retire them instead."""
+        if self.reloading or self.stopping:
+            log.warning( "Reload ignored; already %s", "reloading" if self.reloading else "stopping" )
+            return False
+        self.reloading		= True
+        try:
+            prior		= self.generation
+            retiring		= [ pid for pid,(_,_,g) in self.children.items() if g == prior ]
+            self.generation	= next( self.generations )
+            fresh		= [ self.spawn( index, awaiting=True ) for index in range( self.workers ) ]
+            if self.ready( fresh, self.timeout ):
+                self.reloads   += 1
+                log.warning( "Reloaded: generation %d ready; retiring generation %d", self.generation, prior )
+                self.kill( retiring, signal.SIGTERM )
+                return True
+            log.error( "Reload failed: generation %d not ready in %.1fs; retaining generation %d",
+                       self.generation, self.timeout, prior )
+            self.generation	= prior
+            self.kill( fresh, signal.SIGTERM )
+            return False
+        finally:
+            self.reloading	= False
+
+    @staticmethod
+    def interrupt( signum, frame ):
+        """In a worker, stop serving (once); ignore any further termination signals."""
+        signal.signal( signal.SIGTERM, signal.SIG_IGN )
+        signal.signal( signal.SIGINT, signal.SIG_IGN )
+        raise KeyboardInterrupt
+
+    def signalled( self, signum, frame ):
+        if signum == signal.SIGHUP:
+            try:
+                if self.hangup:
+                    self.hangup()
+                self.reload()
+            except Exception as exc:
+                log.error( "Reload failed: %s", exc )
+            return
+        self.stopping		= True
+        self.kill( list( self.children ), signal.SIGTERM )
+
+    def run( self ):
+        for signum in ( signal.SIGTERM, signal.SIGINT, signal.SIGHUP ):
+            signal.signal( signum, self.signalled )
+        try:
+            for index in range( self.workers ):
+                self.spawn( index )
+            return self.supervise()
+        finally:
+            # Never leave (eg. on an unexpected failure) orphaned workers serving
+            self.kill( list( self.children ), signal.SIGTERM )
+
+    def supervise( self ):
+        delay			= 0
+        while self.children:
+            try:
+                pid,status	= os.wait()
+            except ChildProcessError:
+                break
+            index,started,generation = self.children.pop( pid, ( None, None, None ))
+            if index is None or self.stopping:
+                continue
+            if generation != self.generation:
+                log.info( "Worker %d (generation %d, pid %d) retired w/ status %d", index, generation, pid,
+                          os.waitstatus_to_exitcode( status ))
+                continue
+            log.warning( "Worker %d (pid %d) exited w/ status %d; restarting", index, pid,
+                         os.waitstatus_to_exitcode( status ))
+            delay		= min( 30.0, max( 0.1, delay * 2 )) if time.monotonic() - started < self.rapid else 0
+            if delay:
+                time.sleep( delay )
+            if not self.stopping:
+                self.restarts  += 1
+                self.spawn( index )
+        log.warning( "All workers exited" )
+        return 0
+
+
+servers				= dict(
+    runsimple		= runsimple_server,
+    threadpool		= threadpool_server,
+    wsgiref		= wsgiref_server,
+)
@@ -0,0 +1,60 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_auth -- The cost of verifying a signed admin request: a new request, and a repeated one
+
+Each new request's Ed25519 signature is verified (by the `cryptography` package); a repeated (eg.
+nginx auth_request subrequest) verification of a recently verified request is only a lookup.  Uses
+a locally generated keypair:
+
+    python3 bench/bench_auth.py
+"""
+
+import json
+import os
+import sys
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.auth_util import keypair, signed, verifier, SIGNATURE_HEADER, TIMESTAMP_HEADER
+
+
+def bench( requests=200, repeats=20000 ):
+    seed,public			= keypair()
+    auth			= verifier( lambda: public )
+    now				= int( time.time() )
+    headers			= [ signed( seed, "GET", f"/api/v1/jobs/{i}", now ) for i in range( requests ) ]
+
+    begun			= time.perf_counter()
+    for i,h in enumerate( headers ):
+        auth.verify( "GET", f"/api/v1/jobs/{i}", h[SIGNATURE_HEADER], h[TIMESTAMP_HEADER] )
+    verified			= ( time.perf_counter() - begun ) / requests
+
+    begun			= time.perf_counter()
+    for i in range( repeats ):
+        h			= headers[i % requests]
+        auth.verify( "GET", f"/api/v1/jobs/{i % requests}", h[SIGNATURE_HEADER], h[TIMESTAMP_HEADER] )
+    repeated			= ( time.perf_counter() - begun ) / repeats
+
+    return dict(
+        verify_usec		= verified * 1e6,
+        repeated_usec		= repeated * 1e6,
+        verifications		= auth.verifications,
+    )
+
+
+if __name__ == "__main__":
+    print( json.dumps( bench(), sort_keys=True, indent=4 ))
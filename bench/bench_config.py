@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_config -- Compare cold (open + json.loads per GET) vs. warm (stat-validated) config GETs
+
+Uses a temporary copy of test/data/holo-config.json:
+
+    python3 bench/bench_config.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.config_store import config_store
+
+from bench_servers import test_copy
+
+
+def bench( number=10000 ):
+    with test_copy( chdir=True ):
+        return timings( number=number )
+
+
+def timings( number=10000 ):
+    def cold():
+        with open( "data/holo-config.json" ) as f:
+            config		= json.loads( f.read() )
+        return dict( admin = config['v1']['admin'] )
+
+    warm_store			= config_store( "data/holo-config.json" )
+    def warm():
+        return dict( admin = warm_store.admin() )
+
+    results			= {}
+    for name,func in ( ( "cold", cold ), ( "warm", warm ) ):
+        elapsed			= min( timeit.repeat( func, number=number, repeat=5 ))
+        results[name]		= dict( usec_per_get = elapsed / number * 1e6 )
+    results['speedup']		= results['cold']['usec_per_get'] / results['warm']['usec_per_get']
+    return results
+
+
+if __name__ == "__main__":
+    print( json.dumps( bench(), sort_keys=True, indent=4 ))
@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_encoding -- Accept: header negotiations per second, memoized vs. un-memoized
+
+The corpus of Accept: headers (w/ their expected negotiated encoding) is confirmed first; or only,
+w/ --confirm (eg. as a check):
+
+    python3 bench/bench_encoding.py [--confirm]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.web_util import deduce_encoding, negotiate
+
+available			= [ "application/json", "text/javascript", "text/plain", "text/html" ]
+
+corpus				= [
+    # No (or empty) Accept: header; the first available
+    ( None, "application/json" ),
+    ( "", "application/json" ),
+    ( "*/*", "application/json" ),
+    # Browsers
+    ( "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8", "text/html" ),
+    ( "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8", "text/html" ),
+    ( "TEXT/HTML", "text/html" ),
+    # Clients (eg. curl, requests, jQuery)
+    ( "application/json, text/javascript, */*; q=0.01", "application/json" ),
+    ( "text/plain;q=0.9,application/json;q=0.8", "text/plain" ),
+    ( "text/*", "text/javascript" ),
+    # Specificity precedence: the most specific matching media range determines quality
+    ( "text/*;q=0.5,text/html", "text/html" ),
+    ( "text/*;q=0.5,*/*;q=0.1", "text/javascript" ),
+    ( "*/*;q=0.1,application/json;q=0.2", "application/json" ),
+    # q=0 exclusion
+    ( "application/json;q=0", None ),
+    ( "*/*;q=0", None ),
+    ( "text/*, text/html;q=0", "text/javascript" ),
+    ( "*/*, application/json;q=0, text/javascript;q=0", "text/plain" ),
+    # Parameterized media ranges match only representations bearing the parameters; not ours
+    ( "text/html;level=1;q=0, text/html", "text/html" ),
+    ( "text/html;level=1", None ),
+    ( "text/html;level=1, text/*;q=0.5", "text/javascript" ),
+    # Unavailable, or invalid
+    ( "image/png", None ),
+    ( "application/json;q=abc,text/plain", "text/plain" ),
+]
+
+
+def confirm():
+    for header,expected in corpus:
+        environ			= {} if header is None else dict( HTTP_ACCEPT = header )
+        accept			= deduce_encoding( available, environ=environ )
+        assert accept == expected, \
+            f"Accept: {header!r} negotiated {accept!r}; expected {expected!r}"
+
+
+def bench( number=10000 ):
+    confirm()
+    environs			= [ dict( HTTP_ACCEPT = h ) for h,_ in corpus if h is not None ]
+    def memoized():
+        for environ in environs:
+            deduce_encoding( available, environ=environ )
+    def unmemoized():
+        negotiate.cache_clear()
+        for environ in environs:
+            negotiate.__wrapped__( environ["HTTP_ACCEPT"], tuple( available ))
+    results			= {}
+    for name,func in ( ( "memoized", memoized ), ( "unmemoized", unmemoized )):
+        elapsed			= min( timeit.repeat( func, number=number, repeat=3 ))
+        results[name]		= dict( negotiations_per_sec = number * len( environs ) / elapsed )
+    return results
+
+
+if __name__ == "__main__":
+    ap				= argparse.ArgumentParser( description="Benchmark Accept: header negotiation" )
+    ap.add_argument( '--confirm', action="store_true", help="Only confirm the corpus' negotiations" )
+    args			= ap.parse_args()
+    if args.confirm:
+        confirm()
+        print( json.dumps( dict( confirmed = len( corpus )), sort_keys=True, indent=4 ))
+    else:
+        print( json.dumps( bench(), sort_keys=True, indent=4 ))
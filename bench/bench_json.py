@@ -0,0 +1,76 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_json -- JSON serialization time vs. payload size, for each encoder and mode
+
+The payloads are lists of job-like results (eg. as from /api/v1/jobs), of increasing length:
+
+    python3 bench/bench_json.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.json_util import serializer
+
+
+def payload( count ):
+    return [
+        dict(
+            id			= n,
+            key			= "holoportos",
+            state		= dict( network = "live", sshAccess = bool( n % 2 )),
+            status		= "succeeded",
+            returncode		= 0,
+            submitted		= 1573000000.0 + n,
+            output		= [ f"building /nix/store/{n:032d}-nixos-system-holoportos" ] * 5,
+        )
+        for n in range( count )
+    ]
+
+
+def bench( counts=( 10, 100, 1000, 10000 ), seconds=.5 ):
+    stdlib,fast			= serializer( fast=False ),serializer()
+    modes			= dict(
+        json_dumps_indent	= lambda obj: json.dumps( obj, sort_keys=True, indent=4 ),
+        readable		= lambda obj: stdlib.dumps( obj ),
+        compact_json		= lambda obj: stdlib.dumps( obj, compact=True ),
+        compact_fast		= lambda obj: fast.dumps( obj, compact=True ),
+        stream_readable		= lambda obj: list( fast.iterdumps( obj )),
+        stream_compact		= lambda obj: list( fast.iterdumps( obj, compact=True )),
+    )
+    results			= dict( encoder = fast.encoder )
+    for count in counts:
+        obj			= payload( count )
+        results[str( count )]	= {}
+        for name,func in modes.items():
+            output		= func( obj )
+            size		= sum( map( len, output )) if type( output ) is list else len( output )
+            number		= max( 1, int( seconds / max( 1e-6, timeit.timeit( lambda: func( obj ), number=1 ))))
+            elapsed		= min( timeit.repeat( lambda: func( obj ), number=number, repeat=3 )) / number
+            results[str( count )][name] = dict(
+                bytes		= size,
+                msec		= elapsed * 1e3,
+                mb_per_sec	= size / elapsed / 1e6,
+            )
+    return results
+
+
+if __name__ == "__main__":
+    print( json.dumps( bench(), sort_keys=True, indent=4 ))
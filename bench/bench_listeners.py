@@ -0,0 +1,154 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_listeners -- Requests/second served via loopback TCP vs. a UNIX domain socket
+
+The server is started (python3 -m admin_webpy -C <a temporary copy of test> ...) w/ each kind of
+listener:
+
+  tcp      -- --bind 127.0.0.1:<port>
+  unix     -- --bind unix:<path>
+  fd       -- a pre-opened listening UNIX domain socket, passed as --bind fd:<n>
+  systemd  -- a pre-opened listening UNIX domain socket, passed as fd 3 w/ LISTEN_PID/LISTEN_FDS
+
+A full UNIX domain socket listen backlog fails a connect immediately (EAGAIN), rather than delaying
+it (as TCP does), so the servers are run w/ a --backlog deeper than the number of clients.  Exits
+non-zero unless every request via every kind of listener succeeds (eg. as a check, w/ fewer
+requests):
+
+    python3 bench/bench_listeners.py [--clients 8] [--requests 500]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from bench_servers import free_port, test_copy
+
+
+class unix_connection( http.client.HTTPConnection ):
+    def __init__( self, path, timeout=10 ):
+        super().__init__( "localhost", timeout=timeout )
+        self.path		= path
+
+    def connect( self ):
+        self.sock		= socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        self.sock.settimeout( self.timeout )
+        self.sock.connect( self.path )
+
+
+def connection( address ):
+    if isinstance( address, str ):
+        return unix_connection( address )
+    return http.client.HTTPConnection( *address, timeout=10 )
+
+
+def wait_responding( address, timeout=10.0 ):
+    deadline			= time.time() + timeout
+    while time.time() < deadline:
+        conn			= connection( address )
+        try:
+            conn.request( "GET", "/api/v1/ping" )
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep( .05 )
+        finally:
+            conn.close()
+    raise TimeoutError( f"Server on {address} not responding after {timeout}s" )
+
+
+def load( address, path="/api/v1/config", clients=8, requests=500 ):
+    counts			= dict( ok = 0 )
+    lock			= threading.Lock()
+    def client():
+        conn			= connection( address )
+        ok			= 0
+        for _ in range( requests ):
+            conn.request( "GET", path )
+            response		= conn.getresponse()
+            response.read()
+            ok		       += response.status == 200
+        conn.close()
+        with lock:
+            counts['ok']       += ok
+    threads			= [ threading.Thread( target=client ) for _ in range( clients ) ]
+    begun			= time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return counts['ok'], time.perf_counter() - begun
+
+
+def serve( kind, tmp, root ):
+    """Start the server (serving root) w/ the kind of listener; returns its (proc, address)."""
+    command			= [ sys.executable, "-m", "admin_webpy", "-C", root, "--server", "threadpool",
+                                    "--backlog", "64" ]
+    options			= dict( cwd=os.path.dirname( here ), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+    path			= os.path.join( tmp, f"{kind}.sock" )
+    if kind == "tcp":
+        address			= ( '127.0.0.1', free_port() )
+        return subprocess.Popen( command + [ "--bind", "%s:%d" % address ], **options ),address
+    if kind == "unix":
+        return subprocess.Popen( command + [ "--bind", f"unix:{path}" ], **options ),path
+    listener			= socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    listener.bind( path )
+    listener.listen( 64 )
+    try:
+        if kind == "fd":
+            return subprocess.Popen( command + [ "--bind", f"fd:{listener.fileno()}" ],
+                                     pass_fds=[ listener.fileno() ], **options ),path
+        def activate():
+            # As systemd does, in the child: the listening socket at fd 3, and LISTEN_PID its PID
+            os.dup2( listener.fileno(), 3 )
+            os.environ.update( LISTEN_PID=str( os.getpid() ), LISTEN_FDS="1" )
+        return subprocess.Popen( command, pass_fds=[ listener.fileno() ], preexec_fn=activate, **options ),path
+    finally:
+        listener.close()
+
+
+def bench( clients=8, requests=500 ):
+    results			= {}
+    with tempfile.TemporaryDirectory() as tmp, test_copy() as root:
+        for kind in ( "tcp", "unix", "fd", "systemd" ):
+            proc,address	= serve( kind, tmp, root )
+            try:
+                wait_responding( address )
+                ok,elapsed	= load( address, clients=clients, requests=requests )
+            finally:
+                proc.terminate()
+                proc.wait( timeout=10 )
+            results[kind]	= dict( ok = ok, requests_per_sec = ok / elapsed )
+    return results
+
+
+if __name__ == "__main__":
+    ap				= argparse.ArgumentParser( description="Benchmark requests/second via each kind of listener" )
+    ap.add_argument( '--clients', default=8, type=int )
+    ap.add_argument( '--requests', default=500, type=int, help="Requests per client" )
+    args			= ap.parse_args()
+    results			= bench( clients=args.clients, requests=args.requests )
+    print( json.dumps( results, sort_keys=True, indent=4 ))
+    sys.exit( 1 if any( r['ok'] < args.clients * args.requests for r in results.values() ) else 0 )
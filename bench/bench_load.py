@@ -0,0 +1,142 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_load -- End-to-end throughput and latency percentiles, under concurrent keep-alive load
+
+Starts the server (python3 -m admin_webpy -C <a temporary copy of test> ...) on a local port, and
+issues requests from a number of concurrent keep-alive clients, cycling through every GET route,
+each w/ every response Content-Type (Accept:) and Content-Encoding (Accept-Encoding:).  Reports the
+throughput, and the p50/p95/p99 latencies of each route and overall:
+
+    python3 bench/bench_load.py [--server threadpool] [--clients 8] [--requests 500]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from bench_servers import free_port, test_copy, wait_listening
+
+routes				= [
+    "/api/v1/ping",
+    "/api/v1/config",
+    "/api/v1/status",
+    "/api/v1/jobs",
+    "/api/v1/metrics",
+]
+accepts				= [ "application/json", "text/html" ]
+encodings			= [ "identity", "gzip", "deflate" ]
+
+
+def percentiles( latencies, points=( 50, 95, 99 )):
+    """The nearest-rank percentiles (and maximum) (in milliseconds) of the latencies (in seconds)."""
+    ordered			= sorted( latencies )
+    if not ordered:
+        return {}
+    return dict( {
+        f"p{p}_ms": ordered[min( len( ordered ) - 1, max( 0, -( -len( ordered ) * p // 100 ) - 1 ))] * 1e3
+        for p in points
+    }, max_ms = ordered[-1] * 1e3 )
+
+
+def load( address, clients=8, requests=500 ):
+    """Each client issues requests over a single keep-alive connection, cycling through every
+    (route, accept, encoding) combination.  Returns the {route: [latency, ...]}, failures, elapsed."""
+    combinations		= [ ( r, a, e ) for r in routes for a in accepts for e in encodings ]
+    latencies			= { route: [] for route in routes }
+    failures			= [ 0 ]
+    lock			= threading.Lock()
+    ready			= threading.Barrier( clients + 1 )
+    def client( offset ):
+        conn			= http.client.HTTPConnection( *address, timeout=10 )
+        conn.connect()	# Exclude the (concurrent) connection setup; a full listen backlog may delay it
+        ready.wait()
+        local			= { route: [] for route in routes }
+        failed			= 0
+        for n in range( requests ):
+            route,accept,encoding = combinations[( offset + n ) % len( combinations )]
+            begun		= time.perf_counter()
+            try:
+                conn.request( "GET", route, headers={ "Accept": accept, "Accept-Encoding": encoding })
+                response	= conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed     += 1
+                    continue
+                local[route].append( time.perf_counter() - begun )
+                if response.will_close:
+                    conn.close()
+            except Exception:
+                failed	       += 1
+                conn.close()
+        with lock:
+            for route,values in local.items():
+                latencies[route].extend( values )
+            failures[0]	       += failed
+    threads			= [ threading.Thread( target=client, args=( i, )) for i in range( clients ) ]
+    for t in threads:
+        t.start()
+    ready.wait()
+    begun			= time.perf_counter()
+    for t in threads:
+        t.join()
+    return latencies, failures[0], time.perf_counter() - begun
+
+
+def bench( server="threadpool", clients=8, requests=500, threads=10 ):
+    address			= ( '127.0.0.1', free_port() )
+    with test_copy() as root:
+        proc			= subprocess.Popen(
+            [ sys.executable, "-m", "admin_webpy", "-C", root, "-b", "%s:%d" % address,
+              "--server", server, "--threads", str( threads ) ],
+            cwd=os.path.dirname( here ), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+        try:
+            wait_listening( address )
+            load( address, clients=clients, requests=len( routes ) * 2 )	# warm up
+            latencies,failed,elapsed = load( address, clients=clients, requests=requests )
+        finally:
+            proc.terminate()
+            proc.wait( timeout=10 )
+    everything			= [ l for values in latencies.values() for l in values ]
+    return dict(
+        server			= server,
+        clients			= clients,
+        ok			= len( everything ),
+        failed			= failed,
+        requests_per_sec	= len( everything ) / elapsed,
+        latency			= percentiles( everything ),
+        routes			= {
+            route: dict( ok = len( values ), **percentiles( values ))
+            for route,values in latencies.items()
+        },
+    )
+
+
+if __name__ == "__main__":
+    ap				= argparse.ArgumentParser( description="Load test the hpos-admin-server" )
+    ap.add_argument( '--server', default="threadpool" )
+    ap.add_argument( '--clients', default=8, type=int )
+    ap.add_argument( '--requests', default=500, type=int, help="Requests per client" )
+    ap.add_argument( '--threads', default=10, type=int, help="Server threads" )
+    args			= ap.parse_args()
+    print( json.dumps( bench( server=args.server, clients=args.clients, requests=args.requests,
+                              threads=args.threads ), sort_keys=True, indent=4 ))
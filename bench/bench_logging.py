@@ -0,0 +1,136 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_logging -- The request-path cost of logging, written synchronously vs. via the log queue
+
+The cost to the calling thread of each log.info( ... ) to a log file, written synchronously (as
+before), and queued for the log_util.pipeline's background thread; by 1 and 8 concurrent threads,
+and w/ a log file device stalling .5ms per write.  Then, the end-to-end load throughput and
+latencies of a server logging at -vv to a log file: synchronously (--log-queue 0), queued (the
+default), and queued w/ the --access-log:
+
+    python3 bench/bench_logging.py [--clients 8] [--requests 500]
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from bench_servers import free_port, test_copy, wait_listening
+from bench_load import load, percentiles
+from admin_webpy.log_util import pipeline
+
+
+class stalling_file_handler( logging.FileHandler ):
+    """A log file on a slow device (eg. an SD card), stalling for some time on every write."""
+    def __init__( self, path, stall=0.0 ):
+        super().__init__( path )
+        self.stall		= stall
+
+    def flush( self ):
+        super().flush()
+        if self.stall:
+            time.sleep( self.stall )
+
+
+def per_call( path, queued, calls=20000, threads=1, stall=0.0 ):
+    """The mean microseconds per log.info( ... ) call, to a log file, by each of several threads."""
+    root			= logging.getLogger()
+    handler			= stalling_file_handler( path, stall=stall )
+    handler.setFormatter( logging.Formatter(
+        '%(asctime)s.%(msecs).03d %(thread)16x %(name)-8.8s %(levelname)-8.8s %(funcName)-10.10s %(message)s' ))
+    level			= root.level
+    root.addHandler( handler )
+    root.setLevel( logging.DEBUG )
+    queue			= pipeline( capacity=calls * threads ) if queued else None
+    if queue:
+        queue.start()
+    log				= logging.getLogger( "bench" )
+    elapsed			= []
+    def logger():
+        begun			= time.perf_counter()
+        for i in range( calls ):
+            log.info( "api GET URI: %s, prefix: %r, version: %r, path: %r", "/api/v1/ping", "/api", "v1", "/ping" )
+        elapsed.append( time.perf_counter() - begun )
+    try:
+        loggers			= [ threading.Thread( target=logger ) for _ in range( threads ) ]
+        for t in loggers:
+            t.start()
+        for t in loggers:
+            t.join()
+    finally:
+        if queue:
+            queue.stop()
+        root.removeHandler( handler )
+        root.setLevel( level )
+        handler.close()
+    return sum( elapsed ) / len( elapsed ) / calls * 1e6
+
+
+def serve( tmp, *options, clients=8, requests=500 ):
+    address			= ( '127.0.0.1', free_port() )
+    with test_copy() as root:
+        proc			= subprocess.Popen(
+            [ sys.executable, "-m", "admin_webpy", "-C", root, "-b", "%s:%d" % address,
+              "--server", "threadpool", "-vv", "--log", os.path.join( tmp, "server.log" ) ] + list( options ),
+            cwd=os.path.dirname( here ), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+        try:
+            wait_listening( address )
+            load( address, clients=clients, requests=10 )	# warm up
+            latencies,failed,elapsed = load( address, clients=clients, requests=requests )
+        finally:
+            proc.terminate()
+            proc.wait( timeout=10 )
+    everything			= [ l for values in latencies.values() for l in values ]
+    return dict(
+        ok			= len( everything ),
+        failed			= failed,
+        requests_per_sec	= len( everything ) / elapsed,
+        latency			= percentiles( everything ),
+    )
+
+
+def bench( clients=8, requests=500 ):
+    with tempfile.TemporaryDirectory() as tmp:
+        return dict(
+            log_info_usec	= {
+                f"{mode}_{threads}_threads{'_stalled' if stall else ''}": per_call(
+                    os.path.join( tmp, f"{mode}.log" ), queued=( mode == "queued" ),
+                    calls=200 if stall else 20000, threads=threads, stall=stall )
+                for mode in ( "synchronous", "queued" )
+                for threads,stall in ( ( 1, 0.0 ), ( 8, 0.0 ), ( 8, .0005 ))
+            },
+            load		= dict(
+                synchronous	= serve( tmp, "--log-queue", "0", clients=clients, requests=requests ),
+                queued		= serve( tmp, clients=clients, requests=requests ),
+                queued_access	= serve( tmp, "--access-log", clients=clients, requests=requests ),
+            ),
+        )
+
+
+if __name__ == "__main__":
+    ap				= argparse.ArgumentParser( description="Benchmark the request-path cost of logging" )
+    ap.add_argument( '--clients', default=8, type=int )
+    ap.add_argument( '--requests', default=500, type=int, help="Requests per client" )
+    args			= ap.parse_args()
+    print( json.dumps( bench( clients=args.clients, requests=args.requests ), sort_keys=True, indent=4 ))
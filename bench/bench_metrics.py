@@ -0,0 +1,90 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_metrics -- The per-request overhead of the metrics instrumentation
+
+Times the metrics operations performed for each request (a `request` histogram observation, the
+`endpoint` and `serialize` stage observations, and the `inflight` gauge begin/end), and a complete
+/api/v1/config request dispatched through the web.py application, w/ metrics enabled and disabled:
+
+    python3 bench/bench_metrics.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import timeit
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.metrics_util import metrics, registry
+
+
+def per_request( m ):
+    series			= ( "v1", "config" )
+    m.begin( "inflight", series )
+    m.observe( "endpoint", series, .0001 )
+    m.observe( "serialize", series, .0002 )
+    m.end( "inflight", series )
+    m.observe( "request", series + ( "application/json", "200" ), .0005 )
+
+
+def threaded( m, threads=8, number=20000 ):
+    """Record from several threads at once; the shards are never contended."""
+    def work():
+        for _ in range( number ):
+            per_request( m )
+    workers			= [ threading.Thread( target=work ) for _ in range( threads ) ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+
+def bench( number=100000 ):
+    results			= {}
+    for enabled in ( True, False ):
+        m			= metrics( enabled=enabled )
+        elapsed			= min( timeit.repeat( lambda: per_request( m ), number=number, repeat=3 )) / number
+        results["per_request_" + ( "enabled" if enabled else "disabled" )] = dict( usec = elapsed * 1e6 )
+
+    m				= metrics()
+    elapsed			= min( timeit.repeat( lambda: threaded( m ), number=1, repeat=3 ))
+    results["threaded_8x20000"]	= dict( usec = elapsed * 1e6 / 8 / 20000 )
+    results["prometheus"]	= dict( usec = min( timeit.repeat( m.prometheus, number=100, repeat=3 )) / 100 * 1e6 )
+
+    # A complete request through the web.py application, w/ the registry enabled and disabled
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir( tmp )
+        os.mkdir( "data" )
+        with open( "data/holo-config.json", "w" ) as f:
+            json.dump( dict( v1=dict( admin=dict( email="a@b.c", public_key="abc" ), seed="s" )), f )
+        from admin_webpy import server
+        app			= server.web.application( server.api_urls(), vars( server ))
+        for enabled in ( True, False ):
+            registry.enabled	= enabled
+            request		= lambda: app.request( "/api/v1/config", headers=dict( HTTP_ACCEPT="application/json" ))
+            assert request().status.startswith( "200" )
+            elapsed		= min( timeit.repeat( request, number=2000, repeat=3 )) / 2000
+            results["api_config_" + ( "enabled" if enabled else "disabled" )] = dict( usec = elapsed * 1e6 )
+        registry.enabled	= True
+    results["api_config_overhead_usec"] = results["api_config_enabled"]["usec"] - results["api_config_disabled"]["usec"]
+    return results
+
+
+if __name__ == "__main__":
+    print( json.dumps( bench(), sort_keys=True, indent=4 ))
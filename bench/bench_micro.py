@@ -0,0 +1,105 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_micro -- Microbenchmarks of the request handling hot paths, against a copy of test/data
+
+API version resolution (register .parse/.search), Accept: negotiation (deduce_encoding), JSON
+serialization and HTML rendering of the config, and the api_config_v1 endpoint itself:
+
+    python3 bench/bench_micro.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.api import api_config_v1, rest
+from admin_webpy.api_util import register
+from admin_webpy.web_util import deduce_encoding, negotiate, page_renderer
+from admin_webpy.json_util import serializer
+
+from bench_servers import test_copy
+
+available			= [ "application/json", "text/javascript", "text/plain", "text/html" ]
+
+
+def timed( func, seconds=.25 ):
+    """The best per-call time of func, in microseconds."""
+    number			= max( 1, int( seconds / max( 1e-7, timeit.timeit( func, number=1 ))))
+    return min( timeit.repeat( func, number=number, repeat=3 )) / number * 1e6
+
+
+def bench():
+    with test_copy( chdir=True ):
+        return timings()
+
+
+def timings():
+    apis			= register()
+    rest( apis )
+    apis.freeze()
+    results			= {}
+
+    versions			= [ "v1", "v1.0", "V1.0.0", "v1.0.x" ]
+    def resolve():
+        for v in versions:
+            try:
+                apis.search( apis.parse( v ))
+            except AssertionError:
+                pass
+    results["register_search_parse"] = timed( resolve ) / len( versions )
+    results["register_get"]	= timed( lambda: apis.get( "v1" ))
+
+    accepts			= [
+        dict( HTTP_ACCEPT = "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8" ),
+        dict( HTTP_ACCEPT = "application/json, text/javascript, */*; q=0.01" ),
+        dict( HTTP_ACCEPT = "text/*;q=0.5,*/*;q=0.1" ),
+    ]
+    def negotiated():
+        for environ in accepts:
+            deduce_encoding( available, environ=environ )
+    def unmemoized():
+        negotiate.cache_clear()
+        negotiated()
+    results["deduce_encoding"]	= timed( negotiated ) / len( accepts )
+    results["deduce_encoding_unmemoized"] = timed( unmemoized ) / len( accepts )
+
+    config			= lambda: api_config_v1(
+        version="v1", path="config", queries={}, environ=dict( REQUEST_METHOD="GET" ), accept="application/json" )
+    results["api_config_v1"]	= timed( config )
+
+    results_config		= config()
+    serialize			= serializer()
+    results["json_readable"]	= timed( lambda: serialize.dumps( results_config ))
+    results["json_compact"]	= timed( lambda: serialize.dumps( results_config, compact=True ))
+
+    pages			= page_renderer( loc="templates/" )
+    keys			= sorted( results_config )
+    rows			= [ results_config ]
+    def render( cached ):
+        if not cached:
+            pages._cache.clear()
+        pages.render( "keylist", "Config", keys, rows )
+    results["html_render"]	= timed( lambda: render( True ))
+    results["html_render_uncached"] = timed( lambda: render( False ))
+
+    return { name: dict( usec = usec ) for name,usec in results.items() }
+
+
+if __name__ == "__main__":
+    print( json.dumps( bench(), sort_keys=True, indent=4 ))
@@ -0,0 +1,68 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_register -- API version resolution vs. the number of registered API versions
+
+Compares the un-memoized .search( .parse( ... )) path (still using the frozen, pre-sorted index)
+against the memoized .get, for exact, inexact and invalid version strings:
+
+    python3 bench/bench_register.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.api_util import register
+
+
+def registered( count ):
+    """Register about count API versions, spread over majors, minors and patches."""
+    apis			= register()
+    for n in range( count ):
+        apis.add( version_tuple=( 1 + n // 100, n // 10 % 10, n % 10 ), api=dict() )
+    return apis.freeze()
+
+
+def bench( number=10000, counts=( 1, 10, 100, 500, 1000 )):
+    results			= {}
+    for count in counts:
+        apis			= registered( count )
+        versions		= [ "v1", "v1.0", "V1.0.0", "v1.0.x", "v0" ]
+        def unmemoized():
+            for v in versions:
+                try:
+                    apis.search( apis.parse( v ))
+                except AssertionError:
+                    pass
+        def memoized():
+            for v in versions:
+                try:
+                    apis.get( v )
+                except AssertionError:
+                    pass
+        results[count]		= {
+            name: dict( usec_per_get = min( timeit.repeat( func, number=number, repeat=3 ))
+                        / number / len( versions ) * 1e6 )
+            for name,func in ( ( "unmemoized", unmemoized ), ( "memoized", memoized ))
+        }
+    return results
+
+
+if __name__ == "__main__":
+    print( json.dumps( bench(), sort_keys=True, indent=4 ))
@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_reload -- Failed requests under continuous load, across repeated (SIGHUP) graceful reloads
+
+Starts the server (python3 -m admin_webpy -C <a temporary copy of test> --server threadpool ...) as
+a single process, and w/ --workers (each w/ the default admission limits), and issues requests
+continuously from concurrent keep-alive clients (cycling through every GET route, and both JSON and
+text/html), while sending it a SIGHUP every --interval seconds.  As a well-behaved client would, a
+request shed as overload (503) is retried after its Retry-After (up to --retries times).  Reports the
+requests completed, shed (and retried) and failed (w/ the reasons), and whether the server survived
+the reloads; exits non-zero if any failed (or it did not survive):
+
+    python3 bench/bench_reload.py [--workers 2] [--clients 8] [--reloads 5] [--interval 1] [--retries 3]
+"""
+
+import argparse
+import collections
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from bench_servers import free_port, test_copy, wait_listening
+from bench_load import routes, accepts
+
+
+def serve( root, *options, clients=8, reloads=5, interval=1.0, retries=3 ):
+    address			= ( '127.0.0.1', free_port() )
+    proc			= subprocess.Popen(
+        [ sys.executable, "-m", "admin_webpy", "-C", root, "-b", "%s:%d" % address,
+          "--server", "threadpool" ]
+        + list( options ),
+        cwd=os.path.dirname( here ), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+    completed			= [ 0 ]
+    shedding			= [ 0 ]
+    failures			= collections.Counter()
+    lock			= threading.Lock()
+    stop			= threading.Event()
+    def client( offset ):
+        conn			= http.client.HTTPConnection( *address, timeout=10 )
+        ok			= 0
+        shed			= 0
+        failed			= collections.Counter()
+        n			= offset
+        retry			= 0
+        while not stop.is_set():
+            route,accept	= routes[n % len( routes )],accepts[n // len( routes ) % len( accepts )]
+            try:
+                conn.request( "GET", route, headers={ "Accept": accept } )
+                response	= conn.getresponse()
+                response.read()
+                if response.will_close:
+                    conn.close()
+                if response.status == 503 and retry < retries:
+                    shed       += 1
+                    retry      += 1
+                    time.sleep( float( response.getheader( "Retry-After" ) or 1 ))
+                    continue
+                if response.status == 200:
+                    ok	       += 1
+                else:
+                    failed[f"{response.status} {route}"] += 1
+            except Exception as exc:
+                failed[type( exc ).__name__] += 1
+                conn.close()
+            n		       += 1
+            retry		= 0
+        with lock:
+            completed[0]       += ok
+            shedding[0]	       += shed
+            failures.update( failed )
+    try:
+        wait_listening( address )
+        threads			= [ threading.Thread( target=client, args=( i, )) for i in range( clients ) ]
+        for t in threads:
+            t.start()
+        for _ in range( reloads ):
+            time.sleep( interval )
+            proc.send_signal( signal.SIGHUP )
+        time.sleep( interval )
+        stop.set()
+        for t in threads:
+            t.join()
+        survived		= proc.poll() is None
+    finally:
+        proc.terminate()
+        proc.wait( timeout=30 )
+    return dict(
+        ok			= completed[0],
+        shed			= shedding[0],
+        failed			= sum( failures.values() ),
+        failures		= dict( failures ),
+        reloads			= reloads,
+        survived		= survived,
+    )
+
+
+def bench( workers=2, clients=8, reloads=5, interval=1.0, retries=3 ):
+    with test_copy() as root:
+        return dict(
+            single		= serve( root, clients=clients, reloads=reloads, interval=interval, retries=retries ),
+            workers		= serve( root, "--workers", str( workers ),
+                                         clients=clients, reloads=reloads, interval=interval, retries=retries ),
+        )
+
+
+if __name__ == "__main__":
+    ap				= argparse.ArgumentParser( description="Benchmark failed requests across graceful reloads" )
+    ap.add_argument( '--workers', default=2, type=int )
+    ap.add_argument( '--clients', default=8, type=int )
+    ap.add_argument( '--reloads', default=5, type=int )
+    ap.add_argument( '--interval', default=1.0, type=float, help="Seconds between reloads" )
+    ap.add_argument( '--retries', default=3, type=int, help="Retries of a request shed w/ 503" )
+    args			= ap.parse_args()
+    results			= bench( workers=args.workers, clients=args.clients, reloads=args.reloads,
+                                 interval=args.interval, retries=args.retries )
+    print( json.dumps( results, sort_keys=True, indent=4 ))
+    sys.exit( 1 if any( r['failed'] or not r['survived'] for r in results.values() ) else 0 )
@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_servers -- Requests/second served by each WSGI server backend, w/ concurrent clients
+
+Each backend serves the same api_urls table from a temporary copy of test/, on a local port:
+
+    python3 bench/bench_servers.py
+"""
+
+import contextlib
+import http.client
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.server import api_urls, wsgi_app
+from admin_webpy.wsgi_util import servers
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind( ( '127.0.0.1', 0 ))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def test_copy( chdir=False ):
+    """A temporary copy of test/ (its data copied; its static files and templates linked) to serve
+    from (and, optionally, work in), so no bench writes (eg. locks, jobs or profiles) into the
+    tracked test/data."""
+    test			= os.path.join( os.path.dirname( here ), "test" )
+    tmp				= tempfile.mkdtemp()
+    cwd				= os.getcwd()
+    try:
+        shutil.copytree( os.path.join( test, "data" ), os.path.join( tmp, "data" ), symlinks=True )
+        for name in ( "static", "templates" ):
+            os.symlink( os.path.realpath( os.path.join( test, name )), os.path.join( tmp, name ))
+        if chdir:
+            os.chdir( tmp )
+        yield tmp
+    finally:
+        os.chdir( cwd )
+        shutil.rmtree( tmp )
+
+
+def wait_listening( address, timeout=5.0 ):
+    deadline			= time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection( address, timeout=timeout ).close()
+            return
+        except OSError:
+            time.sleep( .05 )
+    raise TimeoutError( f"Server on {address} not listening after {timeout}s" )
+
+
+def load( address, path="/api/v1/ping", clients=8, requests=250 ):
+    """Issue requests from each of clients threads (w/ keep-alive, if the server allows it).  Returns
+    the (successful, failed, elapsed) requests."""
+    counts			= dict( ok = 0, failed = 0 )
+    lock			= threading.Lock()
+    def client():
+        conn			= http.client.HTTPConnection( *address, timeout=10 )
+        ok = failed		= 0
+        for _ in range( requests ):
+            try:
+                conn.request( "GET", path )
+                response	= conn.getresponse()
+                response.read()
+                if response.status == 200:
+                    ok	       += 1
+                else:
+                    failed     += 1
+                if response.will_close:
+                    conn.close()
+            except Exception:
+                failed	       += 1
+                conn.close()
+        with lock:
+            counts['ok']       += ok
+            counts['failed']   += failed
+    threads			= [ threading.Thread( target=client ) for _ in range( clients ) ]
+    begun			= time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return counts['ok'], counts['failed'], time.time() - begun
+
+
+def bench( clients=8, requests=250, threads=10 ):
+    with test_copy( chdir=True ):
+        urls			= api_urls( prefix='api' )
+        results			= {}
+        for name in sorted( servers ):
+            address		= ( '127.0.0.1', free_port() )
+            backend		= servers[name]( wsgi_app( urls ), address, threads=threads )
+            server		= threading.Thread( target=backend.serve_forever, daemon=True )
+            server.start()
+            try:
+                wait_listening( address )
+                ok,failed,elapsed = load( address, clients=clients, requests=requests )
+            finally:
+                backend.shutdown()
+                server.join( timeout=10 )
+            results[name]	= dict(
+                ok		= ok,
+                failed		= failed,
+                requests_per_sec	= ok / elapsed,
+            )
+    return results
+
+
+if __name__ == "__main__":
+    print( json.dumps( bench(), sort_keys=True, indent=4 ))
@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_startup -- Package import time, and server time-to-first-response
+
+Each is measured in a fresh interpreter, several times; the time-to-first-response is from the
+launch of `python3 -m admin_webpy -C <a temporary copy of test> ...` 'til the first successful
+GET /api/v1/ping:
+
+    python3 bench/bench_startup.py
+"""
+
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from bench_servers import free_port, test_copy
+
+
+def import_version():
+    """The time to import the package (eg. for just its __version__)."""
+    begun			= time.perf_counter()
+    subprocess.check_call(
+        [ sys.executable, "-c", "import admin_webpy; admin_webpy.__version__" ], cwd=os.path.dirname( here ))
+    return time.perf_counter() - begun
+
+
+def first_response( root, server="runsimple", timeout=10.0 ):
+    address			= ( '127.0.0.1', free_port() )
+    begun			= time.perf_counter()
+    proc			= subprocess.Popen(
+        [ sys.executable, "-m", "admin_webpy", "-C", root, "-b", "%s:%d" % address, "--server", server ],
+        cwd=os.path.dirname( here ), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+    try:
+        while time.perf_counter() - begun < timeout:
+            try:
+                conn		= http.client.HTTPConnection( *address, timeout=timeout )
+                conn.request( "GET", "/api/v1/ping" )
+                if conn.getresponse().status == 200:
+                    return time.perf_counter() - begun
+            except OSError:
+                time.sleep( .001 )
+            finally:
+                conn.close()
+        raise TimeoutError( f"No response from {address} after {timeout}s" )
+    finally:
+        proc.terminate()
+        proc.wait( timeout=10 )
+
+
+def bench( runs=10 ):
+    results			= {}
+    with test_copy() as root:
+        for name,func in ( ( "import_version", import_version ),
+                           ( "first_response", lambda: first_response( root ))):
+            times		= [ func() for _ in range( runs ) ]
+            results[name]	= dict(
+                median_ms	= statistics.median( times ) * 1e3,
+                min_ms		= min( times ) * 1e3,
+            )
+    return results
+
+
+if __name__ == "__main__":
+    print( json.dumps( bench(), sort_keys=True, indent=4 ))
@@ -0,0 +1,80 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+bench_workers -- End-to-end throughput scaling w/ the number of --workers processes
+
+Starts the server (python3 -m admin_webpy -C <a temporary copy of test> --server threadpool
+--workers N ...) w/ 1 up to --workers worker processes (sharing one listening socket, and w/
+--reuseport, each w/ its own), and reports the bench_load throughput and latencies of each, and the
+speedup over 1 worker:
+
+    python3 bench/bench_workers.py [--workers 4] [--clients 16] [--requests 300]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from bench_servers import free_port, test_copy, wait_listening
+from bench_load import load, percentiles
+
+
+def serve( workers, *options, clients=16, requests=300 ):
+    address			= ( '127.0.0.1', free_port() )
+    with test_copy() as root:
+        proc			= subprocess.Popen(
+            [ sys.executable, "-m", "admin_webpy", "-C", root, "-b", "%s:%d" % address,
+              "--server", "threadpool", "--workers", str( workers ) ] + list( options ),
+            cwd=os.path.dirname( here ), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+        try:
+            wait_listening( address )
+            load( address, clients=clients, requests=10 )	# warm up (every worker, probably)
+            latencies,failed,elapsed = load( address, clients=clients, requests=requests )
+        finally:
+            proc.terminate()
+            proc.wait( timeout=10 )
+    everything			= [ l for values in latencies.values() for l in values ]
+    return dict(
+        ok			= len( everything ),
+        failed			= failed,
+        requests_per_sec	= len( everything ) / elapsed,
+        latency			= percentiles( everything ),
+    )
+
+
+def bench( workers=4, clients=16, requests=300 ):
+    counts			= sorted( { 1, *( n for n in ( 2, 4, 8 ) if n < workers ), workers } )
+    results			= {}
+    for mode,options in ( ( "shared", () ), ( "reuseport", ( "--reuseport", )) ):
+        for count in counts:
+            results[f"{mode}_{count}"] = serve( count, *options, clients=clients, requests=requests )
+    for name,result in results.items():
+        result['speedup']	= result['requests_per_sec'] / results[name.split( '_' )[0] + "_1"]['requests_per_sec']
+    return results
+
+
+if __name__ == "__main__":
+    ap				= argparse.ArgumentParser( description="Benchmark throughput scaling w/ --workers" )
+    ap.add_argument( '--workers', default=min( 4, os.cpu_count() or 1 ), type=int,
+                     help="The most worker processes (default: the CPUs, up to 4)" )
+    ap.add_argument( '--clients', default=16, type=int )
+    ap.add_argument( '--requests', default=300, type=int, help="Requests per client" )
+    args			= ap.parse_args()
+    print( json.dumps( bench( workers=args.workers, clients=args.clients, requests=args.requests ),
+                       sort_keys=True, indent=4 ))
@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+check_auth -- Only validly signed admin requests, by the current key and within the window, verify
+
+Confirms that a request signed by the admin key verifies (and is then remembered), and that requests
+signed by another key, w/ a tampered signature, for another method or URI, or w/ a timestamp beyond
+the window (stale or future) are rejected as unauthorized; also, that a changed admin key forgets
+the requests verified w/ the prior key:
+
+    python3 bench/check_auth.py
+"""
+
+import json
+import os
+import sys
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.api_util import unauthorized
+from admin_webpy.auth_util import decode, encode, keypair, signed, verifier, SIGNATURE_HEADER, TIMESTAMP_HEADER
+
+
+def rejected( auth, method, uri, headers, now=None ):
+    try:
+        auth.verify( method, uri, headers[SIGNATURE_HEADER], headers[TIMESTAMP_HEADER], now=now )
+    except unauthorized:
+        return True
+    return False
+
+
+def tampered( signature ):
+    raw				= bytearray( decode( signature ))
+    raw[10]		       ^= 0x01
+    return encode( bytes( raw ))
+
+
+def check():
+    seed,public			= keypair()
+    other,_			= keypair()
+    current			= [ public ]
+    auth			= verifier( lambda: current[0], window=300 )
+    now				= int( time.time() )
+    uri				= "/api/v1/config"
+
+    valid			= signed( seed, "PUT", uri, now )
+    assert auth.verify( "PUT", uri, valid[SIGNATURE_HEADER], valid[TIMESTAMP_HEADER], now=now )
+    assert auth.verifications == 1
+    assert auth.verify( "PUT", uri, valid[SIGNATURE_HEADER], valid[TIMESTAMP_HEADER], now=now )
+    assert auth.verifications == 1, "A repeated request must be remembered, not verified again"
+
+    checks			= dict(
+        wrong_key		= ( "PUT", uri, signed( other, "PUT", uri, now ), now ),
+        tampered		= ( "PUT", uri, dict( valid, **{ SIGNATURE_HEADER: tampered( valid[SIGNATURE_HEADER] ) }), now ),
+        wrong_method		= ( "GET", uri, valid, now ),
+        wrong_uri		= ( "PUT", "/api/v1/status", valid, now ),
+        wrong_timestamp		= ( "PUT", uri, dict( valid, **{ TIMESTAMP_HEADER: str( now + 1 ) }), now ),
+        missing			= ( "PUT", uri, { SIGNATURE_HEADER: "", TIMESTAMP_HEADER: str( now ) }, now ),
+        stale			= ( "PUT", uri, signed( seed, "PUT", uri, now - auth.window - 1 ), now ),
+        future			= ( "PUT", uri, signed( seed, "PUT", uri, now + auth.window + 1 ), now ),
+        expired			= ( "PUT", uri, valid, now + auth.window + 1 ),	# The remembered request, too
+    )
+    for name,( method, path, headers, when ) in checks.items():
+        assert rejected( auth, method, path, headers, now=when ), \
+            f"A {name} request must be rejected as unauthorized"
+
+    # Within the window, either side, is valid
+    for skew in ( -auth.window, auth.window ):
+        h			= signed( seed, "PUT", uri, now + skew )
+        assert auth.verify( "PUT", uri, h[SIGNATURE_HEADER], h[TIMESTAMP_HEADER], now=now )
+
+    # A new admin key forgets the requests verified w/ the prior key, and rejects them
+    assert auth._verified
+    seed,current[0]		= keypair()
+    assert rejected( auth, "PUT", uri, valid, now=now ), \
+        "A request verified w/ the prior admin key must be rejected"
+    assert not auth._verified, "A changed admin key must forget the requests verified w/ the prior key"
+    renewed			= signed( seed, "PUT", uri, now )
+    assert auth.verify( "PUT", uri, renewed[SIGNATURE_HEADER], renewed[TIMESTAMP_HEADER], now=now )
+
+    # No (or an invalid) admin key rejects everything
+    for key in ( None, "not-a-key" ):
+        current[0]		= key
+        assert rejected( auth, "PUT", uri, renewed, now=now ), \
+            f"Requests must be rejected w/ admin key {key!r}"
+
+    return dict(
+        rejected		= len( checks ) + 3,
+        verifications		= auth.verifications,
+    )
+
+
+if __name__ == "__main__":
+    print( json.dumps( check(), sort_keys=True, indent=4 ))
@@ -0,0 +1,127 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+check_conditional -- Conditional GETs (If-None-Match:) are answered 304, w/o serializing or rendering
+
+Serves a temporary copy of test/data and templates, w/ the status harvester running; obtains the
+ETag of each versioned route (as JSON and text/html), then makes JSON serialization and template
+rendering raise, and confirms each conditional GET is still answered 304 Not Modified w/ the same
+ETag.  Also confirms that the status ETag is unchanged across harvests finding the same status:
+
+    python3 bench/check_conditional.py
+"""
+
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy import server as admin_server
+from admin_webpy.api import status_harvester
+from admin_webpy.server import api_urls, wsgi_app
+from admin_webpy.web_util import page_renderer
+from admin_webpy.wsgi_util import servers
+
+from bench_servers import free_port, wait_listening
+
+routes				= [ "/api/v1/config", "/api/v1/status" ]
+accepts				= [ "application/json", "text/html" ]
+
+
+def failing( *args, **kwds ):
+    raise AssertionError( "A 304 Not Modified must not serialize or render its results" )
+
+
+def get( conn, route, accept, etag=None ):
+    headers			= { "Accept": accept }
+    if etag:
+        headers['If-None-Match'] = etag
+    conn.request( "GET", route, headers=headers )
+    response			= conn.getresponse()
+    response.read()
+    return response.status,response.getheader( "ETag" )
+
+
+def check():
+    tmp				= tempfile.mkdtemp()
+    cwd				= os.getcwd()
+    patched			= [
+        ( json, 'dumps' ),
+        ( admin_server.serialize, 'dumps' ),
+        ( admin_server.serialize, 'iterdumps' ),
+        ( page_renderer, 'render' ),
+    ]
+    originals			= [ ( obj, name, getattr( obj, name )) for obj,name in patched ]
+    try:
+        shutil.copytree( os.path.join( os.path.dirname( here ), "test", "data" ), os.path.join( tmp, "data" ),
+                         symlinks=True )
+        shutil.copytree( os.path.join( os.path.dirname( here ), "templates" ), os.path.join( tmp, "templates" ))
+        os.chdir( tmp )
+        status_harvester.interval = 0.1
+        status_harvester.start()
+        while status_harvester.snapshot.harvested_at is None:
+            time.sleep( .01 )
+
+        address			= ( '127.0.0.1', free_port() )
+        backend			= servers['threadpool']( wsgi_app( api_urls() ), address )
+        server			= threading.Thread( target=backend.serve_forever, daemon=True )
+        server.start()
+        wait_listening( address )
+        conn			= http.client.HTTPConnection( *address, timeout=10 )
+
+        etags			= {}
+        for route in routes:
+            for accept in accepts:
+                status,etag	= get( conn, route, accept )
+                assert status == 200 and etag, \
+                    f"GET {route} as {accept} responded {status} w/ ETag {etag!r}"
+                etags[route,accept] = etag
+
+        # Later harvests (of the same, unchanged status) must retain the same status ETags
+        harvested		= status_harvester.snapshot.generation
+        while status_harvester.snapshot.generation < harvested + 2:
+            time.sleep( .05 )
+
+        for obj,name in patched:
+            setattr( obj, name, failing )
+        try:
+            for (route,accept),etag in etags.items():
+                status,current	= get( conn, route, accept, etag=etag )
+                assert status == 304 and current == etag, \
+                    f"Conditional GET {route} as {accept} w/ ETag {etag} responded {status} w/ ETag {current!r}"
+        finally:
+            for obj,name,original in originals:
+                setattr( obj, name, original )
+        backend.shutdown()
+        return dict(
+            conditional		= len( etags ),
+            harvests		= status_harvester.snapshot.generation - harvested,
+        )
+    finally:
+        for obj,name,original in originals:
+            setattr( obj, name, original )
+        status_harvester.stop()
+        os.chdir( cwd )
+        shutil.rmtree( tmp )
+
+
+if __name__ == "__main__":
+    print( json.dumps( check(), sort_keys=True, indent=4 ))
@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+check_status -- The zerotier status probe reports zerotier-cli's info, its freshness, and its failures
+
+Puts a stub zerotier-cli first on the PATH, and confirms that the status reports its info fields
+and the probe's freshness; that the result is cached for the probe's TTL (the stub is not run
+again 'til stale); and that a failing stub, or one hanging past the 0.5s deadline, is reported
+(as an error, or pending) while the last info is retained:
+
+    python3 bench/check_status.py
+"""
+
+import functools
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.api import status_probes, status_report
+from admin_webpy.status_util import probe, prober, zerotier_info
+
+info				= dict(
+    address		= "9c0ffee123",
+    online		= True,
+    planetWorldId	= 149604618,
+    version		= "1.4.6",
+)
+
+# Runs as zerotier-cli; appends each run to runs.log, and behaves as directed by mode: ok, fail, hang
+stub				= f"""#! {sys.executable}
+import json, os, sys, time
+here = os.path.dirname( os.path.abspath( __file__ ))
+open( os.path.join( here, "runs.log" ), "a" ).write( " ".join( sys.argv[1:] ) + "\\n" )
+mode = open( os.path.join( here, "mode" )).read().strip()
+if mode == "fail":
+    sys.stderr.write( "zerotier-cli: missing port and zerotier-one.port not found\\n" )
+    sys.exit( 1 )
+if mode == "hang":
+    time.sleep( 30 )
+print( {json.dumps( json.dumps( info ))} )
+"""
+
+
+def check( ttl=1.0, deadline=0.5, timeout=1.5 ):
+    tmp				= tempfile.mkdtemp()
+    path			= os.environ.get( 'PATH', '' )
+    def mode( how ):
+        with open( os.path.join( tmp, "mode" ), "w" ) as f:
+            f.write( how )
+    def runs():
+        try:
+            with open( os.path.join( tmp, "runs.log" )) as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+    try:
+        cli			= os.path.join( tmp, "zerotier-cli" )
+        with open( cli, "w" ) as f:
+            f.write( stub )
+        os.chmod( cli, os.stat( cli ).st_mode | stat.S_IXUSR )
+        os.environ['PATH']	= tmp + os.pathsep + path
+        mode( "ok" )
+
+        zerotier		= probe( "zerotier", functools.partial( zerotier_info, timeout=timeout ), ttl=ttl )
+        # The server's other probes, w/ a zerotier probe timing out (and going stale) sooner
+        probes			= prober( [ p for p in status_probes.probes if p.name != "zerotier" ] + [ zerotier ],
+                                  deadline=deadline )
+
+        # The info fields, and a fresh report
+        status			= status_report( probes.harvest() )
+        report			= status['probes']['zerotier']
+        assert status['zerotier'] == info, \
+            f"Expected zerotier info {info}: {status['zerotier']}"
+        assert runs() == [ "-j info" ], \
+            f"Expected one run of zerotier-cli -j info: {runs()}"
+        assert report['error'] is None and not report['pending'] and not report['stale'] and report['age'] < ttl, \
+            f"Expected a fresh zerotier report: {report}"
+
+        # Cached 'til stale (after the TTL); then, run again
+        status			= status_report( probes.harvest() )
+        assert len( runs() ) == 1 and status['zerotier'] == info, \
+            f"Expected zerotier-cli not run again within the TTL: {runs()}"
+        time.sleep( ttl )
+        _,report		= zerotier.report()
+        assert report['stale'] and report['age'] >= ttl, \
+            f"Expected a stale zerotier report after the TTL: {report}"
+        status			= status_report( probes.harvest() )
+        assert len( runs() ) == 2 and not status['probes']['zerotier']['stale'], \
+            f"Expected zerotier-cli run again once stale: {runs()}"
+
+        # A failure is reported as an error; the last info is retained
+        mode( "fail" )
+        status			= status_report( probes.harvest( force=True ))
+        report			= status['probes']['zerotier']
+        assert report['error'] and "exit status 1" in report['error'] and not report['pending'], \
+            f"Expected a zerotier-cli failure reported: {report}"
+        assert status['zerotier'] == info, \
+            f"Expected the last zerotier info retained after a failure: {status['zerotier']}"
+
+        # A hang is reported as pending at the deadline, and as an error once it times out
+        mode( "hang" )
+        begun			= time.monotonic()
+        status			= status_report( probes.harvest( force=True ))
+        waited			= time.monotonic() - begun
+        report			= status['probes']['zerotier']
+        assert waited < deadline + .25 and report['pending'], \
+            f"Expected a hung zerotier-cli pending at the {deadline}s deadline (after {waited:.3f}s): {report}"
+        assert status['zerotier'] == info, \
+            f"Expected the last zerotier info retained while hung: {status['zerotier']}"
+        while zerotier.report()[1]['pending'] and time.monotonic() - begun < timeout + 5:
+            time.sleep( .05 )
+        _,report		= zerotier.report()
+        assert report['error'] and "timed out" in report['error'] and not report['pending'], \
+            f"Expected a hung zerotier-cli reported timed out: {report}"
+
+        # Recovers once zerotier-cli succeeds again
+        mode( "ok" )
+        status			= status_report( probes.harvest( force=True ))
+        assert status['zerotier'] == info and status['probes']['zerotier']['error'] is None, \
+            f"Expected the zerotier probe recovered: {status['probes']['zerotier']}"
+        return dict(
+            runs		= len( runs() ),
+            hung_harvest_ms	= waited * 1000,
+        )
+    finally:
+        os.environ['PATH']	= path
+        shutil.rmtree( tmp )
+
+
+if __name__ == "__main__":
+    print( json.dumps( check(), sort_keys=True, indent=4 ))
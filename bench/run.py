@@ -0,0 +1,116 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+run -- Run the benchmark suite, and save the results as JSON, for comparison between commits
+
+The microbenchmarks (bench_micro), the end-to-end load test (bench_load) and the startup time
+(bench_startup) are run, and the results saved to bench/results/<commit>.json (w/ a "-dirty"
+suffix, if the tree is modified).  If a --compare baseline results file (or commit) is supplied,
+each result's change is reported:
+
+    make bench
+    python3 bench/run.py --compare 4b012ff
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, here )
+
+import bench_load
+import bench_micro
+import bench_startup
+
+
+def commit():
+    try:
+        rev			= subprocess.check_output(
+            [ "git", "rev-parse", "--short", "HEAD" ], cwd=here, stderr=subprocess.DEVNULL ).decode().strip()
+        dirty			= subprocess.call(
+            [ "git", "diff", "--quiet", "HEAD", "--", "../admin_webpy" ], cwd=here, stderr=subprocess.DEVNULL )
+        return rev + ( "-dirty" if dirty else "" )
+    except Exception:
+        return "unknown"
+
+
+def flatten( results, prefix="" ):
+    """The numeric results, as {"a.b.c": <value>}."""
+    flat			= {}
+    for key,value in results.items():
+        if isinstance( value, dict ):
+            flat.update( flatten( value, prefix + key + "." ))
+        elif isinstance( value, ( int, float )) and not isinstance( value, bool ):
+            flat[prefix + key]	= value
+    return flat
+
+
+def compare( baseline, results ):
+    """Report the % change of every result present in both.  Latencies (usec, _ms) are better
+    lower; throughputs (_per_sec) better higher."""
+    before,after		= flatten( baseline ),flatten( results )
+    for key in sorted( set( before ) & set( after )):
+        if not before[key]:
+            continue
+        change			= ( after[key] - before[key] ) / before[key] * 100
+        worse			= change < 0 if key.endswith( "_per_sec" ) else change > 0
+        flag			= " !" if worse and abs( change ) > 10 else ""
+        print( f"{key:60} {before[key]:12.3f} {after[key]:12.3f} {change:+7.1f}%{flag}" )
+
+
+def main( argv=None ):
+    ap				= argparse.ArgumentParser( description="Run the hpos-admin-server benchmarks" )
+    ap.add_argument( '--output', default=None,
+                     help="Results file (default: bench/results/<commit>.json)" )
+    ap.add_argument( '--compare', default=None,
+                     help="Baseline results file (or commit, in bench/results/) to compare against" )
+    ap.add_argument( '--requests', default=500, type=int,
+                     help="Load test requests per client (default: 500)" )
+    args			= ap.parse_args( argv )
+
+    baseline			= None
+    if args.compare:
+        path			= args.compare
+        if not os.path.exists( path ):
+            path		= os.path.join( here, "results", path + ".json" )
+        with open( path ) as f:
+            baseline		= json.loads( f.read() )
+
+    results			= dict(
+        commit			= commit(),
+        timestamp		= time.time(),
+        python			= platform.python_version(),
+        micro			= bench_micro.bench(),
+    )
+    results['load']		= bench_load.bench( requests=args.requests )
+    results['startup']		= bench_startup.bench()
+
+    output			= args.output or os.path.join( here, "results", results['commit'] + ".json" )
+    os.makedirs( os.path.dirname( os.path.abspath( output )), exist_ok=True )
+    with open( output, 'w' ) as f:
+        f.write( json.dumps( results, sort_keys=True, indent=4 ) + "\n" )
+    print( f"Saved {output}" )
+
+    if baseline:
+        compare( baseline, results )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
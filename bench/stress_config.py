@@ -0,0 +1,115 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+stress_config -- Many parallel clients PATCHing /api/v1/config; confirms a consistent, coalesced file
+
+Serves a temporary copy of test/data (via a symlinked holo-config.json, as in production), w/o the
+config endpoint's admission limit (as w/ --limit config=-1), so every PATCH reaches the store:
+
+    python3 bench/stress_config.py
+"""
+
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.api import holo_config, route_admission
+from admin_webpy.server import api_urls, wsgi_app
+from admin_webpy.wsgi_util import servers
+
+from bench_servers import free_port, wait_listening
+
+
+def stress( clients=32, patches=50 ):
+    tmp				= tempfile.mkdtemp()
+    # Stress the config store, not admission control; otherwise, most PATCHes are refused w/ 503
+    limit			= route_admission.limits.pop( 'config', None )
+    try:
+        os.makedirs( os.path.join( tmp, "data" ))
+        shutil.copy( os.path.join( os.path.dirname( here ), "test", "data", "holo-config.json" ),
+                     os.path.join( tmp, "holo-config.json" ))
+        os.symlink( "../holo-config.json", os.path.join( tmp, "data", "holo-config.json" ))
+        os.chdir( tmp )
+
+        address			= ( '127.0.0.1', free_port() )
+        backend			= servers['threadpool']( wsgi_app( api_urls() ), address, threads=clients,
+                                                 backlog=clients )
+        server			= threading.Thread( target=backend.serve_forever, daemon=True )
+        server.start()
+        wait_listening( address )
+
+        versions		= []
+        failures		= []
+        errors			= []	# Any client failing (eg. w/ a connection error), and why
+        lock			= threading.Lock()
+        def client( n ):
+            try:
+                conn		= http.client.HTTPConnection( *address, timeout=10 )
+                for i in range( patches ):
+                    body	= json.dumps( dict( admin = dict( name = f"client {n} patch {i}" )))
+                    conn.request( "PATCH", "/api/v1/config", body=body,
+                                  headers={ 'Content-Type': 'application/json' } )
+                    response	= conn.getresponse()
+                    result	= response.read()
+                    with lock:
+                        if response.status == 200:
+                            versions.append( json.loads( result )['version'] )
+                        else:
+                            failures.append( ( response.status, result ))
+            except Exception as exc:
+                with lock:
+                    errors.append( ( n, repr( exc )))
+        threads			= [ threading.Thread( target=client, args=( n, )) for n in range( clients ) ]
+        begun			= time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed			= time.time() - begun
+        backend.shutdown()
+
+        holo_config.flush()
+        with open( "holo-config.json" ) as f:
+            written		= json.loads( f.read() )
+        assert not errors, \
+            f"{len( errors )} clients failed: {errors[:3]}"
+        assert not failures, \
+            f"{len( failures )} PATCHes failed: {failures[:3]}"
+        assert sorted( versions ) == list( range( 1, clients * patches + 1 )), \
+            "PATCH versions were not unique, and sequential"
+        assert written == holo_config.config(), \
+            f"File contents {written} differ from in-memory config"
+        assert os.path.islink( os.path.join( "data", "holo-config.json" )), \
+            "The holo-config.json symlink was replaced"
+        return dict(
+            patches		= len( versions ),
+            writes		= holo_config.writes,
+            patches_per_sec	= len( versions ) / elapsed,
+        )
+    finally:
+        if limit is not None:
+            route_admission.limits['config'] = limit
+        shutil.rmtree( tmp )
+
+
+if __name__ == "__main__":
+    print( json.dumps( stress(), sort_keys=True, indent=4 ))
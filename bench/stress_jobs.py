@@ -0,0 +1,153 @@
+#! /usr/bin/env python3
+
+#
+# hpos-admin-server -- Perform authenticated HoloPortOS administrative actions
+#
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry.kundert@holo.host"
+__copyright__                   = "Copyright (c) 2019 Holo Ltd."
+__license__                     = "GPLv3 (or later)"
+
+"""
+stress_jobs -- Rapid holoportos config toggles via PATCH /api/v1/config; confirms one rebuild, of the final state
+
+Serves a temporary data/ directory, w/ a fake rebuild command recording each state it is run to
+apply.  Then, toggles alternately via two job queues sharing a jobs directory and holoportos.json
+(as do the server's --workers), and confirms that still only one rebuild runs:
+
+    python3 bench/stress_jobs.py
+"""
+
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+here				= os.path.abspath( os.path.dirname( __file__ ))
+sys.path.insert( 0, os.path.dirname( here ))
+
+from admin_webpy.api import holoportos_jobs
+from admin_webpy.nix_util import holoportos, job_queue, rebuild
+from admin_webpy.server import api_urls, wsgi_app
+from admin_webpy.wsgi_util import servers
+
+from bench_servers import free_port, wait_listening
+
+# Appends the (compact) state being applied to runs.log, as one line
+fake_rebuild			= ( sys.executable, "-c",
+    "import json, os; open( 'runs.log', 'a' ).write("
+    " json.dumps( json.load( open( os.environ['HOLOPORTOS_STATE'] ))) + '\\n' )" )
+
+
+def stress( toggles=( "dev", "test", "live" ), settle=0.5 ):
+    tmp				= tempfile.mkdtemp()
+    cwd				= os.getcwd()
+    try:
+        os.makedirs( os.path.join( tmp, "data" ))
+        shutil.copy( os.path.join( os.path.dirname( here ), "test", "data", "holo-config.json" ),
+                     os.path.join( tmp, "data", "holo-config.json" ))
+        os.chdir( tmp )
+        holoportos_jobs.run.command = fake_rebuild
+        holoportos_jobs.settle	= settle
+
+        address			= ( '127.0.0.1', free_port() )
+        backend			= servers['threadpool']( wsgi_app( api_urls() ), address )
+        server			= threading.Thread( target=backend.serve_forever, daemon=True )
+        server.start()
+        wait_listening( address )
+
+        conn			= http.client.HTTPConnection( *address, timeout=10 )
+        idents			= []
+        for network in toggles:
+            conn.request( "PATCH", "/api/v1/config", body=json.dumps( dict( holoportos = dict( network = network ))),
+                          headers={ 'Content-Type': 'application/json' } )
+            response		= conn.getresponse()
+            result		= json.loads( response.read() )
+            assert response.status == 200, \
+                f"PATCH network {network} failed: {result}"
+            idents.append( result['job'] )
+
+        deadline		= time.time() + settle + 10
+        while time.time() < deadline:
+            conn.request( "GET", "/api/v1/jobs" )
+            jobs		= json.loads( conn.getresponse().read() )
+            if jobs and all( j['status'] in ( "succeeded", "failed" ) for j in jobs ):
+                break
+            time.sleep( .1 )
+        backend.shutdown()
+
+        with open( "runs.log" ) as f:
+            runs		= [ json.loads( line ) for line in f ]
+        assert len( set( idents )) == 1, \
+            f"Toggles were not coalesced into one job: {idents}"
+        assert len( jobs ) == 1 and jobs[0]['requests'] == len( toggles ) and jobs[0]['status'] == "succeeded", \
+            f"Expected one succeeded job of {len( toggles )} requests: {jobs}"
+        assert len( runs ) == 1 and runs[0]['network'] == toggles[-1], \
+            f"Expected exactly one rebuild, of network {toggles[-1]}: {runs}"
+        return dict(
+            toggles		= len( toggles ),
+            jobs		= len( jobs ),
+            rebuilds		= len( runs ),
+            applied		= runs[0],
+        )
+    finally:
+        os.chdir( cwd )
+        shutil.rmtree( tmp )
+
+
+def stress_shared( toggles=( "dev", "test", "live", "dev" ), workers=2, settle=0.5 ):
+    tmp				= tempfile.mkdtemp()
+    cwd				= os.getcwd()
+    try:
+        os.makedirs( os.path.join( tmp, "data" ))
+        os.chdir( tmp )
+        states,queues		= [],[]
+        for _ in range( workers ):
+            state		= holoportos( "data/holoportos.json" )
+            state.shared	= True
+            queue		= job_queue( rebuild( state, command=fake_rebuild ), settle=settle )
+            queue.share( "data/jobs" )
+            states.append( state )
+            queues.append( queue )
+
+        idents			= []
+        for i,network in enumerate( toggles ):
+            states[i % workers].update( dict( network = network ))
+            idents.append( queues[i % workers].submit( "holoportos", states[i % workers].state() ).ident )
+
+        deadline		= time.time() + settle + 10
+        while time.time() < deadline:
+            jobs		= queues[0].jobs()
+            if len( jobs ) == workers and all( j.report()['status'] in ( "succeeded", "failed" ) for j in jobs ):
+                break
+            time.sleep( .1 )
+
+        with open( "runs.log" ) as f:
+            runs		= [ json.loads( line ) for line in f ]
+        reports			= [ j.report() for j in jobs ]
+        assert len( set( idents )) == workers, \
+            f"Expected each worker's toggles coalesced into one job: {idents}"
+        assert len( reports ) == workers and all( r['status'] == "succeeded" for r in reports ), \
+            f"Expected {workers} succeeded jobs: {reports}"
+        assert len( runs ) == 1 and runs[0]['network'] == toggles[-1], \
+            f"Expected exactly one rebuild (across {workers} workers), of network {toggles[-1]}: {runs}"
+        return dict(
+            toggles		= len( toggles ),
+            jobs		= len( reports ),
+            rebuilds		= len( runs ),
+            applied		= runs[0],
+        )
+    finally:
+        os.chdir( cwd )
+        shutil.rmtree( tmp )
+
+
+if __name__ == "__main__":
+    print( json.dumps( dict( single = stress(), shared = stress_shared() ), sort_keys=True, indent=4 ))